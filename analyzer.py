@@ -3,55 +3,28 @@ Source Analysis Engine - Phase 1
 Extracts narrative DNA from source material.
 """
 
-from typing import Optional
+import asyncio
+import atexit
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import asdict, replace
+from typing import Iterator, List, Optional, Tuple, Union
 
-from config import SAVE_THE_CAT_BEATS
+import numpy as np
+
+from config import SAVE_THE_CAT_BEATS, SAVE_THE_CAT_BEATS_BY_NAME
 from models import (
     SourceAnalysis, Character, PlotBeat, Conflict
 )
-from llm_client import LLMClient
+from llm_client import LLMClient, JSONArrayStreamParser, count_tokens, object_schema, split_by_tokens
+from cache import DiskCache, SemanticCache, cache_key
 
 
-class SourceAnalyzer:
-    """Analyzes source narratives to extract structural elements."""
-    
-    def __init__(self, model: Optional[str] = None):
-        """Initialize analyzer with LLM client."""
-        self.llm = LLMClient(model=model, json_mode=True)
-    
-    def analyze(self, source_text: str, source_title: str) -> SourceAnalysis:
-        """
-        Extract narrative structure from source material.
-        
-        Args:
-            source_text: The text to analyze
-            source_title: Title of the source work
-            
-        Returns:
-            SourceAnalysis object with extracted elements
-        """
-        print(f"📖 Analyzing '{source_title}'...")
-        
-        # Create analysis prompt
-        prompt = self._create_analysis_prompt(source_text, source_title)
-        
-        # Call LLM
-        response_text = self._call_llm(prompt)
-        
-        # Parse response
-        analysis = self._parse_analysis(response_text, source_title)
-        
-        print(f"✅ Analysis complete: {len(analysis.characters)} characters, {len(analysis.beats)} beats")
-        return analysis
-    
-    def _create_analysis_prompt(self, source_text: str, source_title: str) -> str:
-        """Create the analysis prompt with structured output format."""
-        
-        prompt = f"""You are a narrative structure analyst. Analyze the following text systematically and extract its narrative DNA.
+ANALYSIS_SYSTEM_PROMPT = "You are a narrative analysis expert. Always respond with valid JSON."
 
-SOURCE: {source_title}
-TEXT:
-{source_text[:8000]}  
+# Static prompt sections come first so providers can cache the shared prefix;
+# only the source title and text vary between calls.
+ANALYSIS_INSTRUCTIONS = """You are a narrative structure analyst. Analyze the text provided at the end systematically and extract its narrative DNA.
 
 TASK: Perform a comprehensive narrative analysis following these steps:
 
@@ -91,105 +64,441 @@ STEP 6: SETTING AND TONE
 STEP 7: CENTRAL QUESTION
 What is the central dramatic question this narrative asks?
 
-OUTPUT FORMAT:
+"""
+
+ANALYSIS_SCHEMA = """OUTPUT FORMAT:
 Provide your analysis as a JSON object with this EXACT structure:
 
-{{
+{
   "characters": [
-    {{
+    {
       "name": "Character Name",
       "role": "hero/mentor/villain/etc",
       "traits": ["trait1", "trait2", "trait3"],
       "desires": ["desire1", "desire2"],
       "fears": ["fear1", "fear2"],
       "arc": "description of character transformation"
-    }}
+    }
   ],
   "themes": ["theme1", "theme2", "theme3"],
   "beats": [
-    {{
+    {
       "name": "Opening Image",
       "source_events": ["event1", "event2"]
-    }}
+    }
   ],
   "conflicts": [
-    {{
+    {
       "type": "internal/external/interpersonal",
       "description": "conflict description",
       "parties": ["party1", "party2"]
-    }}
+    }
+  ],
+  "symbols": [
+    {"symbol": "symbol1", "meaning": "meaning1"},
+    {"symbol": "symbol2", "meaning": "meaning2"}
   ],
-  "symbols": {{
-    "symbol1": "meaning1",
-    "symbol2": "meaning2"
-  }},
   "setting": "setting description",
   "tone": "tone description",
   "central_question": "the central dramatic question"
-}}
+}
 
-IMPORTANT:
+"""
+
+ANALYSIS_RULES = """IMPORTANT:
 - Output ONLY valid JSON, no other text
 - No markdown formatting or code blocks
 - Be thorough but concise
 - Focus on elements that are narratively essential
+"""
+
+ANALYSIS_PREFIX = ANALYSIS_INSTRUCTIONS + ANALYSIS_SCHEMA + ANALYSIS_RULES
+
+# Per-source part of the prompt, appended after ANALYSIS_PREFIX
+ANALYSIS_SOURCE_TEMPLATE = """
+SOURCE: {title}
+TEXT:
+{text}
 
 Begin analysis:"""
+
+# Sources longer than the model's context budget are condensed chunk by chunk
+CONDENSE_SYSTEM_PROMPT = "You are a careful literary summarizer."
+CONDENSE_TEMPLATE = """Below is part {part} of {total} of "{title}".
+Summarize it in detail for later narrative analysis. Keep every named character,
+location and significant object, the key events in order, the conflicts, and
+notable symbols or motifs. Do not add commentary.
+
+{text}"""
+
+
+_STRING = {"type": "string"}
+_STRING_LIST = {"type": "array", "items": _STRING}
+
+# Machine-readable form of ANALYSIS_SCHEMA for provider structured outputs
+ANALYSIS_RESPONSE_SCHEMA = {
+    "title": "record_analysis",
+    **object_schema({
+        "characters": {"type": "array", "items": object_schema({
+            "name": _STRING,
+            "role": _STRING,
+            "traits": _STRING_LIST,
+            "desires": _STRING_LIST,
+            "fears": _STRING_LIST,
+            "arc": _STRING
+        })},
+        "themes": _STRING_LIST,
+        "beats": {"type": "array", "items": object_schema({
+            "name": _STRING,
+            "source_events": _STRING_LIST
+        })},
+        "conflicts": {"type": "array", "items": object_schema({
+            "type": _STRING,
+            "description": _STRING,
+            "parties": _STRING_LIST
+        })},
+        "symbols": {"type": "array", "items": object_schema({
+            "symbol": _STRING,
+            "meaning": _STRING
+        })},
+        "setting": _STRING,
+        "tone": _STRING,
+        "central_question": _STRING
+    })
+}
+
+
+# Responses at least this large are parsed in a worker process by analyze_async
+PARSE_IN_PROCESS_MIN_BYTES = 4096
+
+# Each analysis parses a single response, so a couple of workers cover
+# concurrent analyze_async calls without starting one process per core
+PARSE_POOL_WORKERS = 2
+
+# Created on first use so importing the module never spawns workers
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    """Return the shared process pool used to parse large responses (shut down at exit)."""
+    global _parse_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(max_workers=min(PARSE_POOL_WORKERS, os.cpu_count() or 1))
+        atexit.register(_parse_pool.shutdown)
+    return _parse_pool
+
+
+class SourceAnalyzer:
+    """Analyzes source narratives to extract structural elements."""
+    
+    def __init__(self, model: Optional[str] = None):
+        """Initialize analyzer with LLM client and result cache."""
+        # Whole analyses are cached below, so the client keeps no response cache of its own
+        self.llm = LLMClient(model=model, json_mode=True, cache_responses=False)
+        # Plain-text client for condensing overlong sources
+        self.summarizer = LLMClient(model=model, json_mode=False)
+        self.source_token_budget = self._source_token_budget()
+        self.cache = DiskCache("analysis") if self.llm.config.cache_enabled else None
+        self.semantic_cache = None
+        if self.llm.config.cache_enabled and self.llm.config.semantic_cache_enabled:
+            # One index per model so analyses from different models never mix
+            self.semantic_cache = SemanticCache(
+                f"analysis-semantic/{cache_key(self.llm.model)[:16]}", threshold=0.97
+            )
+    
+    def analyze(self, source_text: str, source_title: str) -> SourceAnalysis:
+        """
+        Extract narrative structure from source material.
+        
+        Args:
+            source_text: The text to analyze
+            source_title: Title of the source work
+            
+        Returns:
+            SourceAnalysis object with extracted elements
+        """
+        print(f"📖 Analyzing '{source_title}'...")
+        
+        # Create analysis prompt
+        prompt = self._create_analysis_prompt(source_text, source_title)
+        
+        # Reuse a previous analysis when possible
+        analysis, key, vector = self._lookup_cache(prompt, source_text, source_title)
+        if analysis is not None:
+            return analysis
+        
+        # Fit the source into the model's context window
+        prompt = self._create_analysis_prompt(self._fit_source(source_text, source_title), source_title)
+        
+        # Call LLM
+        response_text = self._call_llm(prompt)
+        
+        # Parse response
+        analysis = self._parse_analysis(response_text, source_title)
+        self._store_cache(key, vector, response_text, analysis)
+        
+        print(f"✅ Analysis complete: {len(analysis.characters)} characters, {len(analysis.beats)} beats")
+        return analysis
+    
+    def analyze_stream(
+        self,
+        source_text: str,
+        source_title: str
+    ) -> Iterator[Union[Character, PlotBeat, Conflict, SourceAnalysis]]:
+        """
+        Stream the analysis: yield each Character, PlotBeat and Conflict as soon
+        as it is complete in the response, then the full SourceAnalysis last.
         
-        return prompt
+        Args:
+            source_text: The text to analyze
+            source_title: Title of the source work
+            
+        Yields:
+            Partial elements, followed by the complete SourceAnalysis
+        """
+        print(f"📖 Analyzing '{source_title}' (streaming)...")
+        
+        prompt = self._create_analysis_prompt(source_text, source_title)
+        
+        analysis, key, vector = self._lookup_cache(prompt, source_text, source_title)
+        if analysis is not None:
+            yield from analysis.characters
+            yield from analysis.beats
+            yield from analysis.conflicts
+            yield analysis
+            return
+        
+        prompt = self._create_analysis_prompt(self._fit_source(source_text, source_title), source_title)
+        
+        parser = JSONArrayStreamParser(("characters", "beats", "conflicts"))
+        chunks = []
+        beat_count = 0
+        for chunk in self.llm.stream(
+            prompt=prompt,
+            system_prompt=ANALYSIS_SYSTEM_PROMPT,
+            cacheable_prefix=ANALYSIS_PREFIX
+        ):
+            chunks.append(chunk)
+            for field_name, item in parser.feed(chunk):
+                try:
+                    if field_name == "characters":
+                        yield self._parse_character(item)
+                    elif field_name == "beats":
+                        yield self._parse_beat(beat_count, item)
+                        beat_count += 1
+                    else:
+                        yield self._parse_conflict(item)
+                except KeyError:
+                    continue  # Incomplete element; the final parse decides
+        
+        response_text = "".join(chunks)
+        analysis = self._parse_analysis(response_text, source_title)
+        self._store_cache(key, vector, response_text, analysis)
+        
+        print(f"✅ Analysis complete: {len(analysis.characters)} characters, {len(analysis.beats)} beats")
+        yield analysis
+    
+    async def analyze_async(self, source_text: str, source_title: str) -> SourceAnalysis:
+        """
+        Async variant of analyze() for use inside an event loop.
+        
+        Args:
+            source_text: The text to analyze
+            source_title: Title of the source work
+            
+        Returns:
+            SourceAnalysis object with extracted elements
+        """
+        print(f"📖 Analyzing '{source_title}'...")
+        
+        prompt = self._create_analysis_prompt(source_text, source_title)
+        
+        analysis, key, vector = self._lookup_cache(prompt, source_text, source_title)
+        if analysis is not None:
+            return analysis
+        
+        # Token counting (and condensing, if needed) runs off the event loop
+        fitted_text = await asyncio.to_thread(self._fit_source, source_text, source_title)
+        prompt = self._create_analysis_prompt(fitted_text, source_title)
+        
+        response_text = await self.llm.acall(
+            prompt=prompt,
+            system_prompt=ANALYSIS_SYSTEM_PROMPT,
+            cacheable_prefix=ANALYSIS_PREFIX,
+            response_schema=ANALYSIS_RESPONSE_SCHEMA
+        )
+        
+        if len(response_text) >= PARSE_IN_PROCESS_MIN_BYTES:
+            # Keep the event loop free to drive other requests while parsing
+            analysis = await asyncio.get_running_loop().run_in_executor(
+                _get_parse_pool(), SourceAnalyzer._parse_analysis, response_text, source_title
+            )
+        else:
+            analysis = self._parse_analysis(response_text, source_title)
+        self._store_cache(key, vector, response_text, analysis)
+        
+        print(f"✅ Analysis complete: {len(analysis.characters)} characters, {len(analysis.beats)} beats")
+        return analysis
+    
+    async def analyze_many_async(self, sources: List[Tuple[str, str]]) -> List[SourceAnalysis]:
+        """
+        Analyze several source works concurrently on the running event loop.
+        
+        Args:
+            sources: (source_text, source_title) pairs
+            
+        Returns:
+            SourceAnalysis objects in the same order as sources
+        """
+        return list(await asyncio.gather(
+            *(self.analyze_async(text, title) for text, title in sources)
+        ))
+    
+    def _lookup_cache(
+        self,
+        prompt: str,
+        source_text: str,
+        source_title: str
+    ) -> Tuple[Optional[SourceAnalysis], str, Optional[np.ndarray]]:
+        """
+        Check the exact and semantic caches.
+        
+        Returns:
+            (cached analysis or None, exact cache key, embedding for semantic cache or None)
+        """
+        # Reuse a previous analysis of the identical request
+        key = cache_key(self.llm.model, ANALYSIS_SYSTEM_PROMPT, ANALYSIS_PREFIX, prompt)
+        cached = self.cache.get(key) if self.cache else None
+        if cached is not None:
+            analysis = SourceAnalysis.from_dict(cached["analysis"])
+            print(f"⚡ Loaded cached analysis: {len(analysis.characters)} characters, {len(analysis.beats)} beats")
+            return analysis, key, None
+        
+        # Fall back to a near-duplicate source analyzed before
+        vector = self.semantic_cache.embed(source_text[:8000]) if self.semantic_cache else None
+        if vector is not None:
+            similar = self.semantic_cache.lookup(vector)
+            if similar is not None:
+                analysis = replace(SourceAnalysis.from_dict(similar), title=source_title)
+                print(f"⚡ Reused analysis of similar source '{similar['title']}'")
+                return analysis, key, vector
+        
+        return None, key, vector
+    
+    def _store_cache(
+        self,
+        key: str,
+        vector: Optional[np.ndarray],
+        response_text: str,
+        analysis: SourceAnalysis
+    ):
+        """Record a fresh analysis in the exact and semantic caches."""
+        if self.cache:
+            self.cache.set(key, {"response": response_text, "analysis": asdict(analysis)})
+        if vector is not None:
+            self.semantic_cache.add(vector, asdict(analysis))
+    
+    def analyze_many(self, sources: List[Tuple[str, str]]) -> List[SourceAnalysis]:
+        """
+        Analyze several source works concurrently.
+        
+        Args:
+            sources: (source_text, source_title) pairs
+            
+        Returns:
+            SourceAnalysis objects in the same order as sources
+        """
+        if not sources:
+            return []
+        
+        workers = min(len(sources), self.llm.config.max_concurrent)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda src: self.analyze(*src), sources))
+    
+    def _create_analysis_prompt(self, source_text: str, source_title: str) -> str:
+        """Create the per-source part of the prompt; it follows ANALYSIS_PREFIX."""
+        return ANALYSIS_SOURCE_TEMPLATE.format(title=source_title, text=source_text)
+    
+    def _source_token_budget(self) -> int:
+        """Tokens left for source text after the fixed prompt and the response."""
+        fixed_prompt = ANALYSIS_SYSTEM_PROMPT + ANALYSIS_PREFIX + ANALYSIS_SOURCE_TEMPLATE.format(title="", text="")
+        overhead = count_tokens(fixed_prompt, self.llm.model) + 64  # Allowance for the title
+        budget = (
+            self.llm.config.get_context_window(self.llm.model)
+            - self.llm.config.max_tokens
+            - overhead
+        )
+        return max(budget, 1024)
+    
+    def _fit_source(self, source_text: str, source_title: str) -> str:
+        """
+        Return source_text unchanged if it fits the token budget, otherwise a
+        condensed version produced by map-reduce summarization.
+        
+        Args:
+            source_text: The full source text
+            source_title: Title of the source work
+            
+        Returns:
+            Text of at most source_token_budget tokens (approximately, without tiktoken)
+        """
+        budget = self.source_token_budget
+        model = self.llm.model
+        
+        # Each pass summarizes budget-sized chunks in parallel; repeat while still too long
+        for _ in range(3):
+            if count_tokens(source_text, model) <= budget:
+                return source_text
+            chunks = split_by_tokens(source_text, budget, model)
+            print(f"  📚 Condensing '{source_title}' ({len(chunks)} chunks) to fit the context window...")
+            summary_tokens = min(self.summarizer.config.max_tokens, max(budget // len(chunks), 256))
+            
+            def summarize(numbered_chunk: Tuple[int, str]) -> str:
+                part, chunk = numbered_chunk
+                return self.summarizer.call(
+                    prompt=CONDENSE_TEMPLATE.format(
+                        part=part, total=len(chunks), title=source_title, text=chunk
+                    ),
+                    system_prompt=CONDENSE_SYSTEM_PROMPT,
+                    max_tokens=summary_tokens
+                )
+            
+            workers = min(len(chunks), self.summarizer.config.max_concurrent)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                summaries = list(executor.map(summarize, enumerate(chunks, 1)))
+            source_text = "\n\n".join(summaries)
+        
+        # Summaries refused to shrink enough; keep the leading budget
+        return split_by_tokens(source_text, budget, model)[0]
     
     def _call_llm(self, prompt: str) -> str:
         """Call LLM using centralized client with retry logic."""
         return self.llm.call(
             prompt=prompt,
-            system_prompt="You are a narrative analysis expert. Always respond with valid JSON."
+            system_prompt=ANALYSIS_SYSTEM_PROMPT,
+            cacheable_prefix=ANALYSIS_PREFIX,
+            response_schema=ANALYSIS_RESPONSE_SCHEMA
         )
     
-    def _parse_analysis(self, response_text: str, title: str) -> SourceAnalysis:
-        """Parse LLM response into SourceAnalysis object."""
+    @staticmethod
+    def _parse_analysis(response_text: str, title: str) -> SourceAnalysis:
+        """
+        Parse LLM response into SourceAnalysis object.
+        
+        Static (and so picklable by name) so it can run in a worker process.
+        """
         # Use centralized JSON parsing
         data = LLMClient.parse_json_response(response_text)
         
-        # Parse characters
-        characters = []
-        for char_data in data.get("characters", []):
-            characters.append(Character(
-                name=char_data["name"],
-                role=char_data["role"],
-                traits=char_data.get("traits", []),
-                desires=char_data.get("desires", []),
-                fears=char_data.get("fears", []),
-                arc=char_data.get("arc", "")
-            ))
-        
-        # Parse beats
-        beats = []
-        beat_data_list = data.get("beats", [])
-        for i, beat_data in enumerate(beat_data_list):
-            # Match to Save the Cat structure
-            beat_name = beat_data["name"]
-            matching_beat = next(
-                (b for b in SAVE_THE_CAT_BEATS if b["name"] == beat_name),
-                SAVE_THE_CAT_BEATS[min(i, len(SAVE_THE_CAT_BEATS)-1)]
-            )
-            
-            beats.append(PlotBeat(
-                index=i,
-                name=beat_name,
-                function=matching_beat["function"],
-                source_events=beat_data.get("source_events", []),
-                target_emotion=matching_beat["target_emotion"],
-                typical_length=matching_beat["typical_length"]
-            ))
-        
-        # Parse conflicts
-        conflicts = []
-        for conf_data in data.get("conflicts", []):
-            conflicts.append(Conflict(
-                type=conf_data["type"],
-                description=conf_data["description"],
-                parties_involved=conf_data.get("parties", [])
-            ))
+        # Parse elements (helpers are shared with the streaming path)
+        characters = [SourceAnalyzer._parse_character(c) for c in data.get("characters", ())]
+        beats = [SourceAnalyzer._parse_beat(i, b) for i, b in enumerate(data.get("beats", ()))]
+        conflicts = [SourceAnalyzer._parse_conflict(c) for c in data.get("conflicts", ())]
+        
+        # Symbols arrive as [{"symbol", "meaning"}] pairs under structured output
+        symbols = data.get("symbols", {})
+        if isinstance(symbols, list):
+            symbols = {s["symbol"]: s.get("meaning", "") for s in symbols}
         
         return SourceAnalysis(
             title=title,
@@ -197,11 +506,49 @@ Begin analysis:"""
             themes=data.get("themes", []),
             beats=beats,
             conflicts=conflicts,
-            symbols=data.get("symbols", {}),
+            symbols=symbols,
             setting=data.get("setting", ""),
             tone=data.get("tone", ""),
             central_question=data.get("central_question", "")
         )
+    
+    @staticmethod
+    def _parse_character(char_data: dict) -> Character:
+        """Build a Character from one parsed "characters" entry."""
+        return Character(
+            name=char_data["name"],
+            role=char_data["role"],
+            traits=char_data.get("traits", []),
+            desires=char_data.get("desires", []),
+            fears=char_data.get("fears", []),
+            arc=char_data.get("arc", "")
+        )
+    
+    @staticmethod
+    def _parse_beat(i: int, beat_data: dict) -> PlotBeat:
+        """Build the i-th PlotBeat, matched to the Save the Cat structure."""
+        beat_name = beat_data["name"]
+        matching_beat = SAVE_THE_CAT_BEATS_BY_NAME.get(beat_name)
+        if matching_beat is None:
+            matching_beat = SAVE_THE_CAT_BEATS[min(i, len(SAVE_THE_CAT_BEATS)-1)]
+        
+        return PlotBeat(
+            index=i,
+            name=beat_name,
+            function=matching_beat["function"],
+            source_events=beat_data.get("source_events", []),
+            target_emotion=matching_beat["target_emotion"],
+            typical_length=matching_beat["typical_length"]
+        )
+    
+    @staticmethod
+    def _parse_conflict(conf_data: dict) -> Conflict:
+        """Build a Conflict from one parsed "conflicts" entry."""
+        return Conflict(
+            type=conf_data["type"],
+            description=conf_data["description"],
+            parties_involved=conf_data.get("parties", [])
+        )
 
 
 # Example usage
@@ -0,0 +1,196 @@
+"""
+Response Cache
+Content-addressed on-disk storage for expensive LLM results.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Optional, Union
+
+import numpy as np
+
+from config import DEFAULT_CONFIG
+
+# Optional faster JSON encoder/decoder; stdlib json is used when it is not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Lazy-loaded sentence-transformers model (optional dependency)
+_embedder = None
+
+
+def json_loads(text: Union[str, bytes]) -> Any:
+    """Decode JSON with orjson when available (its errors subclass json.JSONDecodeError)."""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def json_dumps(value: Any, indent: bool = False) -> str:
+    """
+    Encode JSON with orjson when available.
+    
+    Args:
+        value: JSON-serializable value
+        indent: Pretty-print with two-space indentation (otherwise compact)
+        
+    Returns:
+        JSON text (non-ASCII characters are kept, not escaped)
+    """
+    if orjson is not None:
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(value, option=option).decode("utf-8")
+    if indent:
+        return json.dumps(value, indent=2, ensure_ascii=False)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def cache_key(*parts: str) -> str:
+    """
+    Build a stable BLAKE2b key from the given string parts.
+
+    Args:
+        parts: Strings that together identify a request (model, prompts, ...)
+
+    Returns:
+        Hex digest usable as a file name
+    """
+    digest = hashlib.blake2b(digest_size=32)
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x1f")  # Separator so ("ab", "c") != ("a", "bc")
+    return digest.hexdigest()
+
+
+def get_embedder():
+    """
+    Return the shared sentence-transformers model, loading it on first use.
+    
+    Returns:
+        SentenceTransformer instance, or None if the package is not installed
+    """
+    global _embedder
+    if _embedder is None:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            return None
+        _embedder = SentenceTransformer(DEFAULT_CONFIG.embedding_model)
+    return _embedder
+
+
+class DiskCache:
+    """Stores JSON-serializable values as one file per key under a namespace directory."""
+
+    def __init__(self, namespace: str, root: Optional[str] = None):
+        """
+        Initialize cache directory.
+
+        Args:
+            namespace: Sub-directory separating unrelated caches (e.g. "analysis")
+            root: Base cache directory (uses config default if None)
+        """
+        self.directory = Path(root or DEFAULT_CONFIG.cache_dir) / namespace
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on miss or unreadable entry."""
+        try:
+            with open(self._path(key), 'rb') as f:
+                return json_loads(f.read())
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def set(self, key: str, value: Any):
+        """Store value under key. Failures are reported but never raised."""
+        path = self._path(key)
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(json_dumps(value))
+            # Atomic rename so concurrent readers never see a partial file
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"  ⚠️  Could not write cache entry: {e}")
+
+
+class SemanticCache:
+    """
+    Similarity-keyed cache: returns a stored value when a new text embeds
+    close enough (cosine) to a previously stored one.
+    """
+
+    def __init__(self, namespace: str, threshold: float = 0.97, root: Optional[str] = None):
+        """
+        Initialize cache and load any persisted entries.
+
+        Args:
+            namespace: Sub-directory separating unrelated caches
+            threshold: Minimum cosine similarity counted as a hit
+            root: Base cache directory (uses config default if None)
+        """
+        # Vectors from different embedding models are not comparable, so each model gets its own index
+        self.directory = (
+            Path(root or DEFAULT_CONFIG.cache_dir) / namespace / cache_key(DEFAULT_CONFIG.embedding_model)[:16]
+        )
+        self.threshold = threshold
+        self.vectors: Optional[np.ndarray] = None  # (N, dim), L2-normalized
+        self.entries: list = []
+        self._lock = threading.Lock()  # Keeps vectors and entries in step across threads
+        self._load()
+
+    def _load(self):
+        try:
+            self.vectors = np.load(self.directory / "vectors.npy")
+            with open(self.directory / "entries.json", 'rb') as f:
+                self.entries = json_loads(f.read())
+        except (OSError, ValueError):
+            self.vectors, self.entries = None, []
+        if self.vectors is not None and (self.vectors.ndim != 2 or len(self.vectors) != len(self.entries)):
+            self.vectors, self.entries = None, []
+
+    def embed(self, text: str) -> Optional[np.ndarray]:
+        """Embed text as a normalized vector, or None if no embedder is available."""
+        embedder = get_embedder()
+        if embedder is None:
+            return None
+        return np.asarray(embedder.encode(text, normalize_embeddings=True), dtype=np.float32)
+
+    def lookup(self, vector: np.ndarray) -> Optional[Any]:
+        """Return the most similar stored value if it clears the threshold."""
+        # add() replaces both together, so this pair is always in step
+        with self._lock:
+            vectors, entries = self.vectors, self.entries
+        # Skip an index built with a different embedding size
+        if vectors is None or not len(vectors) or vectors.shape[1] != vector.shape[-1]:
+            return None
+        sims = vectors @ vector
+        best = int(np.argmax(sims))
+        return entries[best] if sims[best] >= self.threshold else None
+
+    def add(self, vector: np.ndarray, value: Any):
+        """Store value under vector and persist the index."""
+        row = vector.reshape(1, -1)
+        with self._lock:
+            # New objects rather than in-place growth, so a concurrent lookup keeps a consistent pair;
+            # an index of a different embedding size is replaced rather than extended
+            if self.vectors is None or self.vectors.shape[1] != row.shape[1]:
+                self.vectors, self.entries = row, [value]
+            else:
+                self.vectors = np.vstack([self.vectors, row])
+                self.entries = self.entries + [value]
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                np.save(self.directory / "vectors.npy", self.vectors)
+                with open(self.directory / "entries.json", 'w', encoding='utf-8') as f:
+                    f.write(json_dumps(self.entries))
+            except OSError as e:
+                print(f"  ⚠️  Could not write semantic cache: {e}")
@@ -5,13 +5,38 @@ Manages API credentials, model parameters, and genre templates.
 
 import os
 from dataclasses import dataclass, field
-from typing import Dict, List
+from types import MappingProxyType
+from typing import Dict, Tuple
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
 
+# Context windows (tokens) by model-name prefix
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1000000,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "claude": 200000,
+    "gemini": 1000000,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# OpenAI models that accept response_format {"type": "json_schema"} (prefix match);
+# other OpenAI(-compatible) models get plain JSON mode for schema requests
+JSON_SCHEMA_MODELS = ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")
+
+# Smaller, cheaper model per provider for structured rewrite tasks (world mapping)
+MAPPING_MODEL_DEFAULTS = {
+    "openai": "gpt-4o-mini",
+    "anthropic": "claude-3-5-haiku-latest",
+    "gemini": "gemini-1.5-flash",
+}
+
+
 @dataclass
 class ModelConfig:
     """Configuration for LLM API calls."""
@@ -25,16 +50,77 @@ class ModelConfig:
     # Model selection - prioritize based on available keys
     default_model: str = field(default_factory=lambda: os.getenv("DEFAULT_MODEL", "gpt-4-turbo-preview"))
     fallback_model: str = "gpt-3.5-turbo"
+    # Model for world mapping; empty picks MAPPING_MODEL_DEFAULTS for the provider
+    mapping_model: str = field(default_factory=lambda: os.getenv("MAPPING_MODEL", ""))
     
     # Generation parameters
     temperature: float = field(default_factory=lambda: float(os.getenv("TEMPERATURE", "0.7")))
     max_tokens: int = field(default_factory=lambda: int(os.getenv("MAX_TOKENS", "2000")))
+    # Prompt context size in tokens; 0 means look it up from MODEL_CONTEXT_WINDOWS
+    context_window: int = field(default_factory=lambda: int(os.getenv("CONTEXT_WINDOW", "0")))
     top_p: float = field(default_factory=lambda: float(os.getenv("TOP_P", "0.9")))
     
+    # Concurrency
+    max_concurrent: int = field(default_factory=lambda: int(os.getenv("LLM_MAX_CONCURRENCY", "10")))
+    # Async calls adapt between 1 and this ceiling based on rate-limit feedback
+    max_concurrent_ceiling: int = field(default_factory=lambda: int(os.getenv("LLM_MAX_CONCURRENCY_CEILING", "50")))
+    # Request rate cap per provider (0 = unlimited)
+    requests_per_second: float = field(default_factory=lambda: float(os.getenv("LLM_REQUESTS_PER_SECOND", "0")))
+    # Token rate cap per provider and model (prompt + max_tokens per request; 0 = unlimited)
+    tokens_per_minute: int = field(default_factory=lambda: int(os.getenv("LLM_TOKENS_PER_MINUTE", "0")))
+    # Multiplex OpenAI/Anthropic requests over HTTP/2 (used only if the h2 package is installed)
+    http2_enabled: bool = field(default_factory=lambda: os.getenv("HTTP2", "true").lower() == "true")
+    
+    # Response caching
+    cache_enabled: bool = field(default_factory=lambda: os.getenv("CACHE_ENABLED", "true").lower() == "true")
+    cache_dir: str = field(default_factory=lambda: os.getenv(
+        "CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "narrative-transformer")
+    ))
+    semantic_cache_enabled: bool = field(default_factory=lambda: os.getenv("SEMANTIC_CACHE", "false").lower() == "true")
+    semantic_cache_threshold: float = field(default_factory=lambda: float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.90")))
+    embedding_model: str = field(default_factory=lambda: os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2"))
+    
+    # Prompt compression of scene context (requires llmlingua)
+    enable_prompt_compression: bool = field(default_factory=lambda: os.getenv("PROMPT_COMPRESSION", "false").lower() == "true")
+    prompt_compression_rate: float = field(default_factory=lambda: float(os.getenv("PROMPT_COMPRESSION_RATE", "0.33")))
+    compression_model: str = field(default_factory=lambda: os.getenv(
+        "COMPRESSION_MODEL", "microsoft/llmlingua-2-xlm-roberta-large-meetingbank"
+    ))
+    # Stop a streamed scene as soon as a dead character is named in it, and regenerate
+    abort_on_dead_mention: bool = field(default_factory=lambda: os.getenv("ABORT_ON_DEAD_MENTION", "false").lower() == "true")
+    # Pick timeline events/characters for scene prompts by similarity to the beat
+    # (requires sentence-transformers; otherwise the most recent events are used)
+    relevant_context_enabled: bool = field(default_factory=lambda: os.getenv("RELEVANT_CONTEXT", "false").lower() == "true")
+    context_token_budget: int = field(default_factory=lambda: int(os.getenv("CONTEXT_TOKEN_BUDGET", "300")))
+    
     def validate(self) -> bool:
         """Check if at least one API key is configured."""
         return bool(self.openai_api_key or self.anthropic_api_key or self.gemini_api_key)
     
+    def get_context_window(self, model: str) -> int:
+        """Return the context window (tokens) for a model, honoring the CONTEXT_WINDOW override."""
+        if self.context_window:
+            return self.context_window
+        # Longest matching prefix wins ("gpt-4-turbo" over "gpt-4")
+        for prefix in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+            if model.startswith(prefix):
+                return MODEL_CONTEXT_WINDOWS[prefix]
+        return DEFAULT_CONTEXT_WINDOW
+    
+    def supports_json_schema(self, model: str) -> bool:
+        """Whether an OpenAI(-compatible) model accepts json_schema structured outputs."""
+        # Routers such as OpenRouter name models "openai/gpt-4o"
+        return model.rsplit("/", 1)[-1].startswith(JSON_SCHEMA_MODELS)
+    
+    def get_mapping_model(self) -> str:
+        """Return the model used for world mapping."""
+        if self.mapping_model:
+            return self.mapping_model
+        # A custom OpenAI-compatible endpoint may not serve the default small model
+        if self.openai_base_url and self.get_primary_api() == "openai":
+            return self.default_model
+        return MAPPING_MODEL_DEFAULTS.get(self.get_primary_api(), self.default_model)
+    
     def get_primary_api(self) -> str:
         """Return which API to use."""
         if self.gemini_api_key:
@@ -46,44 +132,44 @@ class ModelConfig:
         return None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class GenreTemplate:
-    """Template defining characteristics of a target genre."""
+    """Template defining characteristics of a target genre (immutable)."""
     
     name: str
     tone: str
     technology_level: str
-    naming_conventions: List[str]
-    key_aesthetics: List[str]
-    world_rules: List[str]
+    naming_conventions: Tuple[str, ...]
+    key_aesthetics: Tuple[str, ...]
+    world_rules: Tuple[str, ...]
     style_guidance: str
 
 
-# Genre Templates Library
-GENRE_TEMPLATES = {
+# Genre Templates Library (read-only; copy before modifying)
+GENRE_TEMPLATES = MappingProxyType({
     "cyberpunk": GenreTemplate(
         name="Cyberpunk",
         tone="Dark, gritty, tech-noir with neon aesthetics",
         technology_level="Near-future: AI, neural implants, megacorporations, virtual reality",
-        naming_conventions=[
+        naming_conventions=(
             "Tech-inspired: Neo-, Cyber-, -tron suffixes",
             "Corporate: Corp, Industries, Systems",
             "Shortened/alphanumeric: Rom-30, J-Unit, V-Corp"
-        ],
-        key_aesthetics=[
+        ),
+        key_aesthetics=(
             "Neon-lit urban sprawl",
             "High tech, low life",
             "Corporate dystopia",
             "Augmented humans",
             "Virtual/physical reality blur"
-        ],
-        world_rules=[
+        ),
+        world_rules=(
             "Technology is ubiquitous but creates inequality",
             "Corporations have nation-state power",
             "Privacy is extinct",
             "Human augmentation is common",
             "The digital and physical worlds are intertwined"
-        ],
+        ),
         style_guidance="Use vivid sensory details emphasizing neon, chrome, rain-slicked streets. Include tech jargon naturally. Show class divide through technology access."
     ),
     
@@ -91,25 +177,25 @@ GENRE_TEMPLATES = {
         name="Space Opera",
         tone="Epic, adventurous, galaxy-spanning drama",
         technology_level="Far-future: FTL travel, alien civilizations, energy weapons, terraforming",
-        naming_conventions=[
+        naming_conventions=(
             "Cosmic: Star-, Nova-, Nebula- prefixes",
             "Military ranks: Commander, Admiral, Captain",
             "Alien-sounding: apostrophes, unusual combinations"
-        ],
-        key_aesthetics=[
+        ),
+        key_aesthetics=(
             "Vast starscapes and alien worlds",
             "Massive starships and space stations",
             "Diverse alien species",
             "Ancient alien artifacts",
             "Galactic empires and federations"
-        ],
-        world_rules=[
+        ),
+        world_rules=(
             "Multiple intelligent species coexist",
             "Travel between star systems is routine",
             "Galactic governments span thousands of worlds",
             "Ancient civilizations left powerful artifacts",
             "Technology appears as 'sufficiently advanced magic'"
-        ],
+        ),
         style_guidance="Emphasize scale and grandeur. Use formal, slightly archaic dialogue for gravitas. Describe alien environments with wonder."
     ),
     
@@ -117,25 +203,25 @@ GENRE_TEMPLATES = {
         name="Victorian Gothic",
         tone="Dark, atmospheric, morally complex, repressed",
         technology_level="Victorian era: Steam power, gas lamps, early photography, telegraphs",
-        naming_conventions=[
+        naming_conventions=(
             "Period-appropriate: Lord, Lady, Doctor, Professor",
             "British surnames: -shire, -ford, -worth",
             "Formal titles and honorifics"
-        ],
-        key_aesthetics=[
+        ),
+        key_aesthetics=(
             "Fog-shrouded London streets",
             "Gothic architecture and manor houses",
             "Gas-lit interiors",
             "Strict social hierarchies",
             "Scientific rationalism vs supernatural horror"
-        ],
-        world_rules=[
+        ),
+        world_rules=(
             "Social class is rigid and defining",
             "Reputation is paramount",
             "Science is challenging old beliefs",
             "The supernatural lurks beneath respectability",
             "Gender roles are strictly enforced"
-        ],
+        ),
         style_guidance="Use formal, elaborate language. Emphasize atmosphere through weather and architecture. Explore themes of duality and hidden darkness."
     ),
     
@@ -143,25 +229,25 @@ GENRE_TEMPLATES = {
         name="Post-Apocalyptic",
         tone="Grim, survivalist, desperate hope amid ruins",
         technology_level="Regressed: Scavenged tech, makeshift weapons, lost knowledge",
-        naming_conventions=[
+        naming_conventions=(
             "Descriptive: Rust, Ash, Dust, Steel",
             "Location-based: Vault-dweller, Wastelander",
             "Practical: roles and skills as names"
-        ],
-        key_aesthetics=[
+        ),
+        key_aesthetics=(
             "Ruined cities and wastelands",
             "Makeshift settlements",
             "Scavenged technology",
             "Mutated flora/fauna",
             "Resource scarcity everywhere"
-        ],
-        world_rules=[
+        ),
+        world_rules=(
             "Survival is the primary concern",
             "Pre-apocalypse tech is valuable but rare",
             "Communities are small and isolated",
             "Trust is earned, not given",
             "The old world's mistakes echo in the new"
-        ],
+        ),
         style_guidance="Keep prose lean and immediate. Focus on sensory details of decay. Show resourcefulness and resilience."
     ),
     
@@ -169,32 +255,32 @@ GENRE_TEMPLATES = {
         name="Mythic Fantasy",
         tone="Legendary, archetypal, timeless",
         technology_level="Pre-industrial: Magic, medieval weapons, ancient wisdom",
-        naming_conventions=[
+        naming_conventions=(
             "Archaic-sounding: -iel, -wyn, -or suffixes",
             "Titles: The Wise, The Brave, The Dark",
             "Elemental: Storm-, Fire-, Shadow-"
-        ],
-        key_aesthetics=[
+        ),
+        key_aesthetics=(
             "Enchanted forests and ancient ruins",
             "Magical creatures and beings",
             "Legendary weapons and artifacts",
             "Mystical prophecies",
             "Clear good vs evil (or complex morality)"
-        ],
-        world_rules=[
+        ),
+        world_rules=(
             "Magic follows mysterious but consistent laws",
             "Prophecies and fate play a role",
             "Heroes face trials that test character",
             "Ancient powers can be awakened",
             "Balance must be maintained"
-        ],
+        ),
         style_guidance="Use elevated, poetic language. Emphasize symbolic and archetypal elements. Create sense of timelessness and wonder."
     )
-}
+})
 
 
-# Save the Cat Beat Structure (15-beat version)
-SAVE_THE_CAT_BEATS = [
+# Save the Cat Beat Structure (15-beat version, read-only)
+SAVE_THE_CAT_BEATS = tuple(MappingProxyType(beat) for beat in [
     {
         "name": "Opening Image",
         "function": "Snapshot of protagonist's world before change",
@@ -285,7 +371,11 @@ SAVE_THE_CAT_BEATS = [
         "target_emotion": "satisfaction",
         "typical_length": 250
     }
-]
+])
+
+
+# Name lookup for the beats above
+SAVE_THE_CAT_BEATS_BY_NAME = MappingProxyType({beat["name"]: beat for beat in SAVE_THE_CAT_BEATS})
 
 
 # Default configuration instance
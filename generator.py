@@ -3,24 +3,129 @@ Scene Generation Engine - Phase 4
 Generates individual scenes with full context awareness.
 """
 
+import io
+import json
 import re
-from typing import List, Tuple, Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
 
-from config import GENRE_TEMPLATES
+import numpy as np
+
+from cache import get_embedder
+from config import DEFAULT_CONFIG, GENRE_TEMPLATES
 from models import (
-    SceneOutput, StoryState, WorldMapping, PlotBeat
+    SceneOutput, StateUpdate, StoryState, WorldMapping, PlotBeat
 )
 from tension import TensionAnalyzer
-from llm_client import LLMClient
+from llm_client import LLMClient, count_tokens
+
+
+SCENE_SYSTEM_PROMPT = "You are a creative writer specializing in immersive storytelling."
+
+# Output token limits for one scene and for a multi-scene request
+SCENE_MAX_TOKENS = 1500
+BATCH_MAX_TOKENS = 4096
+
+# Static prompt prefixes kept per generator (one per story being written)
+PREFIX_CACHE_SIZE = 8
+
+# Timeline/character texts whose embeddings are kept per generator (least recently used go first)
+EMBEDDING_CACHE_SIZE = 2048
+
+# Generation stops once the scene's metadata block is closed
+METADATA_END = "</metadata>"
+
+# Emotion labels accepted in scene metadata, mapped to emotional valence
+EMOTION_VALENCE = {"positive": 0.5, "negative": -0.5, "neutral": 0.0}
+
+# Key line of the legacy "FIELD: value" metadata format
+_KEY_RE = re.compile(r"^\s*([A-Z_]+):\s*(.*)$", re.IGNORECASE)
+
+# State-change keywords in STATE_CHANGES metadata
+_DEATH_RE = re.compile(r"\b(?:dies|died|killed|deaths?)\b", re.IGNORECASE)
+_MOVE_RE = re.compile(r"\b(?:moves|travels) to\b", re.IGNORECASE)
+_ITEM_RE = re.compile(r"\b(?:gets|receives|finds)\b", re.IGNORECASE)
+
+# Timeline events shown when context is not ranked by relevance
+RECENT_TIMELINE_EVENTS = 5
+
+# Context shorter than this is sent as-is even with compression enabled
+COMPRESSION_MIN_CHARS = 400
+
+# Lazy-loaded LLMLingua compressor (optional dependency)
+_compressor = None
+
+
+def get_compressor():
+    """
+    Return the shared LLMLingua-2 prompt compressor, loading it on first use.
+    
+    Returns:
+        PromptCompressor instance, or None if llmlingua is not installed
+    """
+    global _compressor
+    if _compressor is None:
+        try:
+            from llmlingua import PromptCompressor
+        except ImportError:
+            return None
+        _compressor = PromptCompressor(model_name=DEFAULT_CONFIG.compression_model, use_llmlingua2=True)
+    return _compressor
+
+
+def compress_context(text: str) -> str:
+    """
+    Shrink prompt context with LLMLingua when prompt compression is enabled.
+    
+    Args:
+        text: Context text (e.g. previous-scene summaries, timeline)
+        
+    Returns:
+        Compressed text, or text unchanged when disabled, short, or unavailable
+    """
+    if not DEFAULT_CONFIG.enable_prompt_compression or len(text) < COMPRESSION_MIN_CHARS:
+        return text
+    compressor = get_compressor()
+    if compressor is None:
+        return text
+    result = compressor.compress_prompt(text, rate=DEFAULT_CONFIG.prompt_compression_rate)
+    return result["compressed_prompt"]
+
+
+@lru_cache(maxsize=32)
+def _names_pattern(names: Tuple[str, ...]) -> "re.Pattern":
+    """Compile one case-insensitive alternation matching any of the given names."""
+    # Longest first so a name is not shadowed by a shorter name it contains
+    alternation = "|".join(re.escape(n) for n in sorted(names, key=len, reverse=True))
+    return re.compile(rf"(?<!\w)(?:{alternation})(?!\w)", re.IGNORECASE)
+
+
+# Scene/metadata blocks of a multi-scene response
+_BATCH_SCENE_RE = re.compile(r'<scene idx="?(\d+)"?>(.*?)</scene>', re.DOTALL)
+_BATCH_METADATA_RE = re.compile(r'<metadata idx="?(\d+)"?>(.*?)</metadata>', re.DOTALL)
 
 
 class SceneGenerator:
     """Generates narrative scenes with context awareness."""
     
-    def __init__(self, model: Optional[str] = None):
-        """Initialize generator with LLM client."""
+    def __init__(self, model: Optional[str] = None, llm: Optional[LLMClient] = None):
+        """
+        Initialize generator with LLM client.
+        
+        Args:
+            model: Model name (uses config default if None)
+            llm: Client to generate with (built from model if None)
+        """
         self.tension_analyzer = TensionAnalyzer()
-        self.llm = LLMClient(model=model, json_mode=False)  # Creative writing, no JSON mode
+        self.llm = llm or LLMClient(model=model, json_mode=False)  # Creative writing, no JSON mode
+        # (genre name, id(world_mapping)) -> (world_mapping, formatted static prefix)
+        self._prefix_cache = {}
+        # Text -> normalized embedding, in least-recently-used order; timeline
+        # events are embedded once as they accrue
+        self._embeddings: Dict[str, np.ndarray] = {}
+        self._embeddings_lock = threading.Lock()
     
     def generate_scene(
         self,
@@ -50,19 +155,30 @@ class SceneGenerator:
         # Get genre template
         genre_template = GENRE_TEMPLATES[world_mapping.genre]
         
-        # Build comprehensive context
-        prompt = self._build_generation_prompt(
+        # Build comprehensive context: shared story prefix + per-beat suffix
+        prefix = self._static_prefix(genre_template, world_mapping)
+        prompt = self._dynamic_suffix(
             beat_info=beat_info,
             genre_template=genre_template,
-            world_mapping=world_mapping,
             story_state=story_state,
             pacing_hint=pacing_hint,
             previous_summary=previous_scenes_summary,
             target_length=target_length
         )
         
-        # Generate scene
-        response_text = self._call_llm(prompt)
+        # Generate scene (streamed, so it can stop right after the metadata)
+        dead = tuple(sorted(n for n, c in story_state.characters.items() if c.status == "dead"))
+        if dead and self.llm.config.abort_on_dead_mention:
+            response_text = self._stream_llm(prompt, prefix, abort_pattern=_names_pattern(dead))
+            if response_text is None:
+                print(f"    ⚠️  Scene named a dead character; regenerating")
+                prompt += (
+                    f"\n\nIMPORTANT: {', '.join(dead)} "
+                    f"{'is' if len(dead) == 1 else 'are'} dead. Do not name them in this scene."
+                )
+                response_text = self._stream_llm(prompt, prefix)
+        else:
+            response_text = self._stream_llm(prompt, prefix)
         
         # Parse output
         scene_output = self._parse_scene_output(
@@ -73,34 +189,280 @@ class SceneGenerator:
         
         return scene_output
     
-    def _build_generation_prompt(
+    def generate_scenes_batch(
         self,
-        beat_info: PlotBeat,
-        genre_template,
+        beats: List[PlotBeat],
         world_mapping: WorldMapping,
         story_state: StoryState,
-        pacing_hint: str,
+        pacing_hints: List[str],
+        previous_scenes_summary: str,
+        target_lengths: List[int],
+        scenes_per_request: int = 1
+    ) -> List[SceneOutput]:
+        """
+        Generate several independent beats concurrently.
+        
+        All prompts are built from the same snapshot of story_state, so the
+        beats must not depend on each other's outcome. Scenes are then
+        validated and their state updates applied to story_state in beat order.
+        
+        Args:
+            beats: Beats to generate, in story order
+            world_mapping: World element mappings
+            story_state: Story state before the first beat (updated in place)
+            pacing_hints: Pacing guidance per beat
+            previous_scenes_summary: Summary of scenes before the first beat
+            target_lengths: Target word count per beat
+            scenes_per_request: Pack up to this many consecutive beats into one
+                request (bounded by BATCH_MAX_TOKENS of output)
+            
+        Returns:
+            SceneOutputs in the same order as beats
+        """
+        genre_template = GENRE_TEMPLATES[world_mapping.genre]
+        prefix = self._static_prefix(genre_template, world_mapping)
+        print(f"  ✍️  Generating {len(beats)} beats in parallel: {', '.join(b.name for b in beats)}...")
+        
+        def request_group(group: List[int]) -> List[str]:
+            return self._request_scenes(
+                [beats[i] for i in group], genre_template, story_state,
+                [pacing_hints[i] for i in group], previous_scenes_summary,
+                [target_lengths[i] for i in group], prefix
+            )
+        
+        groups = self._group_beats(target_lengths, scenes_per_request)
+        parsed = [None] * len(beats)
+        workers = min(len(groups), self.llm.config.max_concurrent) or 1
+        # Separate pools: scenes that already arrived are parsed and NTI-scored
+        # while the remaining requests are still waiting on the network
+        with ThreadPoolExecutor(max_workers=workers) as executor, \
+                ThreadPoolExecutor(max_workers=1) as scorer:
+            futures = {executor.submit(request_group, group): group for group in groups}
+            for future in as_completed(futures):
+                for i, response_text in zip(futures[future], future.result()):
+                    parsed[i] = scorer.submit(self._parse_scene_output, response_text, beats[i], story_state)
+            scenes = [f.result() for f in parsed]
+        
+        return self._fold_batch(beats, scenes, story_state)
+    
+    async def generate_scenes_batch_async(
+        self,
+        beats: List[PlotBeat],
+        world_mapping: WorldMapping,
+        story_state: StoryState,
+        pacing_hints: List[str],
+        previous_scenes_summary: str,
+        target_lengths: List[int]
+    ) -> List[SceneOutput]:
+        """
+        Async variant of generate_scenes_batch(): all requests share the
+        running event loop instead of one thread each.
+        
+        Args:
+            beats: Beats to generate, in story order
+            world_mapping: World element mappings
+            story_state: Story state before the first beat (updated in place)
+            pacing_hints: Pacing guidance per beat
+            previous_scenes_summary: Summary of scenes before the first beat
+            target_lengths: Target word count per beat
+            
+        Returns:
+            SceneOutputs in the same order as beats
+        """
+        genre_template = GENRE_TEMPLATES[world_mapping.genre]
+        prefix = self._static_prefix(genre_template, world_mapping)
+        print(f"  ✍️  Generating {len(beats)} beats in parallel: {', '.join(b.name for b in beats)}...")
+        prompts = [
+            self._fit_prompt(self._dynamic_suffix(
+                beat_info=beat,
+                genre_template=genre_template,
+                story_state=story_state,
+                pacing_hint=hint,
+                previous_summary=previous_scenes_summary,
+                target_length=length
+            ), prefix, SCENE_MAX_TOKENS)
+            for beat, hint, length in zip(beats, pacing_hints, target_lengths)
+        ]
+        responses = await self.llm.acall_many(
+            prompts,
+            system_prompt=SCENE_SYSTEM_PROMPT,
+            cacheable_prefix=prefix,
+            temperature=0.8,
+            max_tokens=SCENE_MAX_TOKENS
+        )
+        scenes = [
+            self._parse_scene_output(response_text, beat, story_state)
+            for beat, response_text in zip(beats, responses)
+        ]
+        return self._fold_batch(beats, scenes, story_state)
+    
+    @staticmethod
+    def _group_beats(target_lengths: List[int], scenes_per_request: int) -> List[List[int]]:
+        """
+        Split beat positions into consecutive groups of at most scenes_per_request
+        whose estimated output (~4/3 tokens per word plus metadata) fits BATCH_MAX_TOKENS.
+        """
+        groups, current, current_tokens = [], [], 0
+        for i, length in enumerate(target_lengths):
+            tokens = int(length * 4 / 3) + 150
+            if current and (len(current) >= scenes_per_request or current_tokens + tokens > BATCH_MAX_TOKENS):
+                groups.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            groups.append(current)
+        return groups
+    
+    def _request_scenes(
+        self,
+        beats: List[PlotBeat],
+        genre_template,
+        story_state: StoryState,
+        pacing_hints: List[str],
         previous_summary: str,
-        target_length: int
+        target_lengths: List[int],
+        prefix: str
+    ) -> List[str]:
+        """
+        Get one response per beat, packing all beats into a single request when
+        there are several. Beats missing from a multi-scene response are
+        requested again individually.
+        
+        Returns:
+            Per-beat response text in the single-scene format (scene + <metadata>)
+        """
+        if len(beats) == 1:
+            prompt = self._dynamic_suffix(
+                beats[0], genre_template, story_state, pacing_hints[0], previous_summary, target_lengths[0]
+            )
+            return [self._call_llm(prompt, prefix)]
+        
+        prompt = self._build_batched_prompt(
+            beats, genre_template, story_state, pacing_hints, previous_summary, target_lengths
+        )
+        response_text = self._call_llm(
+            prompt, prefix, max_tokens=min(SCENE_MAX_TOKENS * len(beats), BATCH_MAX_TOKENS)
+        )
+        parsed = self._split_batched_response(response_text)
+        
+        responses = []
+        for n, beat in enumerate(beats, 1):
+            if n in parsed:
+                responses.append(parsed[n])
+            else:
+                print(f"    ⚠️  {beat.name} missing from batched response; generating it separately")
+                responses.extend(self._request_scenes(
+                    [beat], genre_template, story_state, [pacing_hints[n - 1]],
+                    previous_summary, [target_lengths[n - 1]], prefix
+                ))
+        return responses
+    
+    def _build_batched_prompt(
+        self,
+        beats: List[PlotBeat],
+        genre_template,
+        story_state: StoryState,
+        pacing_hints: List[str],
+        previous_summary: str,
+        target_lengths: List[int]
     ) -> str:
-        """Build the master generation prompt with all context."""
+        """Build a per-request suffix asking for several numbered scenes at once."""
+        beat_blocks = []
+        for n, (beat, hint, length) in enumerate(zip(beats, pacing_hints, target_lengths), 1):
+            beat_blocks.append(f"""<beat idx={n}>
+Beat: {beat.index + 1}/15 - {beat.name}
+Beat Function: {beat.function}
+Target Emotion: {beat.target_emotion}
+Source Events: {', '.join(beat.source_events) if beat.source_events else 'None specified'}
+Length: approximately {length} words
+
+PACING DIRECTIVE: {hint}
+</beat>""")
         
-        # Format character states
-        char_states = []
-        for name, char in story_state.characters.items():
-            state_str = f"{name} ({char.role}): {char.status}"
-            if char.location:
-                state_str += f", currently at {char.location}"
-            if char.inventory:
-                state_str += f", has {', '.join(char.inventory)}"
-            char_states.append(state_str)
+        return f"""
+{self._story_state_block(story_state, beats)}
+
+<previous_context>
+{compress_context(previous_summary) if previous_summary else "This is the opening scene."}
+</previous_context>
+
+<beats>
+{chr(10).join(beat_blocks)}
+</beats>
+
+<generation_instructions>
+Write one scene for each of the {len(beats)} beats above, in order, as consecutive parts of the story. Each scene:
+- Is approximately its beat's length
+- Uses {genre_template.name} aesthetic (show, don't tell)
+- Advances the plot toward its beat function and evokes its target emotion
+- Maintains continuity with previous scenes and the scenes before it
+- Respects character states (dead characters cannot act or speak)
+- Uses ONLY the mapped target names (never source names)
+- Follows its pacing directive
+
+Follow the style guide above. For each beat N, output exactly:
+<scene idx=N>
+[scene text]
+</scene>
+<metadata idx=N>
+[the metadata JSON object from the style guide]
+</metadata>
+</generation_instructions>
+
+Write the scenes now:"""
+    
+    @staticmethod
+    def _split_batched_response(response_text: str) -> dict:
+        """
+        Split a multi-scene response into single-scene responses.
         
-        # Format active conflicts
-        conflicts = [c.description for c in story_state.active_conflicts 
-                    if not c.resolution]
+        Returns:
+            {beat number (1-based): "scene text\n\n<metadata>...</metadata>"}
+        """
+        metadata = {int(m.group(1)): m.group(2) for m in _BATCH_METADATA_RE.finditer(response_text)}
+        return {
+            int(m.group(1)): f"{m.group(2).strip()}\n\n<metadata>{metadata.get(int(m.group(1)), '')}</metadata>"
+            for m in _BATCH_SCENE_RE.finditer(response_text)
+        }
+    
+    def _fold_batch(
+        self,
+        beats: List[PlotBeat],
+        scenes: List[SceneOutput],
+        story_state: StoryState
+    ) -> List[SceneOutput]:
+        """Validate parsed batch scenes and apply each scene's updates in beat order."""
+        # Sequential so later beats see earlier updates
+        for beat, scene in zip(beats, scenes):
+            is_valid, errors = self.validate_scene(scene, story_state)
+            if not is_valid:
+                print(f"    ⚠️  Validation warnings ({beat.name}): {errors}")
+            self.update_story_state(story_state, scene)
+        
+        return scenes
+    
+    def _static_prefix(self, genre_template, world_mapping: WorldMapping) -> str:
+        """
+        Return the prompt sections shared by every beat of a story.
         
-        # Build prompt
-        prompt = f"""You are writing a scene for a {genre_template.name} narrative transformation.
+        Formatted once per (genre, world mapping) and reused, which also keeps
+        it byte-identical across calls so providers can cache it.
+        """
+        key = (genre_template.name, id(world_mapping))
+        cached = self._prefix_cache.get(key)
+        # The mapping is kept alongside the prefix so its id cannot be reused
+        if cached is not None and cached[0] is world_mapping:
+            return cached[1]
+        if len(self._prefix_cache) >= PREFIX_CACHE_SIZE:
+            self._prefix_cache.pop(next(iter(self._prefix_cache)))
+        prefix = self._build_static_prefix(genre_template, world_mapping)
+        self._prefix_cache[key] = (world_mapping, prefix)
+        return prefix
+    
+    def _build_static_prefix(self, genre_template, world_mapping: WorldMapping) -> str:
+        """Format the static prompt prefix (world rules, character mappings, style guide)."""
+        return f"""You are writing a scene for a {genre_template.name} narrative transformation.
 
 <world_rules>
 Genre: {genre_template.name}
@@ -112,16 +474,46 @@ World Rules:
 {chr(10).join(f'- {rule}' for rule in world_mapping.world_rules)}
 </world_rules>
 
-<story_state>
-Active Characters:
-{chr(10).join(char_states)}
+<character_mappings>
+{chr(10).join(f'{m.source} → {m.target} ({m.narrative_function})' for m in world_mapping.character_mappings)}
+</character_mappings>
 
-Active Conflicts:
-{chr(10).join(f'- {c}' for c in conflicts)}
+<style_guide>
+Writing Style: {genre_template.style_guidance}
 
-Timeline So Far:
-{chr(10).join(f'- {event}' for event in story_state.timeline[-5:])}
-</story_state>
+CRITICAL: Use immersive, vivid prose that matches the genre. Include sensory details.
+Make dialogue natural and character-appropriate.
+
+After writing the scene, provide metadata as a single JSON object in this format:
+
+<metadata>
+{{
+  "characters": ["names of characters who appear"],
+  "location": "where this scene takes place",
+  "emotion": "positive" | "negative" | "neutral",
+  "state_changes": {{
+    "deaths": ["names of characters who die"],
+    "location_changes": "who moves where (empty string if none)",
+    "item_transfers": "who gains or loses what (empty string if none)"
+  }},
+  "hooks": ["unresolved questions or tensions that propel story forward"]
+}}
+</metadata>
+</style_guide>
+"""
+    
+    def _dynamic_suffix(
+        self,
+        beat_info: PlotBeat,
+        genre_template,
+        story_state: StoryState,
+        pacing_hint: str,
+        previous_summary: str,
+        target_length: int
+    ) -> str:
+        """Build the per-beat prompt sections that follow the static prefix."""
+        return f"""
+{self._story_state_block(story_state, [beat_info])}
 
 <narrative_context>
 Current Beat: {beat_info.index + 1}/15 - {beat_info.name}
@@ -133,13 +525,9 @@ PACING DIRECTIVE: {pacing_hint}
 </narrative_context>
 
 <previous_context>
-{previous_summary if previous_summary else "This is the opening scene."}
+{compress_context(previous_summary) if previous_summary else "This is the opening scene."}
 </previous_context>
 
-<character_mappings>
-{chr(10).join(f'{m.source} → {m.target} ({m.narrative_function})' for m in world_mapping.character_mappings)}
-</character_mappings>
-
 <generation_instructions>
 Write a scene that:
 - Is approximately {target_length} words
@@ -151,35 +539,220 @@ Write a scene that:
 - Follows the pacing directive above
 - Evokes the target emotion: {beat_info.target_emotion}
 
-Writing Style: {genre_template.style_guidance}
-
-CRITICAL: Use immersive, vivid prose that matches the genre. Include sensory details.
-Make dialogue natural and character-appropriate.
-
-After writing the scene, provide metadata in this format:
-
-<metadata>
-CHARACTERS: [comma-separated list of characters who appear]
-LOCATION: [where this scene takes place]
-EMOTION: [primary emotion: positive/negative/neutral]
-STATE_CHANGES: [any changes - deaths, location moves, item transfers, etc.]
-HOOKS: [unresolved questions or tensions that propel story forward]
-</metadata>
+Follow the style guide above and end with the <metadata> block.
 </generation_instructions>
 
 Write the scene now:"""
+    
+    def _story_state_block(self, story_state: StoryState, beats: Sequence[PlotBeat] = ()) -> str:
+        """
+        Format the <story_state> section (characters, conflicts, timeline).
+        
+        With relevant context enabled, characters and timeline events are ranked
+        by similarity to the given beats and kept within a token budget;
+        otherwise every character and the most recent events are shown.
+        """
+        # Format character states
+        char_states = []
+        for name, char in story_state.characters.items():
+            state_str = f"{name} ({char.role}): {char.status}"
+            if char.location:
+                state_str += f", currently at {char.location}"
+            if char.inventory:
+                state_str += f", has {', '.join(char.inventory)}"
+            char_states.append(state_str)
+        events = story_state.timeline[-RECENT_TIMELINE_EVENTS:]
+        
+        if beats and self.llm.config.relevant_context_enabled:
+            query = " ".join(f"{b.function} {' '.join(b.source_events)}" for b in beats)
+            query_vector = self._embed([query])
+            if query_vector is not None:
+                # Characters named in the beats (by target or source name) are always kept
+                query_lower = query.lower()
+                pinned = [
+                    i for i, (name, char) in enumerate(story_state.characters.items())
+                    if name.lower() in query_lower or char.name.lower() in query_lower
+                ]
+                char_states = self._select_relevant(char_states, query_vector[0], pinned)
+                events = self._select_relevant(story_state.timeline, query_vector[0])
+        
+        # Format active conflicts
+        conflicts = [c.description for c in story_state.active_conflicts 
+                    if not c.resolution]
+        
+        timeline = compress_context("\n".join(f'- {event}' for event in events))
+        
+        return f"""<story_state>
+Active Characters:
+{chr(10).join(char_states)}
+
+Active Conflicts:
+{chr(10).join(f'- {c}' for c in conflicts)}
+
+Timeline So Far:
+{timeline}
+</story_state>"""
+    
+    def _embed(self, texts: List[str]) -> Optional[np.ndarray]:
+        """
+        Embed texts as normalized vectors, reusing vectors of texts seen before.
+        
+        At most EMBEDDING_CACHE_SIZE vectors are kept; the least recently used
+        are dropped first.
+        
+        Returns:
+            (len(texts), dim) array, or None if no embedder is available
+        """
+        embedder = get_embedder()
+        if embedder is None:
+            return None
+        with self._embeddings_lock:
+            # Popped and re-inserted below, which marks them as recently used
+            vectors = {t: self._embeddings.pop(t) for t in dict.fromkeys(texts) if t in self._embeddings}
+        missing = [t for t in dict.fromkeys(texts) if t not in vectors]
+        if missing:
+            encoded = embedder.encode(missing, normalize_embeddings=True)
+            vectors.update(zip(missing, np.asarray(encoded, dtype=np.float32)))
+        with self._embeddings_lock:
+            self._embeddings.update(vectors)
+            while len(self._embeddings) > EMBEDDING_CACHE_SIZE:
+                self._embeddings.pop(next(iter(self._embeddings)))
+        return np.stack([vectors[t] for t in texts])
+    
+    def _select_relevant(
+        self,
+        items: List[str],
+        query_vector: np.ndarray,
+        pinned: Sequence[int] = ()
+    ) -> List[str]:
+        """
+        Keep the items most similar to the query within the context token budget.
         
-        return prompt
+        Args:
+            items: Candidate lines (character states or timeline events)
+            query_vector: Normalized embedding of the current beat(s)
+            pinned: Indices kept regardless of similarity (counted against the budget first)
+            
+        Returns:
+            Selected items in their original order
+        """
+        if not items:
+            return []
+        similarity = self._embed(items) @ query_vector
+        ranked = list(dict.fromkeys([*pinned, *np.argsort(-similarity).tolist()]))
+        budget = self.llm.config.context_token_budget
+        pinned_set = set(pinned)
+        keep = []
+        for i in ranked:
+            cost = count_tokens(items[i], self.llm.model)
+            if cost > budget and i not in pinned_set:
+                continue
+            budget -= cost
+            keep.append(i)
+        return [items[i] for i in sorted(keep)]
     
-    def _call_llm(self, prompt: str) -> str:
-        """Call LLM using centralized client with retry logic."""
+    def _fit_prompt(self, prompt: str, prefix: Optional[str], max_tokens: int) -> str:
+        """
+        Compress the per-beat prompt if the request would overflow the model's
+        context window, instead of letting the API reject it.
+        
+        Args:
+            prompt: Dynamic part of the prompt
+            prefix: Static prompt prefix (never compressed, so it stays cacheable)
+            max_tokens: Output tokens reserved for the response
+            
+        Returns:
+            The prompt, compressed when over budget and llmlingua is available
+        """
+        model = self.llm.model
+        budget = (
+            self.llm.config.get_context_window(model) - max_tokens
+            - count_tokens(SCENE_SYSTEM_PROMPT + (prefix or ""), model)
+        )
+        tokens = count_tokens(prompt, model)
+        if tokens <= budget:
+            return prompt
+        compressor = get_compressor()
+        if compressor is None or budget <= 0:
+            print(f"    ⚠️  Scene prompt ({tokens} tokens) exceeds the context budget ({budget} tokens)")
+            return prompt
+        print(f"    🗜️  Compressing scene prompt from {tokens} to ~{budget} tokens")
+        return compressor.compress_prompt(prompt, target_token=budget)["compressed_prompt"]
+    
+    def _call_llm(self, prompt: str, prefix: Optional[str] = None, max_tokens: int = SCENE_MAX_TOKENS) -> str:
+        """Call LLM using centralized client with retry logic; prefix is provider-cached."""
+        prompt = self._fit_prompt(prompt, prefix, max_tokens)
         return self.llm.call(
             prompt=prompt,
-            system_prompt="You are a creative writer specializing in immersive storytelling.",
+            system_prompt=SCENE_SYSTEM_PROMPT,
+            cacheable_prefix=prefix,
             temperature=0.8,
-            max_tokens=1500
+            max_tokens=max_tokens
         )
     
+    def _stream_llm(
+        self,
+        prompt: str,
+        prefix: Optional[str] = None,
+        abort_pattern: Optional["re.Pattern"] = None
+    ) -> Optional[str]:
+        """
+        Stream a scene and stop as soon as its metadata block is closed, so
+        tokens generated after </metadata> are never paid for.
+        
+        Streams are not retried; on failure this falls back to _call_llm, whose
+        complete response is checked against abort_pattern instead.
+        
+        Args:
+            prompt: Dynamic part of the prompt
+            prefix: Static prompt prefix (provider-cached)
+            abort_pattern: Pattern that must not occur in the scene text; if it
+                does, the stream is closed at once
+            
+        Returns:
+            Response text, or None if aborted on abort_pattern
+        """
+        prompt = self._fit_prompt(prompt, prefix, SCENE_MAX_TOKENS)
+        buffer = io.StringIO()
+        chunks = self.llm.stream(
+            prompt=prompt,
+            system_prompt=SCENE_SYSTEM_PROMPT,
+            cacheable_prefix=prefix,
+            temperature=0.8,
+            max_tokens=SCENE_MAX_TOKENS
+        )
+        tail = ""
+        scene_pattern = abort_pattern
+        # Carry enough text between chunks to match a tag or name split across them
+        keep = len(METADATA_END) if abort_pattern is None else max(len(METADATA_END), 64)
+        try:
+            for chunk in chunks:
+                buffer.write(chunk)
+                # Only the end of the text can complete the closing tag
+                window = tail + chunk
+                if scene_pattern is not None:
+                    # Only the scene text is checked, up to the metadata block
+                    start = window.find("<metadata")
+                    if scene_pattern.search(window if start < 0 else window[:start]):
+                        return None
+                    if start >= 0:
+                        scene_pattern = None
+                if METADATA_END in window:
+                    break
+                tail = window[-keep:]
+        except Exception as e:
+            print(f"    ⚠️  Streaming failed ({e}); retrying without streaming")
+            response_text = self._call_llm(prompt, prefix)
+            if abort_pattern is not None and abort_pattern.search(response_text.split("<metadata", 1)[0]):
+                return None
+            return response_text
+        finally:
+            chunks.close()  # Closes the HTTP response when stopping early
+        
+        response_text = buffer.getvalue()
+        end = response_text.find(METADATA_END)
+        return response_text[:end + len(METADATA_END)] if end >= 0 else response_text
+    
     def _parse_scene_output(
         self,
         response_text: str,
@@ -197,30 +770,34 @@ Write the scene now:"""
             scene_text = response_text.strip()
             metadata_text = ""
         
-        # Parse metadata
-        characters = self._extract_field(metadata_text, "CHARACTERS")
-        location = self._extract_field(metadata_text, "LOCATION", default="Unknown")
-        emotion_str = self._extract_field(metadata_text, "EMOTION", default="neutral")
-        state_changes_str = self._extract_field(metadata_text, "STATE_CHANGES")
-        hooks_str = self._extract_field(metadata_text, "HOOKS")
+        # Parse metadata (JSON object, or the legacy FIELD: value lines)
+        metadata = self._parse_metadata_json(metadata_text)
+        if metadata is not None:
+            characters_list = self._metadata_list(metadata.get("characters"), ',')
+            location = str(metadata.get("location") or "Unknown")
+            emotion_str = str(metadata.get("emotion") or "neutral")
+            state_updates = self._state_changes_from_json(metadata.get("state_changes"))
+            hooks_list = self._metadata_list(metadata.get("hooks"), ';')
+        else:
+            fields = self._parse_metadata_block(metadata_text)
+            characters = fields.get("CHARACTERS", "")
+            location = fields.get("LOCATION") or "Unknown"
+            emotion_str = fields.get("EMOTION") or "neutral"
+            state_updates = self._parse_state_changes(fields.get("STATE_CHANGES", ""))
+            hooks_str = fields.get("HOOKS", "")
+            characters_list = [c.strip() for c in characters.split(',')] if characters else []
+            hooks_list = [h.strip() for h in hooks_str.split(';')] if hooks_str else []
         
         # Parse emotion
         emotional_valence = 0.0
         if "positive" in emotion_str.lower():
-            emotional_valence = 0.5
+            emotional_valence = EMOTION_VALENCE["positive"]
         elif "negative" in emotion_str.lower():
-            emotional_valence = -0.5
+            emotional_valence = EMOTION_VALENCE["negative"]
         
         # Calculate NTI
         tension_score = self.tension_analyzer.calculate_nti(scene_text)
         
-        # Parse state updates
-        state_updates = self._parse_state_changes(state_changes_str)
-        
-        # Parse characters and hooks
-        characters_list = [c.strip() for c in characters.split(',')] if characters else []
-        hooks_list = [h.strip() for h in hooks_str.split(';')] if hooks_str else []
-        
         return SceneOutput(
             beat_index=beat_info.index,
             beat_name=beat_info.name,
@@ -233,34 +810,96 @@ Write the scene now:"""
             unresolved_hooks=hooks_list
         )
     
-    def _extract_field(self, text: str, field_name: str, default: str = "") -> str:
-        """Extract a field from metadata text."""
-        pattern = f"{field_name}:\\s*(.+?)(?=\\n[A-Z_]+:|$)"
-        match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-        return match.group(1).strip() if match else default
+    @staticmethod
+    def _parse_metadata_json(metadata_text: str) -> Optional[dict]:
+        """
+        Decode a JSON metadata block.
+        
+        Returns:
+            Metadata dict, or None if the block is not JSON (legacy format)
+        """
+        if not metadata_text.lstrip().startswith(("{", "```")):
+            return None
+        try:
+            metadata = LLMClient.parse_json_response(metadata_text)
+        except json.JSONDecodeError:
+            return None
+        return metadata if isinstance(metadata, dict) else None
+    
+    @staticmethod
+    def _metadata_list(value, separator: str) -> List[str]:
+        """
+        Normalize a JSON metadata list field.
+        
+        A plain string is split on separator, as in the legacy format, rather
+        than iterated character by character.
+        """
+        if isinstance(value, str):
+            value = value.split(separator)
+        elif not isinstance(value, list):
+            return []
+        return [str(item).strip() for item in value if str(item).strip()]
     
-    def _parse_state_changes(self, changes_str: str) -> dict:
+    @staticmethod
+    def _state_changes_from_json(changes) -> StateUpdate:
+        """Normalize the JSON state_changes object to a StateUpdate."""
+        updates = StateUpdate()
+        if not isinstance(changes, dict):
+            return updates
+        deaths = changes.get("deaths") or []
+        if isinstance(deaths, str):
+            deaths = [deaths]
+        updates.deaths = [str(d).strip() for d in deaths if str(d).strip()]
+        for key in ("location_changes", "item_transfers"):
+            value = changes.get(key)
+            if isinstance(value, list):
+                value = ", ".join(str(v) for v in value)
+            if value:
+                setattr(updates, key, str(value).strip())
+        return updates
+    
+    @staticmethod
+    def _parse_metadata_block(text: str) -> dict:
+        """
+        Parse legacy "FIELD: value" metadata in a single pass over its lines.
+        
+        Returns:
+            {FIELD (upper-case): stripped value}; a value runs until the next key line
+        """
+        fields = {}
+        key, buf = None, []
+        for line in text.splitlines():
+            match = _KEY_RE.match(line)
+            if match:
+                if key:
+                    fields[key] = "\n".join(buf).strip()
+                key, buf = match.group(1).upper(), [match.group(2)]
+            elif key:
+                buf.append(line)
+        if key:
+            fields[key] = "\n".join(buf).strip()
+        return fields
+    
+    def _parse_state_changes(self, changes_str: str) -> StateUpdate:
         """Parse state changes from string."""
-        changes = {}
+        changes = StateUpdate()
         
         if not changes_str:
             return changes
         
-        # Look for death mentions
-        if "dies" in changes_str.lower() or "killed" in changes_str.lower() or "death" in changes_str.lower():
-            changes["deaths"] = []
-            # Try to extract names
-            for line in changes_str.split(','):
-                if any(word in line.lower() for word in ["dies", "killed", "death"]):
-                    changes["deaths"].append(line.strip())
+        # Look for death mentions; keep each comma-separated change naming one
+        if _DEATH_RE.search(changes_str):
+            changes.deaths = [
+                part.strip() for part in changes_str.split(',') if _DEATH_RE.search(part)
+            ]
         
         # Look for location changes
-        if "moves to" in changes_str.lower() or "travels to" in changes_str.lower():
-            changes["location_changes"] = changes_str
+        if _MOVE_RE.search(changes_str):
+            changes.location_changes = changes_str
         
         # Look for item transfers
-        if "gets" in changes_str.lower() or "receives" in changes_str.lower() or "finds" in changes_str.lower():
-            changes["item_transfers"] = changes_str
+        if _ITEM_RE.search(changes_str):
+            changes.item_transfers = changes_str
         
         return changes
     
@@ -318,17 +957,22 @@ Write the scene now:"""
         Returns:
             Updated StoryState
         """
+        updates = scene_output.state_updates
+        
         # Apply deaths
-        if "deaths" in scene_output.state_updates:
-            for death_desc in scene_output.state_updates["deaths"]:
+        if updates.deaths:
+            # Case-folded names, built once for all death descriptions
+            name_map = {name.casefold(): name for name in current_state.characters}
+            for death_desc in updates.deaths:
                 # Try to extract character name
-                for char_name in current_state.characters.keys():
-                    if char_name.lower() in death_desc.lower():
+                folded_desc = death_desc.casefold()
+                for folded_name, char_name in name_map.items():
+                    if folded_name in folded_desc:
                         current_state.update_character_status(char_name, "dead")
                         current_state.add_timeline_event(f"{char_name} died")
         
         # Apply location changes
-        if "location_changes" in scene_output.state_updates:
+        if updates.location_changes:
             for char_name in scene_output.characters_involved:
                 current_state.update_character_location(char_name, scene_output.location)
         
@@ -3,41 +3,500 @@ Centralized LLM Client Factory
 Provides unified API client with retry logic, JSON mode, and error handling.
 """
 
+import asyncio
+import importlib
+import importlib.util
 import json
+import random
 import re
-from typing import Optional, Dict, Any
-from functools import wraps
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Iterable, Iterator, List, Tuple
+from functools import lru_cache, wraps
 import time
-
-from openai import OpenAI
-from anthropic import Anthropic
+from datetime import datetime, timezone
 
 from config import DEFAULT_CONFIG
+from cache import DiskCache, SemanticCache, cache_key, json_dumps, json_loads as _json_loads
+
+# Optional repair of malformed/truncated JSON before giving up on a response
+try:
+    import json_repair
+except ImportError:
+    json_repair = None
+
+# Extracts the first JSON value from text that has more around it
+_JSON_DECODER = json.JSONDecoder()
+
+# Markdown code fence around a JSON body
+_FENCE = "```"
+
+# Optional exact tokenizer; token counts are estimated when it is not installed
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Rough characters-per-token ratio used without tiktoken
+_CHARS_PER_TOKEN = 4
 
 # Lazy import for Gemini to avoid deprecation warning when not using it
 genai = None
 
 
-def retry_with_backoff(max_retries: int = 3, base_delay: float = 2.0, max_delay: float = 10.0):
+@lru_cache(maxsize=None)
+def _get_provider_module(name: str):
+    """
+    Import a provider SDK on first use.
+    
+    SDKs are only loaded for the provider actually configured, keeping
+    startup time and memory down for the others.
+    """
+    return importlib.import_module(name)
+
+
+# SDK clients shared across LLMClient instances, keyed by (provider, api_key, base_url)
+_CLIENT_CACHE: Dict[tuple, Any] = {}
+# Async clients are bound to an event loop: loop -> {key: client}
+_ASYNC_CLIENT_CACHE = weakref.WeakKeyDictionary()
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """Return the tiktoken encoding for a model (cl100k_base for unknown/non-OpenAI models)."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    Count (or, without tiktoken, estimate) the tokens in text.
+    
+    Args:
+        text: Text to measure
+        model: Model name selecting the tokenizer
+        
+    Returns:
+        Number of tokens
+    """
+    if tiktoken is None:
+        return -(-len(text) // _CHARS_PER_TOKEN)
+    return len(_get_encoding(model).encode(text, disallowed_special=()))
+
+
+def split_by_tokens(text: str, chunk_tokens: int, model: str) -> List[str]:
+    """
+    Split text into consecutive pieces of at most chunk_tokens tokens each.
+    
+    Args:
+        text: Text to split
+        chunk_tokens: Maximum tokens per piece
+        model: Model name selecting the tokenizer
+        
+    Returns:
+        List of text pieces (a single piece if text already fits)
+    """
+    chunk_tokens = max(chunk_tokens, 1)
+    if tiktoken is None:
+        step = chunk_tokens * _CHARS_PER_TOKEN
+        return [text[i:i + step] for i in range(0, len(text), step)] or [text]
+    encoding = _get_encoding(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    return [
+        encoding.decode(tokens[i:i + chunk_tokens]) for i in range(0, len(tokens), chunk_tokens)
+    ] or [text]
+
+
+def _openai_client_kwargs(config) -> Dict[str, Any]:
+    """Build constructor kwargs shared by the sync and async OpenAI clients."""
+    client_kwargs = {"api_key": config.openai_api_key}
+    if config.openai_base_url:
+        client_kwargs["base_url"] = config.openai_base_url
+        # OpenRouter requires these headers
+        client_kwargs["default_headers"] = {
+            "HTTP-Referer": "https://github.com/narrative-transformer",
+            "X-Title": "Narrative Transformer"
+        }
+    return client_kwargs
+
+
+@lru_cache(maxsize=None)
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def _sdk_client(api_type: str, config, use_async: bool):
+    """
+    Construct an OpenAI/Anthropic SDK client.
+    
+    With HTTP/2 enabled (and h2 installed) the client gets an HTTP/2 transport,
+    so concurrent requests share one multiplexed connection instead of each
+    opening its own TLS connection.
+    """
+    module = _get_provider_module(api_type)
+    prefix = "Async" if use_async else ""
+    kwargs = _openai_client_kwargs(config) if api_type == "openai" else {"api_key": config.anthropic_api_key}
+    if config.http2_enabled and _http2_available():
+        # The SDKs' default httpx client, keeping their timeouts and pool limits
+        kwargs["http_client"] = getattr(module, f"Default{prefix}HttpxClient")(http2=True)
+    client_cls = f"{prefix}OpenAI" if api_type == "openai" else f"{prefix}Anthropic"
+    return getattr(module, client_cls)(**kwargs)
+
+
+def _client_key(api_type: str, config) -> tuple:
+    if api_type == "openai":
+        return (api_type, config.openai_api_key, config.openai_base_url)
+    return (api_type, config.anthropic_api_key, None)
+
+
+def _get_client(api_type: str, config):
+    """
+    Return the shared sync SDK client for a provider, creating it on first use.
+    
+    Args:
+        api_type: "openai" or "anthropic"
+        config: ModelConfig holding credentials
+    """
+    key = _client_key(api_type, config)
+    client = _CLIENT_CACHE.get(key)
+    if client is None:
+        # Each SDK client owns a keep-alive connection pool; sharing the client shares the pool
+        client = _CLIENT_CACHE.setdefault(key, _sdk_client(api_type, config, use_async=False))
+    return client
+
+
+@lru_cache(maxsize=None)
+def _get_gemini_model(model: str, api_key: str):
+    """Return the shared Gemini GenerativeModel for a model name, configuring the SDK once."""
+    global genai
+    genai = _get_provider_module("google.generativeai")
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(model)
+
+
+def _get_async_client(api_type: str, config):
+    """Return the shared async SDK client for a provider on the running event loop."""
+    loop_clients = _ASYNC_CLIENT_CACHE.setdefault(asyncio.get_running_loop(), {})
+    key = _client_key(api_type, config)
+    client = loop_clients.get(key)
+    if client is None:
+        client = loop_clients[key] = _sdk_client(api_type, config, use_async=True)
+    return client
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    """Whether an SDK exception signals a rate limit (HTTP 429 / quota exhausted)."""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    # Gemini raises google.api_core ResourceExhausted without a status_code attribute
+    return type(error).__name__ in ("RateLimitError", "ResourceExhausted", "TooManyRequests")
+
+
+# OpenAI rate-limit reset durations, e.g. "20ms", "1.5s", "6m0s", "1h2m3s"
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_reset(value: str) -> Optional[float]:
+    """Seconds until a rate-limit window resets, from a duration or an RFC 3339 timestamp."""
+    parts = _DURATION_RE.findall(value)
+    if parts:
+        return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+    try:
+        # Anthropic sends the reset time as a timestamp
+        reset_at = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return (reset_at - datetime.now(timezone.utc)).total_seconds()
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """
+    Seconds the provider asked us to wait, if any: Retry-After, else the
+    latest rate-limit window reset header (OpenAI x-ratelimit-reset-*,
+    Anthropic anthropic-ratelimit-*-reset).
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        # OpenAI also sends a millisecond-precision variant
+        return max(float(headers.get("retry-after-ms")) / 1000.0, 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(float(headers.get("retry-after")), 0.0)
+    except (TypeError, ValueError):
+        pass
+    resets = [
+        _parse_reset(headers[name]) for name in (
+            "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens",
+            "anthropic-ratelimit-requests-reset", "anthropic-ratelimit-tokens-reset",
+        ) if headers.get(name)
+    ]
+    resets = [r for r in resets if r is not None]
+    return max(max(resets), 0.0) if resets else None
+
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits, server errors, overload
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+
+# Transient SDK/transport exception class names (matched anywhere in the MRO)
+_RETRYABLE_ERRORS = {
+    "APIConnectionError", "APITimeoutError", "InternalServerError", "RateLimitError",
+    "ServiceUnavailable", "DeadlineExceeded", "ResourceExhausted", "TooManyRequests",
+    "ConnectionError", "TimeoutError",
+}
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Whether a failed call may succeed on retry (transient) rather than fail again."""
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in _RETRYABLE_STATUS or status >= 500
+    return any(cls.__name__ in _RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+def _retry_delay(error: Exception, attempt: int, base_delay: float, max_delay: float) -> float:
+    """Seconds to wait before retrying: the provider's Retry-After, else jittered exponential backoff."""
+    retry_after = _retry_after(error)
+    if retry_after is not None:
+        return min(retry_after, max_delay)
+    # Full jitter spreads out clients that failed together so they don't retry in lockstep
+    return random.uniform(0, min(base_delay * (2 ** attempt), max_delay))
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for async calls to one provider.
+    
+    The limit grows by 0.5 on every success and halves on every rate-limit
+    response, so throughput converges on what the account's quota allows.
+    After a 429 with Retry-After, new requests wait out the advertised pause.
+    """
+    
+    def __init__(self, initial: int, maximum: int):
+        """
+        Args:
+            initial: Starting number of concurrent requests
+            maximum: Ceiling the limit may grow to
+        """
+        self.maximum = max(maximum, 1)
+        self.limit = float(min(max(initial, 1), self.maximum))
+        self.in_flight = 0
+        self.cond = asyncio.Condition()
+        self._resume_at = 0.0  # loop.time() before which no request may start
+    
+    async def acquire(self):
+        """Wait for a free slot (and any Retry-After pause), then take it."""
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        delay = self._resume_at - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    async def release(self, succeeded: bool, rate_limited: bool = False, retry_after: Optional[float] = None):
+        """Free a slot and adjust the limit from the request's outcome."""
+        async with self.cond:
+            self.in_flight -= 1
+            if rate_limited:
+                self.limit = max(self.limit * 0.5, 1.0)
+                if retry_after:
+                    resume_at = asyncio.get_running_loop().time() + retry_after
+                    self._resume_at = max(self._resume_at, resume_at)
+            elif succeeded:
+                self.limit = min(self.limit + 0.5, float(self.maximum))
+            self.cond.notify_all()
+    
+    @asynccontextmanager
+    async def slot(self):
+        """Hold a slot for the duration of one request."""
+        await self.acquire()
+        succeeded, rate_limited, retry_after = False, False, None
+        try:
+            yield
+            succeeded = True
+        except Exception as e:
+            rate_limited = _is_rate_limited(e)
+            retry_after = _retry_after(e)
+            raise
+        finally:
+            await self.release(succeeded, rate_limited, retry_after)
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket capping how many requests (or, with a cost per
+    request, how many LLM tokens) start per second.
+    
+    Callers reserve the next free start time under a lock and then wait
+    outside it, so the same bucket serves threads and coroutines.
     """
-    Decorator for retry logic with exponential backoff.
+    
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        """
+        Args:
+            rate: Sustained units (requests or tokens) per second
+            burst: Units that may start back-to-back (defaults to max(rate, 1))
+        """
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def reserve(self, cost: float = 1.0) -> float:
+        """Take cost tokens and return how long to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= cost
+            # A negative balance is a queue of reservations waiting for refill
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+    
+    def acquire(self, cost: float = 1.0):
+        """Block the calling thread until a request may start."""
+        delay = self.reserve(cost)
+        if delay > 0:
+            time.sleep(delay)
+    
+    async def acquire_async(self, cost: float = 1.0):
+        """Wait (without blocking the event loop) until a request may start."""
+        delay = self.reserve(cost)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Rate limiters are shared by all LLMClients (and threads) of a provider
+_RATE_LIMITERS: Dict[str, RateLimiter] = {}
+# Token-rate limiters, keyed by (provider, model) since TPM limits are per model
+_TOKEN_LIMITERS: Dict[Tuple[str, str], RateLimiter] = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+def _get_rate_limiter(api_type: str, config) -> Optional[RateLimiter]:
+    """Return the provider's request-rate limiter, or None when unlimited."""
+    if config.requests_per_second <= 0:
+        return None
+    with _RATE_LIMITERS_LOCK:
+        limiter = _RATE_LIMITERS.get(api_type)
+        if limiter is None:
+            limiter = _RATE_LIMITERS[api_type] = RateLimiter(config.requests_per_second)
+        return limiter
+
+
+def _get_token_limiter(api_type: str, model: str, config) -> Optional[RateLimiter]:
+    """Return the (provider, model) token-rate limiter, or None when unlimited."""
+    if config.tokens_per_minute <= 0:
+        return None
+    with _RATE_LIMITERS_LOCK:
+        limiter = _TOKEN_LIMITERS.get((api_type, model))
+        if limiter is None:
+            # A full minute's budget may be spent at once, as provider TPM windows allow
+            limiter = _TOKEN_LIMITERS[(api_type, model)] = RateLimiter(
+                config.tokens_per_minute / 60.0, burst=config.tokens_per_minute
+            )
+        return limiter
+
+
+# Limiters are shared by all LLMClients of a provider: loop -> {api_type: limiter}
+_LIMITERS = weakref.WeakKeyDictionary()
+
+
+def _get_limiter(api_type: str, config) -> AdaptiveLimiter:
+    """Return the provider's adaptive limiter for the running event loop."""
+    loop_limiters = _LIMITERS.setdefault(asyncio.get_running_loop(), {})
+    limiter = loop_limiters.get(api_type)
+    if limiter is None:
+        limiter = loop_limiters[api_type] = AdaptiveLimiter(config.max_concurrent, config.max_concurrent_ceiling)
+    return limiter
+
+
+# Models whose endpoint rejected a json_schema response_format at runtime
+_JSON_SCHEMA_REJECTED: set = set()
+
+
+def _rejects_json_schema(error: Exception, request_kwargs: Dict[str, Any]) -> bool:
+    """Whether an OpenAI request failed because its json_schema response_format is unsupported."""
+    response_format = request_kwargs.get("response_format") or {}
+    if response_format.get("type") != "json_schema" or getattr(error, "status_code", None) != 400:
+        return False
+    message = str(error)
+    return "response_format" in message or "json_schema" in message
+
+
+def object_schema(properties: Dict[str, Any]) -> Dict[str, Any]:
+    """Strict-mode object schema: every property required, no extras."""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False
+    }
+
+
+# JSON Schema keywords Gemini's response_schema understands
+_GEMINI_SCHEMA_KEYS = {"type", "format", "description", "nullable", "enum", "properties", "required", "items"}
+
+
+def _gemini_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Strip JSON Schema keywords (additionalProperties, title, ...) that Gemini rejects."""
+    cleaned = {}
+    for key, value in schema.items():
+        if key not in _GEMINI_SCHEMA_KEYS:
+            continue
+        if key == "properties":
+            value = {name: _gemini_schema(prop) for name, prop in value.items()}
+        elif key == "items":
+            value = _gemini_schema(value)
+        cleaned[key] = value
+    return cleaned
+
+
+def retry_with_backoff(
+    max_retries: int = 3,
+    base_delay: float = 2.0,
+    max_delay: float = 10.0,
+    max_wait: Optional[float] = None
+):
+    """
+    Decorator for retry logic with jittered exponential backoff.
+    
+    Only transient failures (timeouts, connection errors, 429/5xx) are
+    retried, and a provider's Retry-After (or rate-limit reset) header
+    takes precedence over the computed delay.
     
     Args:
         max_retries: Maximum number of retry attempts
         base_delay: Initial delay in seconds
         max_delay: Maximum delay cap in seconds
+        max_wait: Give up once retrying would run past this many seconds
+            since the first attempt (None = no deadline)
     """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             last_exception = None
+            deadline = time.monotonic() + max_wait if max_wait is not None else None
             for attempt in range(max_retries + 1):
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
                     last_exception = e
+                    if not _is_retryable(e):
+                        print(f"  ❌ API call failed (not retryable): {e}")
+                        raise
+                    delay = _retry_delay(e, attempt, base_delay, max_delay)
+                    if deadline is not None and time.monotonic() + delay > deadline:
+                        print(f"  ❌ API call failed; retry deadline of {max_wait:.0f}s reached")
+                        break
                     if attempt < max_retries:
-                        delay = min(base_delay * (2 ** attempt), max_delay)
                         print(f"  ⚠️  API call failed (attempt {attempt + 1}/{max_retries + 1}): {e}")
                         print(f"      Retrying in {delay:.1f}s...")
                         time.sleep(delay)
@@ -48,59 +507,113 @@ def retry_with_backoff(max_retries: int = 3, base_delay: float = 2.0, max_delay:
     return decorator
 
 
+def async_retry_with_backoff(
+    max_retries: int = 3,
+    base_delay: float = 2.0,
+    max_delay: float = 10.0,
+    max_wait: Optional[float] = None
+):
+    """
+    Async counterpart of retry_with_backoff; waits with asyncio.sleep.
+    
+    Args:
+        max_retries: Maximum number of retry attempts
+        base_delay: Initial delay in seconds
+        max_delay: Maximum delay cap in seconds
+        max_wait: Give up once retrying would run past this many seconds
+            since the first attempt (None = no deadline)
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            last_exception = None
+            deadline = time.monotonic() + max_wait if max_wait is not None else None
+            for attempt in range(max_retries + 1):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    last_exception = e
+                    if not _is_retryable(e):
+                        print(f"  ❌ API call failed (not retryable): {e}")
+                        raise
+                    delay = _retry_delay(e, attempt, base_delay, max_delay)
+                    if deadline is not None and time.monotonic() + delay > deadline:
+                        print(f"  ❌ API call failed; retry deadline of {max_wait:.0f}s reached")
+                        break
+                    if attempt < max_retries:
+                        print(f"  ⚠️  API call failed (attempt {attempt + 1}/{max_retries + 1}): {e}")
+                        print(f"      Retrying in {delay:.1f}s...")
+                        await asyncio.sleep(delay)
+                    else:
+                        print(f"  ❌ API call failed after {max_retries + 1} attempts")
+            raise last_exception
+        return wrapper
+    return decorator
+
+
 class LLMClient:
     """
     Centralized LLM client with:
     - Unified API for OpenAI, Anthropic, and Gemini
     - Automatic retry with exponential backoff
     - JSON mode support for guaranteed parseable output
+    - Response caching (exact, optionally semantic) for JSON and temperature-0 calls
     - Consistent error handling
     """
     
-    def __init__(self, model: Optional[str] = None, json_mode: bool = False):
+    def __init__(self, model: Optional[str] = None, json_mode: bool = False, cache_responses: bool = True):
         """
         Initialize LLM client.
         
         Args:
             model: Model name override (uses config default if None)
             json_mode: Enable JSON mode for guaranteed parseable output (OpenAI only)
+            cache_responses: Cache responses (see _is_cacheable); callers that
+                cache their own parsed results pass False
         """
         self.config = DEFAULT_CONFIG
         self.model = model or self.config.default_model
         self.json_mode = json_mode
         
+        # Response caches, consulted only for JSON and temperature-0 calls (see _is_cacheable)
+        cache_enabled = cache_responses and self.config.cache_enabled
+        self.response_cache = DiskCache("responses") if cache_enabled else None
+        self.semantic_enabled = cache_enabled and self.config.semantic_cache_enabled
+        # One semantic index per request shape (see _semantic_cache)
+        self._semantic_caches: Dict[str, SemanticCache] = {}
+        self._semantic_lock = threading.Lock()
+        self._cache_stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+        self._stats_lock = threading.Lock()
+        
         # Initialize appropriate client
         if self.config.get_primary_api() == "gemini":
             # Lazy import Gemini SDK only when needed
-            global genai
-            import google.generativeai as genai
-            genai.configure(api_key=self.config.gemini_api_key)
-            self.client = genai.GenerativeModel(self.model)
+            self.client = _get_gemini_model(self.model, self.config.gemini_api_key)
             self.api_type = "gemini"
         elif self.config.get_primary_api() == "openai":
-            client_kwargs = {"api_key": self.config.openai_api_key}
-            if self.config.openai_base_url:
-                client_kwargs["base_url"] = self.config.openai_base_url
-                # OpenRouter requires these headers
-                client_kwargs["default_headers"] = {
-                    "HTTP-Referer": "https://github.com/narrative-transformer",
-                    "X-Title": "Narrative Transformer"
-                }
-            self.client = OpenAI(**client_kwargs)
+            self.client = _get_client("openai", self.config)
             self.api_type = "openai"
         elif self.config.get_primary_api() == "anthropic":
-            self.client = Anthropic(api_key=self.config.anthropic_api_key)
+            self.client = _get_client("anthropic", self.config)
             self.api_type = "anthropic"
         else:
             raise ValueError("No valid API key configured. Check your .env file.")
     
-    @retry_with_backoff(max_retries=3, base_delay=2.0, max_delay=10.0)
+    def _get_async_client(self):
+        """Return the async SDK client for the running event loop."""
+        if self.api_type == "gemini":
+            # Gemini models expose generate_content_async on the same object
+            return self.client
+        return _get_async_client(self.api_type, self.config)
+    
     def call(
         self,
         prompt: str,
         system_prompt: Optional[str] = None,
         temperature: Optional[float] = None,
-        max_tokens: Optional[int] = None
+        max_tokens: Optional[int] = None,
+        cacheable_prefix: Optional[str] = None,
+        response_schema: Optional[Dict[str, Any]] = None
     ) -> str:
         """
         Make an LLM API call with retry logic.
@@ -110,6 +623,10 @@ class LLMClient:
             system_prompt: System instruction (prepended for Gemini)
             temperature: Override config temperature
             max_tokens: Override config max_tokens
+            cacheable_prefix: Static text placed before prompt; kept byte-identical
+                across calls so provider-side prompt caching can reuse it
+            response_schema: JSON Schema the response must follow (uses the
+                provider's structured output mode; response is JSON text)
             
         Returns:
             LLM response text
@@ -117,41 +634,320 @@ class LLMClient:
         temp = temperature if temperature is not None else self.config.temperature
         tokens = max_tokens if max_tokens is not None else self.config.max_tokens
         
+        cacheable = self._is_cacheable(temp, response_schema)
+        if cacheable:
+            key = self._cache_key(prompt, system_prompt, temp, tokens, cacheable_prefix, response_schema)
+            semantic = self._semantic_cache(system_prompt, temp, tokens, cacheable_prefix, response_schema)
+            vector = semantic.embed(prompt) if semantic else None
+            cached = self._cache_lookup(key, semantic, vector)
+            if cached is not None:
+                return cached
+        
+        response_text = self._call_with_retry(prompt, system_prompt, temp, tokens, cacheable_prefix, response_schema)
+        
+        if cacheable:
+            self._cache_store(key, semantic, vector, response_text)
+        return response_text
+    
+    @retry_with_backoff(max_retries=5, base_delay=1.0, max_delay=60.0, max_wait=180.0)
+    def _call_with_retry(
+        self, prompt: str, system_prompt: Optional[str],
+        temp: float, tokens: int, cacheable_prefix: Optional[str],
+        response_schema: Optional[Dict[str, Any]]
+    ) -> str:
+        """Rate-limit and dispatch one request to the configured provider."""
+        rate_limiter = _get_rate_limiter(self.api_type, self.config)
+        if rate_limiter:
+            rate_limiter.acquire()
+        token_limiter = _get_token_limiter(self.api_type, self.model, self.config)
+        if token_limiter:
+            token_limiter.acquire(self._estimate_tokens(prompt, system_prompt, cacheable_prefix, tokens))
+        
         if self.api_type == "gemini":
-            return self._call_gemini(prompt, system_prompt, temp, tokens)
+            return self._call_gemini(prompt, system_prompt, temp, tokens, cacheable_prefix, response_schema)
         elif self.api_type == "openai":
-            return self._call_openai(prompt, system_prompt, temp, tokens)
+            return self._call_openai(prompt, system_prompt, temp, tokens, cacheable_prefix, response_schema)
         elif self.api_type == "anthropic":
-            return self._call_anthropic(prompt, system_prompt, temp, tokens)
+            return self._call_anthropic(prompt, system_prompt, temp, tokens, cacheable_prefix, response_schema)
+    
+    async def acall(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        cacheable_prefix: Optional[str] = None,
+        response_schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        Async variant of call(); concurrency per provider is adapted by AdaptiveLimiter.
+        
+        Args:
+            prompt: User prompt/message
+            system_prompt: System instruction (prepended for Gemini)
+            temperature: Override config temperature
+            max_tokens: Override config max_tokens
+            cacheable_prefix: Static text placed before prompt; kept byte-identical
+                across calls so provider-side prompt caching can reuse it
+            response_schema: JSON Schema the response must follow (uses the
+                provider's structured output mode; response is JSON text)
+            
+        Returns:
+            LLM response text
+        """
+        temp = temperature if temperature is not None else self.config.temperature
+        tokens = max_tokens if max_tokens is not None else self.config.max_tokens
+        
+        cacheable = self._is_cacheable(temp, response_schema)
+        if cacheable:
+            key = self._cache_key(prompt, system_prompt, temp, tokens, cacheable_prefix, response_schema)
+            semantic = self._semantic_cache(system_prompt, temp, tokens, cacheable_prefix, response_schema)
+            vector = None
+            if semantic:
+                # Embedding is CPU-bound; keep it off the event loop
+                vector = await asyncio.to_thread(semantic.embed, prompt)
+            cached = self._cache_lookup(key, semantic, vector)
+            if cached is not None:
+                return cached
+        
+        response_text = await self._acall_with_retry(
+            prompt, system_prompt, temp, tokens, cacheable_prefix, response_schema
+        )
+        
+        if cacheable:
+            self._cache_store(key, semantic, vector, response_text)
+        return response_text
+    
+    @async_retry_with_backoff(max_retries=5, base_delay=1.0, max_delay=60.0, max_wait=180.0)
+    async def _acall_with_retry(
+        self, prompt: str, system_prompt: Optional[str],
+        temp: float, tokens: int, cacheable_prefix: Optional[str],
+        response_schema: Optional[Dict[str, Any]]
+    ) -> str:
+        """Rate-limit and dispatch one async request to the configured provider."""
+        rate_limiter = _get_rate_limiter(self.api_type, self.config)
+        if rate_limiter:
+            await rate_limiter.acquire_async()
+        token_limiter = _get_token_limiter(self.api_type, self.model, self.config)
+        if token_limiter:
+            await token_limiter.acquire_async(
+                self._estimate_tokens(prompt, system_prompt, cacheable_prefix, tokens)
+            )
+        
+        async with _get_limiter(self.api_type, self.config).slot():
+            if self.api_type == "gemini":
+                return await self._acall_gemini(prompt, system_prompt, temp, tokens, cacheable_prefix, response_schema)
+            elif self.api_type == "openai":
+                return await self._acall_openai(prompt, system_prompt, temp, tokens, cacheable_prefix, response_schema)
+            elif self.api_type == "anthropic":
+                return await self._acall_anthropic(prompt, system_prompt, temp, tokens, cacheable_prefix, response_schema)
+    
+    def _estimate_tokens(
+        self, prompt: str, system_prompt: Optional[str], prefix: Optional[str], max_tokens: int
+    ) -> int:
+        """Tokens a request counts against TPM limits: its input plus the output cap."""
+        text = "".join(part for part in (system_prompt, prefix, prompt) if part)
+        return count_tokens(text, self.model) + max_tokens
+    
+    def _is_cacheable(self, temperature: float, response_schema: Optional[Dict[str, Any]]) -> bool:
+        """
+        Only JSON/structured output and temperature-0 requests are cached.
+        Other calls must keep producing fresh text.
+        """
+        if self.response_cache is None:
+            return False
+        return self.json_mode or response_schema is not None or temperature == 0
+    
+    def _cache_key(
+        self, prompt: str, system_prompt: Optional[str], temperature: float, max_tokens: int,
+        prefix: Optional[str], schema: Optional[Dict[str, Any]]
+    ) -> str:
+        """Exact-match key covering everything that shapes the response."""
+        return cache_key(
+            self.api_type, self.model, str(self.json_mode), repr(temperature), str(max_tokens),
+            system_prompt or "", prefix or "", prompt,
+            json.dumps(schema, sort_keys=True) if schema else ""
+        )
+    
+    def _semantic_cache(
+        self, system_prompt: Optional[str], temperature: float, max_tokens: int,
+        prefix: Optional[str], schema: Optional[Dict[str, Any]]
+    ) -> Optional[SemanticCache]:
+        """
+        Return the semantic index for one request shape (None if disabled).
+        
+        Only the prompt is embedded: system prompts and prefixes are long fixed
+        preambles that would dominate the embedding (and the embedder truncates
+        its input). Everything else that shapes the response - provider, model,
+        JSON mode, system prompt, prefix, temperature, max_tokens and schema -
+        selects the index, so it must match exactly.
+        """
+        if not self.semantic_enabled:
+            return None
+        namespace = cache_key(
+            self.api_type, self.model, str(self.json_mode), repr(temperature), str(max_tokens),
+            system_prompt or "", prefix or "",
+            json.dumps(schema, sort_keys=True) if schema else ""
+        )[:16]
+        with self._semantic_lock:
+            if namespace not in self._semantic_caches:
+                self._semantic_caches[namespace] = SemanticCache(
+                    f"responses-semantic/{namespace}",
+                    threshold=self.config.semantic_cache_threshold
+                )
+            return self._semantic_caches[namespace]
+    
+    def _cache_lookup(self, key: str, semantic: Optional[SemanticCache], vector) -> Optional[str]:
+        """Return a cached response (exact first, then semantic) and record the outcome."""
+        cached = self.response_cache.get(key)
+        outcome = "exact_hits"
+        if cached is None and vector is not None:
+            cached = semantic.lookup(vector)
+            outcome = "semantic_hits"
+        if cached is None:
+            outcome = "misses"
+        with self._stats_lock:
+            self._cache_stats[outcome] += 1
+        return cached
+    
+    def _cache_store(self, key: str, semantic: Optional[SemanticCache], vector, response_text: str):
+        """Record a fresh response in the exact and semantic caches."""
+        self.response_cache.set(key, response_text)
+        if vector is not None:
+            semantic.add(vector, response_text)
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Response-cache counters for this client.
+        
+        Returns:
+            Dict with exact_hits, semantic_hits, misses and hit_rate
+        """
+        with self._stats_lock:
+            stats = dict(self._cache_stats)
+        lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["exact_hits"] + stats["semantic_hits"]) / lookups if lookups else 0.0
+        return stats
+    
+    async def acall_many(self, prompts: List[str], **kwargs) -> List[str]:
+        """
+        Run acall() for several prompts concurrently on the running event loop.
+        
+        In-flight requests are bounded by the provider's AdaptiveLimiter, and
+        each prompt is retried independently.
+        
+        Args:
+            prompts: User prompts/messages
+            **kwargs: Arguments shared by every call (system_prompt, temperature, ...)
+            
+        Returns:
+            Response texts in the same order as prompts
+        """
+        return list(await asyncio.gather(*(self.acall(prompt, **kwargs) for prompt in prompts)))
     
     def _call_gemini(
         self, prompt: str, system_prompt: Optional[str],
-        temperature: float, max_tokens: int
+        temperature: float, max_tokens: int, prefix: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None
     ) -> str:
         """Call Gemini API."""
-        # Gemini doesn't have separate system prompt, prepend to user prompt
-        full_prompt = prompt
-        if system_prompt:
-            full_prompt = f"{system_prompt}\n\n{prompt}"
-        
         response = self.client.generate_content(
-            full_prompt,
-            generation_config=genai.GenerationConfig(
-                temperature=temperature,
-                max_output_tokens=max_tokens,
-            )
+            **self._gemini_request(prompt, system_prompt, temperature, max_tokens, prefix, schema)
+        )
+        return response.text
+    
+    async def _acall_gemini(
+        self, prompt: str, system_prompt: Optional[str],
+        temperature: float, max_tokens: int, prefix: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Call Gemini API asynchronously."""
+        response = await self._get_async_client().generate_content_async(
+            **self._gemini_request(prompt, system_prompt, temperature, max_tokens, prefix, schema)
         )
         return response.text
     
+    def _gemini_request(
+        self, prompt: str, system_prompt: Optional[str],
+        temperature: float, max_tokens: int, prefix: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Build generate_content kwargs."""
+        # Gemini doesn't have separate system prompt, prepend to user prompt
+        full_prompt = f"{prefix}{prompt}" if prefix else prompt
+        if system_prompt:
+            full_prompt = f"{system_prompt}\n\n{full_prompt}"
+        
+        config_kwargs = {"temperature": temperature, "max_output_tokens": max_tokens}
+        if schema:
+            config_kwargs["response_mime_type"] = "application/json"
+            config_kwargs["response_schema"] = _gemini_schema(schema)
+        
+        return {
+            "contents": full_prompt,
+            "generation_config": genai.GenerationConfig(**config_kwargs)
+        }
+    
     def _call_openai(
         self, prompt: str, system_prompt: Optional[str],
-        temperature: float, max_tokens: int
+        temperature: float, max_tokens: int, prefix: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None
     ) -> str:
         """Call OpenAI API with optional JSON mode."""
+        request_kwargs = self._openai_request(prompt, system_prompt, temperature, max_tokens, prefix, schema)
+        try:
+            response = self.client.chat.completions.create(**request_kwargs)
+        except Exception as e:
+            if not self._json_schema_rejected(e, request_kwargs):
+                raise
+            response = self.client.chat.completions.create(
+                **self._openai_request(prompt, system_prompt, temperature, max_tokens, prefix, schema)
+            )
+        return response.choices[0].message.content
+    
+    async def _acall_openai(
+        self, prompt: str, system_prompt: Optional[str],
+        temperature: float, max_tokens: int, prefix: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Call OpenAI API asynchronously."""
+        client = self._get_async_client()
+        request_kwargs = self._openai_request(prompt, system_prompt, temperature, max_tokens, prefix, schema)
+        try:
+            response = await client.chat.completions.create(**request_kwargs)
+        except Exception as e:
+            if not self._json_schema_rejected(e, request_kwargs):
+                raise
+            response = await client.chat.completions.create(
+                **self._openai_request(prompt, system_prompt, temperature, max_tokens, prefix, schema)
+            )
+        return response.choices[0].message.content
+    
+    def _json_schema_rejected(self, error: Exception, request_kwargs: Dict[str, Any]) -> bool:
+        """
+        Check whether a request failed only because the model rejects json_schema.
+        
+        If so, the model is remembered and later requests (including the
+        immediate retry) fall back to plain JSON mode.
+        """
+        if not _rejects_json_schema(error, request_kwargs):
+            return False
+        if self.model not in _JSON_SCHEMA_REJECTED:
+            _JSON_SCHEMA_REJECTED.add(self.model)
+            print(f"  ⚠️  {self.model} rejected structured outputs; using JSON mode instead")
+        return True
+    
+    def _openai_request(
+        self, prompt: str, system_prompt: Optional[str],
+        temperature: float, max_tokens: int, prefix: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Build chat.completions.create kwargs."""
         messages = []
         if system_prompt:
             messages.append({"role": "system", "content": system_prompt})
-        messages.append({"role": "user", "content": prompt})
+        # OpenAI caches shared prefixes automatically; keep the static part first
+        messages.append({"role": "user", "content": f"{prefix}{prompt}" if prefix else prompt})
         
         # Build request kwargs
         request_kwargs = {
@@ -161,18 +957,45 @@ class LLMClient:
             "max_tokens": max_tokens
         }
         
-        # Enable JSON mode if requested and supported
-        if self.json_mode:
+        # Structured output takes precedence over plain JSON mode, on models that support it
+        if schema and self.model not in _JSON_SCHEMA_REJECTED and self.config.supports_json_schema(self.model):
+            request_kwargs["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": schema.get("title", "response"), "schema": schema, "strict": True}
+            }
+        elif self.json_mode:
             request_kwargs["response_format"] = {"type": "json_object"}
         
-        response = self.client.chat.completions.create(**request_kwargs)
-        return response.choices[0].message.content
+        return request_kwargs
     
     def _call_anthropic(
         self, prompt: str, system_prompt: Optional[str],
-        temperature: float, max_tokens: int
+        temperature: float, max_tokens: int, prefix: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None
     ) -> str:
         """Call Anthropic API."""
+        response = self.client.messages.create(
+            **self._anthropic_request(prompt, system_prompt, temperature, max_tokens, prefix, schema)
+        )
+        return self._anthropic_text(response)
+    
+    async def _acall_anthropic(
+        self, prompt: str, system_prompt: Optional[str],
+        temperature: float, max_tokens: int, prefix: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Call Anthropic API asynchronously."""
+        response = await self._get_async_client().messages.create(
+            **self._anthropic_request(prompt, system_prompt, temperature, max_tokens, prefix, schema)
+        )
+        return self._anthropic_text(response)
+    
+    def _anthropic_request(
+        self, prompt: str, system_prompt: Optional[str],
+        temperature: float, max_tokens: int, prefix: Optional[str] = None,
+        schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Build messages.create kwargs."""
         request_kwargs = {
             "model": self.model,
             "max_tokens": max_tokens,
@@ -180,11 +1003,92 @@ class LLMClient:
             "messages": [{"role": "user", "content": prompt}]
         }
         
+        # Mark the static prefix as a cache breakpoint
+        if prefix:
+            request_kwargs["messages"][0]["content"] = [
+                {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": prompt}
+            ]
+        
         # Anthropic supports system parameter
         if system_prompt:
             request_kwargs["system"] = system_prompt
         
-        response = self.client.messages.create(**request_kwargs)
+        # Structured output via a single forced tool call
+        if schema:
+            tool_name = schema.get("title", "record_response")
+            request_kwargs["tools"] = [{
+                "name": tool_name,
+                "description": "Record the structured response.",
+                "input_schema": schema
+            }]
+            request_kwargs["tool_choice"] = {"type": "tool", "name": tool_name}
+        
+        return request_kwargs
+    
+    def stream(
+        self,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        cacheable_prefix: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        Stream response text as it is generated.
+        
+        Not retried: a failure mid-stream cannot be replayed transparently.
+        Closing the generator early closes the underlying HTTP response.
+        
+        Args:
+            prompt: User prompt/message
+            system_prompt: System instruction (prepended for Gemini)
+            temperature: Override config temperature
+            max_tokens: Override config max_tokens
+            cacheable_prefix: Static text placed before prompt
+            
+        Yields:
+            Response text chunks
+        """
+        temp = temperature if temperature is not None else self.config.temperature
+        tokens = max_tokens if max_tokens is not None else self.config.max_tokens
+        
+        rate_limiter = _get_rate_limiter(self.api_type, self.config)
+        if rate_limiter:
+            rate_limiter.acquire()
+        token_limiter = _get_token_limiter(self.api_type, self.model, self.config)
+        if token_limiter:
+            token_limiter.acquire(self._estimate_tokens(prompt, system_prompt, cacheable_prefix, tokens))
+        
+        if self.api_type == "gemini":
+            response = self.client.generate_content(
+                **self._gemini_request(prompt, system_prompt, temp, tokens, cacheable_prefix),
+                stream=True
+            )
+            for chunk in response:
+                yield chunk.text
+        elif self.api_type == "openai":
+            response = self.client.chat.completions.create(
+                **self._openai_request(prompt, system_prompt, temp, tokens, cacheable_prefix),
+                stream=True
+            )
+            try:
+                for chunk in response:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+            finally:
+                response.close()
+        elif self.api_type == "anthropic":
+            request_kwargs = self._anthropic_request(prompt, system_prompt, temp, tokens, cacheable_prefix)
+            with self.client.messages.stream(**request_kwargs) as response:
+                yield from response.text_stream
+    
+    @staticmethod
+    def _anthropic_text(response) -> str:
+        """Extract response text, serializing forced tool input as JSON."""
+        for block in response.content:
+            if block.type == "tool_use":
+                return json_dumps(block.input)
         return response.content[0].text
     
     @staticmethod
@@ -200,14 +1104,12 @@ class LLMClient:
             Cleaned JSON string
         """
         json_text = response_text.strip()
+        if not json_text.startswith(_FENCE):
+            return json_text
         
-        # Remove markdown code blocks if present
-        if json_text.startswith("```"):
-            json_text = re.sub(r'^```json\s*', '', json_text)
-            json_text = re.sub(r'^```\s*', '', json_text)
-            json_text = re.sub(r'```\s*$', '', json_text)
-        
-        return json_text.strip()
+        # Remove markdown code blocks (the closing fence may be cut off)
+        json_text = json_text[len(_FENCE):].removeprefix("json")
+        return json_text.removesuffix(_FENCE).strip()
     
     @staticmethod
     def parse_json_response(response_text: str) -> Dict[str, Any]:
@@ -221,17 +1123,102 @@ class LLMClient:
             Parsed JSON dict
             
         Raises:
-            json.JSONDecodeError: If parsing fails
+            json.JSONDecodeError: If parsing fails (and json_repair cannot recover it)
         """
         cleaned = LLMClient.clean_json_response(response_text)
         try:
-            return json.loads(cleaned)
+            return _json_loads(cleaned)
         except json.JSONDecodeError as e:
+            # Stray text around the object: decode from the first brace, ignore the rest
+            start = cleaned.find("{")
+            if start >= 0:
+                try:
+                    data, _ = _JSON_DECODER.raw_decode(cleaned, start)
+                    if isinstance(data, dict):
+                        return data
+                except json.JSONDecodeError:
+                    pass
+            if json_repair is not None:
+                repaired = json_repair.loads(cleaned)
+                if isinstance(repaired, dict) and repaired:
+                    print(f"  ⚠️  Repaired malformed JSON response: {e}")
+                    return repaired
             print(f"❌ Failed to parse JSON: {e}")
             print(f"   Response preview: {cleaned[:200]}...")
             raise
 
 
+class JSONArrayStreamParser:
+    """
+    Incrementally extracts elements of top-level JSON arrays from streamed text.
+    
+    Feed response chunks as they arrive; each call returns the array elements
+    (e.g. each entry of "characters") whose closing brace has been seen.
+    Only object elements of the named top-level keys are emitted.
+    """
+    
+    def __init__(self, keys: Iterable[str]):
+        """
+        Args:
+            keys: Top-level keys whose array elements should be emitted
+        """
+        self.keys = set(keys)
+        self._text = ""
+        self._pos = 0  # Characters of _text already scanned
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string = None
+        self._current_key = None
+        self._item_start = None
+    
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Consume a chunk of response text.
+        
+        Returns:
+            (key, parsed_element) pairs completed by this chunk
+        """
+        self._text += chunk
+        items = []
+        text = self._text
+        
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = text[self._string_start:i]
+                continue
+            
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i + 1
+            elif ch == ':' and self._depth == 1:
+                self._current_key = self._last_string
+            elif ch in "{[":
+                self._depth += 1
+                if self._depth == 3 and ch == "{" and self._current_key in self.keys:
+                    self._item_start = i
+            elif ch in "}]":
+                if self._depth == 3 and ch == "}" and self._item_start is not None:
+                    try:
+                        items.append((self._current_key, _json_loads(text[self._item_start:i + 1])))
+                    except json.JSONDecodeError:
+                        pass  # Malformed element; the final full parse will surface it
+                    self._item_start = None
+                self._depth -= 1
+        
+        self._pos = len(text)
+        return items
+
+
 # Convenience function for quick usage
 def get_llm_client(model: Optional[str] = None, json_mode: bool = False) -> LLMClient:
     """
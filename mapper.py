@@ -3,21 +3,138 @@ World Mapping Engine - Phase 2
 Maps source elements to target genre systematically.
 """
 
+import asyncio
 import json
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-from typing import Optional
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
-from config import GENRE_TEMPLATES
+import numpy as np
+
+from cache import DiskCache, SemanticCache, cache_key, json_dumps
+from config import DEFAULT_CONFIG, GENRE_TEMPLATES
 from models import SourceAnalysis, WorldMapping, ElementMapping
-from llm_client import LLMClient
+from llm_client import JSONArrayStreamParser, LLMClient, object_schema
+
+
+MAPPING_SYSTEM_PROMPT = "You are a creative world-building expert. Always respond with valid JSON."
+
+# Part of the mapping cache key; bump when the mapping prompt changes meaningfully
+PROMPT_VERSION = "4"
+
+# Output cap per category request; the response is a single short JSON array
+MAPPING_MAX_TOKENS = 1200
+
+
+def _text(description: str) -> dict:
+    return {"type": "string", "description": description}
+
+
+def _text_list(description: str) -> dict:
+    return {"type": "array", "items": {"type": "string"}, "description": description}
+
+
+# Mapped categories (each requested separately) and the fields of one element
+MAPPING_CATEGORIES = {
+    "characters": {
+        "source_name": _text("original name"),
+        "target_name": _text("new name"),
+        "target_role": _text("role in target world"),
+        "target_description": _text("brief description fitting genre"),
+        "preserved_traits": _text_list("traits carried over from the source"),
+        "narrative_function": _text("what role they serve")
+    },
+    "locations": {
+        "source": _text("original location"),
+        "target": _text("new location"),
+        "description": _text("how it looks in target world"),
+        "narrative_function": _text("why this place matters")
+    },
+    "objects": {
+        "source": _text("original object"),
+        "target": _text("new object"),
+        "symbolic_meaning": _text("what it represents"),
+        "narrative_function": _text("how it's used in story")
+    },
+    "concepts": {
+        "source": _text("original concept (e.g., family honor)"),
+        "target": _text("new concept (e.g., corporate reputation)"),
+        "how_manifests": _text("how this concept appears in target world")
+    },
+}
+
+# Provider structured-output schema per category: {"<category>": [element, ...]}
+MAPPING_RESPONSE_SCHEMAS = {
+    category: {
+        "title": f"record_{category}",
+        **object_schema({category: {"type": "array", "items": object_schema(fields)}})
+    }
+    for category, fields in MAPPING_CATEGORIES.items()
+}
+
+# Sent with an unparseable category response; cheaper than re-running the mapping
+JSON_REPAIR_PROMPT = """The following response was meant to be a JSON object with a "{category}" array,
+but it is not valid JSON. Return the same content as valid JSON. Do not add, drop or
+change any elements.
+
+{response}"""
+
+# Instructions that follow the source narrative in every mapping prompt
+MAPPING_TASK = """
+=== MAPPING TASK ===
+
+For each element in the source, create a target equivalent that:
+1. Preserves narrative function (a weapon stays a weapon)
+2. Maintains symbolic meaning
+3. Fits the target genre's logic and aesthetics
+4. Uses appropriate naming conventions
+5. Respects the world rules
+"""
+
+
+@lru_cache(maxsize=None)
+def _render_genre_block(genre_template) -> str:
+    """Render the target-genre section of the mapping prompt (once per genre)."""
+    return f"""You are a world-building expert specializing in narrative adaptation. 
+Your task is to map elements from a source story to a {genre_template.name} setting.
+
+=== TARGET GENRE: {genre_template.name.upper()} ===
+
+GENRE CHARACTERISTICS:
+- Tone: {genre_template.tone}
+- Technology Level: {genre_template.technology_level}
+- Key Aesthetics: {', '.join(genre_template.key_aesthetics)}
+- Naming Conventions: {', '.join(genre_template.naming_conventions)}
+
+WORLD RULES:
+{chr(10).join(f'- {rule}' for rule in genre_template.world_rules)}
+"""
+
+
+# Minimum cosine similarity between source summaries for reusing a mapping
+MAPPING_SIMILARITY_THRESHOLD = 0.87
 
 
 class WorldMapper:
     """Maps source narrative elements to target genre."""
     
     def __init__(self, model: Optional[str] = None):
-        """Initialize mapper with LLM client."""
-        self.llm = LLMClient(model=model, json_mode=True)
+        """
+        Initialize mapper with LLM client and result cache.
+        
+        Args:
+            model: Model name override (uses the config's mapping model if None)
+        """
+        # Mappings are cached below (exactly and per genre), so the client keeps
+        # no response cache of its own
+        self.llm = LLMClient(
+            model=model or DEFAULT_CONFIG.get_mapping_model(), json_mode=True, cache_responses=False
+        )
+        self.cache = DiskCache("mapping") if self.llm.config.cache_enabled else None
+        self.semantic_enabled = self.llm.config.cache_enabled and self.llm.config.semantic_cache_enabled
+        self._semantic_caches: Dict[str, SemanticCache] = {}
     
     def create_mapping(
         self,
@@ -34,17 +151,17 @@ class WorldMapper:
         Returns:
             WorldMapping with all element translations
         """
-        if target_genre not in GENRE_TEMPLATES:
-            raise ValueError(f"Unknown genre: {target_genre}. Available: {list(GENRE_TEMPLATES.keys())}")
+        genre_template = self._genre_template(target_genre)
         
-        genre_template = GENRE_TEMPLATES[target_genre]
-        print(f"🗺️  Mapping to {genre_template.name}...")
-        
-        # Create mapping prompt
-        prompt = self._create_mapping_prompt(analysis, genre_template)
+        # Serialized once; used for the cache keys and the prompt
+        summary = self._analysis_summary(analysis)
         
-        # Call LLM
-        response_text = self._call_llm(prompt)
+        # Reuse a previous mapping when possible
+        response_text, key, vector = self._lookup_cache(summary, target_genre)
+        if response_text is None:
+            # One concurrent request per category
+            response_text = self._request_mapping(summary, genre_template)
+            self._store_cache(target_genre, key, vector, response_text)
         
         # Parse response
         mapping = self._parse_mapping(response_text, target_genre, genre_template)
@@ -52,10 +169,186 @@ class WorldMapper:
         print(f"✅ Mapping complete: {len(mapping.character_mappings)} characters mapped")
         return mapping
     
-    def _create_mapping_prompt(self, analysis: SourceAnalysis, genre_template) -> str:
-        """Create the mapping prompt."""
+    def iter_mapping(
+        self,
+        analysis: SourceAnalysis,
+        target_genre: str
+    ) -> Iterator[Union[ElementMapping, WorldMapping]]:
+        """
+        Stream the mapping: yield each ElementMapping as soon as it is complete
+        in any of the (concurrently streamed) category responses, then the full
+        WorldMapping last.
+        
+        Args:
+            analysis: SourceAnalysis from analyzer
+            target_genre: Target genre (must be in GENRE_TEMPLATES)
+            
+        Yields:
+            ElementMappings in arrival order, followed by the complete WorldMapping
+        """
+        genre_template = self._genre_template(target_genre)
+        
+        summary = self._analysis_summary(analysis)
+        response_text, key, vector = self._lookup_cache(summary, target_genre)
+        if response_text is not None:
+            mapping = self._parse_mapping(response_text, target_genre, genre_template)
+            yield from mapping.character_mappings
+            yield from mapping.location_mappings
+            yield from mapping.object_mappings
+            yield from mapping.concept_mappings
+            yield mapping
+            return
+        
+        prefix = self._create_mapping_prefix(summary, genre_template)
+        events = queue.Queue()
+        
+        def stream_category(category: str):
+            try:
+                parser = JSONArrayStreamParser((category,))
+                chunks = []
+                for chunk in self.llm.stream(
+                    prompt=self._create_category_prompt(category),
+                    system_prompt=MAPPING_SYSTEM_PROMPT,
+                    cacheable_prefix=prefix,
+                    temperature=0.8,
+                    max_tokens=MAPPING_MAX_TOKENS
+                ):
+                    chunks.append(chunk)
+                    for _, item in parser.feed(chunk):
+                        try:
+                            events.put(("element", self._parse_element(category, item)))
+                        except KeyError:
+                            continue  # Incomplete element; the final parse decides
+                events.put(("done", (category, "".join(chunks))))
+            except Exception as e:
+                events.put(("error", e))
+        
+        responses = {}
+        executor = ThreadPoolExecutor(max_workers=len(MAPPING_CATEGORIES))
+        try:
+            for category in MAPPING_CATEGORIES:
+                executor.submit(stream_category, category)
+            while len(responses) < len(MAPPING_CATEGORIES):
+                kind, payload = events.get()
+                if kind == "element":
+                    yield payload
+                elif kind == "done":
+                    responses[payload[0]] = payload[1]
+                else:
+                    raise payload
+        finally:
+            # Don't block an abandoned stream on the remaining responses
+            executor.shutdown(wait=False)
+        
+        response_text = self._merge_responses([responses[c] for c in MAPPING_CATEGORIES])
+        self._store_cache(target_genre, key, vector, response_text)
+        mapping = self._parse_mapping(response_text, target_genre, genre_template)
+        
+        print(f"✅ Mapping complete: {len(mapping.character_mappings)} characters mapped")
+        yield mapping
+    
+    async def create_mapping_async(
+        self,
+        analysis: SourceAnalysis,
+        target_genre: str
+    ) -> WorldMapping:
+        """
+        Async variant of create_mapping(); the LLM call awaits the provider's
+        async client, and cache/embedding work runs in a worker thread.
+        
+        Args:
+            analysis: SourceAnalysis from analyzer
+            target_genre: Target genre (must be in GENRE_TEMPLATES)
+            
+        Returns:
+            WorldMapping with all element translations
+        """
+        genre_template = self._genre_template(target_genre)
+        
+        summary = self._analysis_summary(analysis)
+        response_text, key, vector = await asyncio.to_thread(self._lookup_cache, summary, target_genre)
+        if response_text is None:
+            response_text = await self._request_mapping_async(summary, genre_template)
+            await asyncio.to_thread(self._store_cache, target_genre, key, vector, response_text)
+        
+        mapping = self._parse_mapping(response_text, target_genre, genre_template)
+        
+        print(f"✅ Mapping complete: {len(mapping.character_mappings)} characters mapped")
+        return mapping
+    
+    def _genre_template(self, target_genre: str):
+        """Look up the target genre's template, announcing the mapping."""
+        if target_genre not in GENRE_TEMPLATES:
+            raise ValueError(f"Unknown genre: {target_genre}. Available: {list(GENRE_TEMPLATES.keys())}")
+        
+        genre_template = GENRE_TEMPLATES[target_genre]
+        print(f"🗺️  Mapping to {genre_template.name}...")
+        return genre_template
+    
+    def _lookup_cache(
+        self,
+        summary: str,
+        target_genre: str
+    ) -> Tuple[Optional[str], str, Optional[np.ndarray]]:
+        """
+        Check the exact and semantic caches.
         
-        # Serialize analysis for context
+        Args:
+            summary: Serialized analysis (see _analysis_summary)
+            target_genre: Target genre key
+            
+        Returns:
+            (cached response or None, exact cache key, embedding for semantic cache or None)
+        """
+        # Reuse a mapping of the identical source
+        key = cache_key(PROMPT_VERSION, self.llm.api_type, self.llm.model, target_genre, summary)
+        response_text = self.cache.get(key) if self.cache else None
+        if response_text is not None:
+            print("⚡ Loaded cached mapping")
+            return response_text, key, None
+        
+        # Fall back to a near-duplicate source mapped to the same genre
+        semantic_cache = self._semantic_cache(target_genre)
+        vector = semantic_cache.embed(summary) if semantic_cache else None
+        if vector is not None:
+            response_text = semantic_cache.lookup(vector)
+            if response_text is not None:
+                print("⚡ Reused mapping of a similar source")
+        return response_text, key, vector
+    
+    def _store_cache(
+        self,
+        target_genre: str,
+        key: str,
+        vector: Optional[np.ndarray],
+        response_text: str
+    ):
+        """Record a fresh mapping response in the exact and semantic caches."""
+        if self.cache:
+            self.cache.set(key, response_text)
+        if vector is not None:
+            self._semantic_cache(target_genre).add(vector, response_text)
+    
+    def _semantic_cache(self, genre: str) -> Optional[SemanticCache]:
+        """
+        Return the semantic cache for one target genre (None if disabled).
+        
+        Each (prompt version, provider, model, genre) has its own index, so the
+        genre acts as an exact-match filter (a cyberpunk request never gets a
+        space opera mapping) and a PROMPT_VERSION bump retires old-format responses.
+        """
+        if not self.semantic_enabled:
+            return None
+        if genre not in self._semantic_caches:
+            self._semantic_caches[genre] = SemanticCache(
+                f"mapping-semantic/{cache_key(PROMPT_VERSION, self.llm.api_type, self.llm.model, genre)[:16]}",
+                threshold=MAPPING_SIMILARITY_THRESHOLD
+            )
+        return self._semantic_caches[genre]
+    
+    @staticmethod
+    def _analysis_summary(analysis: SourceAnalysis) -> str:
+        """Serialize the analysis fields the mapping is built from."""
         analysis_summary = {
             "characters": [
                 {"name": c.name, "role": c.role, "traits": c.traits}
@@ -65,69 +358,36 @@ class WorldMapper:
             "symbols": analysis.symbols,
             "conflicts": [c.description for c in analysis.conflicts]
         }
-        
-        prompt = f"""You are a world-building expert specializing in narrative adaptation. 
-Your task is to map elements from a source story to a {genre_template.name} setting.
-
-=== TARGET GENRE: {genre_template.name.upper()} ===
-
-GENRE CHARACTERISTICS:
-- Tone: {genre_template.tone}
-- Technology Level: {genre_template.technology_level}
-- Key Aesthetics: {', '.join(genre_template.key_aesthetics)}
-- Naming Conventions: {', '.join(genre_template.naming_conventions)}
-
-WORLD RULES:
-{chr(10).join(f'- {rule}' for rule in genre_template.world_rules)}
-
+        return json_dumps(analysis_summary, indent=True)
+    
+    @staticmethod
+    def _create_mapping_prefix(summary: str, genre_template) -> str:
+        """Create the prompt sections shared by every category request (genre, source, task)."""
+        return f"""{_render_genre_block(genre_template)}
 === SOURCE NARRATIVE ===
-{json.dumps(analysis_summary, indent=2)}
-
-=== MAPPING TASK ===
-
-For each element in the source, create a target equivalent that:
-1. Preserves narrative function (a weapon stays a weapon)
-2. Maintains symbolic meaning
-3. Fits the target genre's logic and aesthetics
-4. Uses appropriate naming conventions
-5. Respects the world rules
+{summary}
+{MAPPING_TASK}"""
+    
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _create_category_prompt(category: str) -> str:
+        """
+        Create the per-category part of the prompt, narrowing the output to one array.
+        
+        Fields are listed by name, with list-valued ones marked. Where the model
+        supports structured output the exact shape is also enforced through
+        MAPPING_RESPONSE_SCHEMAS; other models only get JSON mode (see
+        LLMClient._openai_request) and rely on this list.
+        """
+        fields = "\n".join(
+            f"- {name}{' (list of strings)' if schema['type'] == 'array' else ''}: {schema['description']}"
+            for name, schema in MAPPING_CATEGORIES[category].items()
+        )
+        return f"""
+Map only the source's {category} now.
 
-OUTPUT FORMAT (JSON only, no other text):
-{{
-  "characters": [
-    {{
-      "source_name": "Original Name",
-      "target_name": "New Name",
-      "target_role": "role in target world",
-      "target_description": "brief description fitting genre",
-      "preserved_traits": ["trait1", "trait2"],
-      "narrative_function": "what role they serve"
-    }}
-  ],
-  "locations": [
-    {{
-      "source": "Original Location",
-      "target": "New Location",
-      "description": "how it looks in target world",
-      "narrative_function": "why this place matters"
-    }}
-  ],
-  "objects": [
-    {{
-      "source": "Original Object",
-      "target": "New Object",
-      "symbolic_meaning": "what it represents",
-      "narrative_function": "how it's used in story"
-    }}
-  ],
-  "concepts": [
-    {{
-      "source": "Original Concept (e.g., family honor)",
-      "target": "New Concept (e.g., corporate reputation)",
-      "how_manifests": "how this concept appears in target world"
-    }}
-  ]
-}}
+OUTPUT FORMAT: a JSON object {{"{category}": [...]}} whose elements have these fields:
+{fields}
 
 IMPORTANT:
 - Be creative but internally consistent
@@ -136,16 +396,80 @@ IMPORTANT:
 - Output ONLY valid JSON
 
 Begin mapping:"""
+    
+    def _request_mapping(self, summary: str, genre_template) -> str:
+        """
+        Map all categories with one request each, run concurrently.
         
-        return prompt
+        Returns:
+            Merged JSON response text with one array per category
+        """
+        prefix = self._create_mapping_prefix(summary, genre_template)
+        with ThreadPoolExecutor(max_workers=len(MAPPING_CATEGORIES)) as executor:
+            responses = list(executor.map(
+                lambda category: self._call_llm(category, prefix),
+                MAPPING_CATEGORIES
+            ))
+        return self._merge_responses(responses)
+    
+    async def _request_mapping_async(self, summary: str, genre_template) -> str:
+        """Async counterpart of _request_mapping()."""
+        prefix = self._create_mapping_prefix(summary, genre_template)
+        responses = await asyncio.gather(*(
+            self._call_llm_async(category, prefix)
+            for category in MAPPING_CATEGORIES
+        ))
+        # A malformed response triggers a blocking repair call
+        return await asyncio.to_thread(self._merge_responses, responses)
     
-    def _call_llm(self, prompt: str) -> str:
-        """Call LLM using centralized client with retry logic."""
+    def _merge_responses(self, responses: List[str]) -> str:
+        """Combine per-category responses (in MAPPING_CATEGORIES order) into one JSON object."""
+        merged = {}
+        for category, response_text in zip(MAPPING_CATEGORIES, responses):
+            merged[category] = self._parse_category(category, response_text)
+        return json_dumps(merged)
+    
+    def _parse_category(self, category: str, response_text: str) -> list:
+        """
+        Parse one category response, asking the model to repair it if it is not valid JSON.
+        
+        Returns:
+            The category's array of elements
+        """
+        try:
+            data = LLMClient.parse_json_response(response_text)
+        except json.JSONDecodeError:
+            print(f"  🔧 Repairing malformed {category} response...")
+            repaired = self.llm.call(
+                prompt=JSON_REPAIR_PROMPT.format(category=category, response=response_text),
+                system_prompt=MAPPING_SYSTEM_PROMPT,
+                temperature=0,
+                max_tokens=MAPPING_MAX_TOKENS,
+                response_schema=MAPPING_RESPONSE_SCHEMAS[category]
+            )
+            data = LLMClient.parse_json_response(repaired)
+        return data.get(category, [])
+    
+    def _call_llm(self, category: str, prefix: Optional[str] = None) -> str:
+        """Request one category with retry logic; prefix is provider-cached."""
         return self.llm.call(
-            prompt=prompt,
-            system_prompt="You are a creative world-building expert. Always respond with valid JSON.",
+            prompt=self._create_category_prompt(category),
+            cacheable_prefix=prefix,
+            system_prompt=MAPPING_SYSTEM_PROMPT,
+            temperature=0.8,
+            max_tokens=MAPPING_MAX_TOKENS,
+            response_schema=MAPPING_RESPONSE_SCHEMAS[category]
+        )
+    
+    async def _call_llm_async(self, category: str, prefix: Optional[str] = None) -> str:
+        """Async counterpart of _call_llm()."""
+        return await self.llm.acall(
+            prompt=self._create_category_prompt(category),
+            cacheable_prefix=prefix,
+            system_prompt=MAPPING_SYSTEM_PROMPT,
             temperature=0.8,
-            max_tokens=2000
+            max_tokens=MAPPING_MAX_TOKENS,
+            response_schema=MAPPING_RESPONSE_SCHEMAS[category]
         )
     
     def _parse_mapping(self, response_text: str, genre: str, genre_template) -> WorldMapping:
@@ -153,57 +477,46 @@ Begin mapping:"""
         # Use centralized JSON parsing
         data = LLMClient.parse_json_response(response_text)
         
-        # Parse character mappings
-        char_mappings = []
-        for char in data.get("characters", []):
-            char_mappings.append(ElementMapping(
-                source=char["source_name"],
-                target=char["target_name"],
-                category="character",
-                narrative_function=char.get("narrative_function", ""),
-                symbolic_meaning=None
-            ))
+        mappings = {
+            category: [self._parse_element(category, item) for item in data.get(category, [])]
+            for category in MAPPING_CATEGORIES
+        }
         
-        # Parse location mappings
-        loc_mappings = []
-        for loc in data.get("locations", []):
-            loc_mappings.append(ElementMapping(
-                source=loc["source"],
-                target=loc["target"],
-                category="location",
-                narrative_function=loc.get("narrative_function", ""),
+        return WorldMapping(
+            genre=genre,
+            character_mappings=mappings["characters"],
+            location_mappings=mappings["locations"],
+            object_mappings=mappings["objects"],
+            concept_mappings=mappings["concepts"],
+            world_rules=list(genre_template.world_rules)
+        )
+    
+    @staticmethod
+    def _parse_element(category: str, item: dict) -> ElementMapping:
+        """Parse one element of a category's JSON array into an ElementMapping."""
+        if category == "characters":
+            return ElementMapping(
+                source=item["source_name"],
+                target=item["target_name"],
+                category="character",
+                narrative_function=item.get("narrative_function", ""),
                 symbolic_meaning=None
-            ))
-        
-        # Parse object mappings
-        obj_mappings = []
-        for obj in data.get("objects", []):
-            obj_mappings.append(ElementMapping(
-                source=obj["source"],
-                target=obj["target"],
-                category="object",
-                narrative_function=obj.get("narrative_function", ""),
-                symbolic_meaning=obj.get("symbolic_meaning", None)
-            ))
-        
-        # Parse concept mappings
-        concept_mappings = []
-        for concept in data.get("concepts", []):
-            concept_mappings.append(ElementMapping(
-                source=concept["source"],
-                target=concept["target"],
+            )
+        if category == "concepts":
+            return ElementMapping(
+                source=item["source"],
+                target=item["target"],
                 category="concept",
-                narrative_function=concept.get("how_manifests", ""),
+                narrative_function=item.get("how_manifests", ""),
                 symbolic_meaning=None
-            ))
-        
-        return WorldMapping(
-            genre=genre,
-            character_mappings=char_mappings,
-            location_mappings=loc_mappings,
-            object_mappings=obj_mappings,
-            concept_mappings=concept_mappings,
-            world_rules=genre_template.world_rules
+            )
+        # Locations and objects
+        return ElementMapping(
+            source=item["source"],
+            target=item["target"],
+            category=category[:-1],
+            narrative_function=item.get("narrative_function", ""),
+            symbolic_meaning=item.get("symbolic_meaning", None) if category == "objects" else None
         )
 
 
@@ -4,10 +4,10 @@ Uses dataclasses for simple, type-safe data structures.
 """
 
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Set, Tuple
 
 
-@dataclass
+@dataclass(slots=True)
 class Character:
     """Represents a character in the narrative."""
     name: str
@@ -28,7 +28,7 @@ class Character:
     inventory: List[str] = field(default_factory=list)
 
 
-@dataclass
+@dataclass(slots=True)
 class PlotBeat:
     """Represents a single plot beat from Save the Cat structure."""
     index: int
@@ -39,7 +39,7 @@ class PlotBeat:
     typical_length: int
 
 
-@dataclass
+@dataclass(slots=True)
 class Conflict:
     """Represents a narrative conflict."""
     type: str  # internal, external, interpersonal
@@ -48,7 +48,7 @@ class Conflict:
     resolution: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class SourceAnalysis:
     """Complete analysis of source narrative."""
     title: str
@@ -98,9 +98,24 @@ class SourceAnalysis:
             "tone": self.tone,
             "central_question": self.central_question
         }
+    
+    @classmethod
+    def from_dict(cls, data: dict) -> "SourceAnalysis":
+        """Rebuild from the output of dataclasses.asdict()."""
+        return cls(
+            title=data["title"],
+            characters=[Character(**c) for c in data.get("characters", [])],
+            themes=data.get("themes", []),
+            beats=[PlotBeat(**b) for b in data.get("beats", [])],
+            conflicts=[Conflict(**c) for c in data.get("conflicts", [])],
+            symbols=data.get("symbols", {}),
+            setting=data.get("setting", ""),
+            tone=data.get("tone", ""),
+            central_question=data.get("central_question", "")
+        )
 
 
-@dataclass
+@dataclass(slots=True)
 class ElementMapping:
     """Maps a single element from source to target."""
     source: str
@@ -112,28 +127,51 @@ class ElementMapping:
 
 @dataclass
 class WorldMapping:
-    """Complete mapping from source world to target world."""
+    """
+    Complete mapping from source world to target world.
+    
+    Read-only once built: the mapping lists are stored as tuples and indexed
+    in __post_init__. To change a mapping, build a new one (e.g. with
+    dataclasses.replace) so the index is rebuilt.
+    """
+    # Declared by hand rather than with slots=True so the indexes are slots
+    # but not dataclass fields (they stay out of repr, eq and asdict)
+    __slots__ = (
+        "genre", "character_mappings", "location_mappings", "object_mappings",
+        "concept_mappings", "world_rules", "_index", "_index_by_category",
+    )
+    
     genre: str
-    character_mappings: List[ElementMapping]
-    location_mappings: List[ElementMapping]
-    object_mappings: List[ElementMapping]
-    concept_mappings: List[ElementMapping]
-    world_rules: List[str]
+    character_mappings: Tuple[ElementMapping, ...]
+    location_mappings: Tuple[ElementMapping, ...]
+    object_mappings: Tuple[ElementMapping, ...]
+    concept_mappings: Tuple[ElementMapping, ...]
+    world_rules: Tuple[str, ...]
     
-    def get_target_name(self, source_name: str, category: str = None) -> Optional[str]:
-        """Get target name for a source element."""
-        all_mappings = (
+    def __post_init__(self):
+        """Freeze the lists and index targets by lower-cased source name (first mapping wins, as in a scan)."""
+        self.character_mappings = tuple(self.character_mappings)
+        self.location_mappings = tuple(self.location_mappings)
+        self.object_mappings = tuple(self.object_mappings)
+        self.concept_mappings = tuple(self.concept_mappings)
+        self.world_rules = tuple(self.world_rules)
+        # Lower-cased source name -> target, across all categories and per category
+        self._index = {}
+        self._index_by_category = {}
+        for mapping in (
             self.character_mappings +
             self.location_mappings +
             self.object_mappings +
             self.concept_mappings
-        )
-        
-        for mapping in all_mappings:
-            if mapping.source.lower() == source_name.lower():
-                if category is None or mapping.category == category:
-                    return mapping.target
-        return None
+        ):
+            key = mapping.source.lower()
+            self._index.setdefault(key, mapping.target)
+            self._index_by_category.setdefault(mapping.category, {}).setdefault(key, mapping.target)
+    
+    def get_target_name(self, source_name: str, category: str = None) -> Optional[str]:
+        """Get target name for a source element."""
+        index = self._index if category is None else self._index_by_category.get(category, {})
+        return index.get(source_name.lower())
     
     def to_dict(self) -> dict:
         """Convert to dictionary for serialization."""
@@ -168,11 +206,27 @@ class WorldMapping:
                 }
                 for m in self.concept_mappings
             ],
-            "world_rules": self.world_rules
+            "world_rules": list(self.world_rules)
         }
 
 
-@dataclass
+@dataclass(slots=True)
+class StateUpdate:
+    """Story-state changes reported by one scene."""
+    deaths: List[str] = field(default_factory=list)  # descriptions naming who died
+    location_changes: str = ""  # who moves where; moves the scene's characters to its location
+    item_transfers: str = ""
+    
+    def to_dict(self) -> dict:
+        """Convert to dictionary."""
+        return {
+            "deaths": self.deaths,
+            "location_changes": self.location_changes,
+            "item_transfers": self.item_transfers
+        }
+
+
+@dataclass(slots=True)
 class SceneOutput:
     """Output from scene generation."""
     beat_index: int
@@ -182,7 +236,7 @@ class SceneOutput:
     location: str
     emotional_valence: float  # -1 (negative) to +1 (positive)
     tension_score: float  # NTI value
-    state_updates: Dict[str, any]  # changes to apply to story state
+    state_updates: StateUpdate  # changes to apply to story state
     unresolved_hooks: List[str]  # questions/tensions left open
     
     def to_dict(self) -> dict:
@@ -195,32 +249,39 @@ class SceneOutput:
             "location": self.location,
             "emotional_valence": self.emotional_valence,
             "tension_score": self.tension_score,
-            "state_updates": self.state_updates,
+            "state_updates": self.state_updates.to_dict(),
             "hooks": self.unresolved_hooks
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class StoryState:
     """Tracks the current state of the story during generation."""
     characters: Dict[str, Character]  # name -> Character
     active_conflicts: List[Conflict]
     timeline: List[str]  # major events in order
     current_beat: int
+    # Names of living characters, kept in step by update_character_status
+    _alive: Set[str] = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        """Collect the characters that start out alive."""
+        self._alive = {name for name, char in self.characters.items() if char.status == "alive"}
     
     @classmethod
     def from_analysis(cls, analysis: SourceAnalysis, mapping: WorldMapping):
         """Initialize state from source analysis and world mapping."""
         characters = {}
+        source_characters = {char.name.lower(): char for char in analysis.characters}
         
-        for char in analysis.characters:
-            # Find mapped name
-            target_name = mapping.get_target_name(char.name, "character")
-            if target_name:
-                char.target_name = target_name
+        # Walk the mapped characters directly; pop so the first mapping of a source wins
+        for m in mapping.character_mappings:
+            char = source_characters.pop(m.source.lower(), None)
+            if char:
+                char.target_name = m.target
                 char.status = "alive"
                 char.location = "unknown"
-                characters[target_name] = char
+                characters[m.target] = char
         
         return cls(
             characters=characters,
@@ -233,6 +294,10 @@ class StoryState:
         """Update a character's status."""
         if name in self.characters:
             self.characters[name].status = status
+            if status == "alive":
+                self._alive.add(name)
+            else:
+                self._alive.discard(name)
     
     def update_character_location(self, name: str, location: str):
         """Update a character's location."""
@@ -251,10 +316,7 @@ class StoryState:
     
     def get_alive_characters(self) -> List[str]:
         """Get list of characters still alive."""
-        return [
-            name for name, char in self.characters.items()
-            if char.status == "alive"
-        ]
+        return list(self._alive)
     
     def to_dict(self) -> dict:
         """Convert to dictionary."""
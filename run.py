@@ -6,11 +6,9 @@ Entry point for running transformations from the terminal.
 
 import argparse
 import os
-import json
 import sys
 from pathlib import Path
 
-from transformer import NarrativeTransformer
 from config import GENRE_TEMPLATES
 
 
@@ -59,6 +57,20 @@ Available genres:
         help="Number of story beats to generate (default: 12)"
     )
     
+    parser.add_argument(
+        "--parallel-beats",
+        type=int,
+        default=1,
+        help="Generate this many beats concurrently from the same story state (default: 1, sequential)"
+    )
+    
+    parser.add_argument(
+        "--scenes-per-request",
+        type=int,
+        default=1,
+        help="With --parallel-beats, pack up to this many beats into one LLM request (default: 1)"
+    )
+    
     parser.add_argument(
         "--output",
         default="output.txt",
@@ -77,6 +89,12 @@ Available genres:
         help="Optional: Specify model (e.g., gpt-4, claude-sonnet-4-20250514)"
     )
     
+    parser.add_argument(
+        "--mapping-model",
+        default=None,
+        help="Optional: Model for the world-mapping step (default: a smaller model, see MAPPING_MODEL)"
+    )
+    
     args = parser.parse_args()
     
     # Validate source file exists
@@ -104,18 +122,26 @@ Available genres:
     try:
         print("\n🚀 Starting narrative transformation...\n")
         
-        transformer = NarrativeTransformer(model=args.model)
+        # Imported here so --help and argument errors don't load the pipeline
+        from transformer import NarrativeTransformer
         
-        story, metadata = transformer.transform(
-            source_text=source_text,
-            source_title=args.title,
-            target_genre=args.genre,
-            num_beats=args.beats
-        )
+        transformer = NarrativeTransformer(model=args.model, mapping_model=args.mapping_model)
         
-        # Save output
+        # Write the story scene by scene as it is generated
         with open(args.output, 'w', encoding='utf-8') as f:
-            f.write(story)
+            for item in transformer.transform_iter(
+                source_text=source_text,
+                source_title=args.title,
+                target_genre=args.genre,
+                num_beats=args.beats,
+                parallel_beats=args.parallel_beats,
+                scenes_per_request=args.scenes_per_request
+            ):
+                if isinstance(item, dict):
+                    metadata = item
+                else:
+                    f.write(item)
+                    f.flush()
         
         print(f"✅ Story saved to: {args.output}")
         print(f"   Word count: {metadata['word_count']}")
@@ -126,8 +152,10 @@ Available genres:
             metadata_path = Path(args.metadata)
             metadata_path.parent.mkdir(parents=True, exist_ok=True)
             
+            from cache import json_dumps
+            
             with open(args.metadata, 'w', encoding='utf-8') as f:
-                json.dump(metadata, f, indent=2)
+                f.write(json_dumps(metadata, indent=True))
             
             print(f"📊 Metadata saved to: {args.metadata}")
         
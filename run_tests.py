@@ -2,6 +2,7 @@
 """
 Test script to run 3 different transformations and verify outputs
 """
+import asyncio
 import sys
 import os
 
@@ -43,20 +44,22 @@ tests = [
     }
 ]
 
-results = []
+# Transformations running at once (each is mostly waiting on the LLM API)
+MAX_PARALLEL_TESTS = 3
 
-for i, test in enumerate(tests, 1):
-    print(f"\n{'='*70}")
-    print(f"{test['name']}")
-    print(f"{'='*70}\n")
-    
+
+# One transformer (and one set of LLM clients) shared by every test
+transformer = NarrativeTransformer()
+
+
+def run_test(test: dict) -> dict:
+    """Run one transformation and return its result summary."""
     try:
         # Read source
         with open(test['source_file'], 'r', encoding='utf-8') as f:
             source_text = f.read()
         
         # Transform
-        transformer = NarrativeTransformer()
         story, metadata = transformer.transform(
             source_text=source_text,
             source_title=test['title'],
@@ -77,9 +80,8 @@ for i, test in enumerate(tests, 1):
             "characters": len(metadata.get('character_states', {})),
             "output": test['output_file']
         }
-        results.append(result)
         
-        print(f"\n✅ SUCCESS!")
+        print(f"\n✅ SUCCESS: {test['name']}")
         print(f"   Words: {result['word_count']}")
         print(f"   Avg Tension: {result['avg_tension']:.2f}")
         print(f"   Characters: {result['characters']}")
@@ -94,8 +96,26 @@ for i, test in enumerate(tests, 1):
             "characters": 0,
             "output": None
         }
-        results.append(result)
-        print(f"\n❌ FAILED: {e}")
+        print(f"\n❌ FAILED: {test['name']}: {e}")
+    
+    return result
+
+
+async def run_all(tests: list) -> list:
+    """Run the transformations concurrently, at most MAX_PARALLEL_TESTS at a time."""
+    semaphore = asyncio.Semaphore(MAX_PARALLEL_TESTS)
+    
+    async def run_one(test: dict) -> dict:
+        async with semaphore:
+            print(f"\n{'='*70}")
+            print(f"{test['name']}")
+            print(f"{'='*70}\n")
+            return await asyncio.to_thread(run_test, test)
+    
+    return list(await asyncio.gather(*(run_one(test) for test in tests)))
+
+
+results = asyncio.run(run_all(tests))
 
 # Summary
 print(f"\n{'='*70}")
@@ -4,19 +4,113 @@ YOUR CLEVER DIFFERENTIATOR: Quantitative pacing control
 """
 
 import re
+import string
+from functools import lru_cache
+from itertools import repeat
+
 import numpy as np
-from typing import List, Optional
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from typing import List, Optional, Sequence, Tuple
+from vaderSentiment.vaderSentiment import BOOSTER_DICT, SentimentIntensityAnalyzer, normalize
 
 from config import SAVE_THE_CAT_BEATS
 
+# Uncertainty markers, built once (matched as lower-case substrings)
+# One match per sentence: a run between terminators with any non-space character
+# (the same count as the non-blank parts of re.split(r'[.!?]+', text))
+_SENTENCE_RE = re.compile(r'[^.!?\s][^.!?]*')
+_CONDITIONAL_WORDS = ('if', 'maybe', 'perhaps', 'could', 'might',
+                      'possibly', 'uncertain', 'unclear', 'wonder')
+_INCOMPLETE_MARKERS = ('suddenly', 'before', 'just then', 'interrupted')
+_CLIFFHANGER_ENDINGS = ('?', '...', '…')
+
+
+def _tail_nonspace(text: str, k: int = 3) -> str:
+    """Return the last k characters before any trailing whitespace, without copying the text."""
+    end = len(text)
+    while end and text[end - 1].isspace():
+        end -= 1
+    return text[max(end - k, 0):end]
+
+# Scored texts remembered per analyzer (retries and re-validation rescore the same scene)
+NTI_CACHE_SIZE = 1024
+
+
+class _WindowedVader(SentimentIntensityAnalyzer):
+    """
+    VADER with linear-time negation and idiom checks.
+    
+    vaderSentiment's _negation_check and _special_idioms_check lower-case the
+    whole token list on every call (up to six times per sentiment word), which
+    makes polarity_scores quadratic in scene length. Both only read the tokens
+    from i-3 to i+2, so they are handed that window instead; scores are
+    unchanged. The first three tokens keep the full list, since there the
+    checks index from the end of it.
+    """
+    
+    @staticmethod
+    def _negation_check(valence, words_and_emoticons, start_i, i):
+        if i < 3:
+            return SentimentIntensityAnalyzer._negation_check(valence, words_and_emoticons, start_i, i)
+        return SentimentIntensityAnalyzer._negation_check(valence, words_and_emoticons[i - 3:i + 3], start_i, 3)
+    
+    @staticmethod
+    def _special_idioms_check(valence, words_and_emoticons, i):
+        if i < 3:
+            return SentimentIntensityAnalyzer._special_idioms_check(valence, words_and_emoticons, i)
+        return SentimentIntensityAnalyzer._special_idioms_check(valence, words_and_emoticons[i - 3:i + 3], 3)
+
+
+def _lexicon_compound(text: str, lexicon: dict) -> float:
+    """
+    Approximate VADER's compound score with a lexicon dot product.
+    
+    Sums the lexicon valence of each lower-cased token, shifts words that follow
+    a booster ("very", "barely", ...) by the booster increment in their own
+    direction, and adds VADER's exclamation/question emphasis before the usual
+    normalization. Negation, "but" shifts, capitalization and idioms are ignored.
+    
+    Args:
+        text: Scene text
+        lexicon: VADER word -> valence table
+        
+    Returns:
+        Float from -1 (negative) to +1 (positive)
+    """
+    tokens = [token.strip(string.punctuation) for token in text.lower().split()]
+    if not tokens:
+        return 0.0
+    valence = np.fromiter(map(lexicon.get, tokens, repeat(0.0)), dtype=np.float64, count=len(tokens))
+    boost = np.fromiter(map(BOOSTER_DICT.get, tokens, repeat(0.0)), dtype=np.float64, count=len(tokens))
+    valence[1:] += np.sign(valence[1:]) * boost[:-1]
+    
+    score = float(valence.sum())
+    if score:
+        emphasis = SentimentIntensityAnalyzer._amplify_ep(text) + SentimentIntensityAnalyzer._amplify_qm(text)
+        score += emphasis if score > 0 else -emphasis
+    return round(normalize(score), 4)
+
 
 class TensionAnalyzer:
     """Calculates Narrative Tension Index for scenes."""
     
-    def __init__(self):
-        """Initialize with sentiment analyzer."""
-        self.sentiment_analyzer = SentimentIntensityAnalyzer()
+    # VADER reads its lexicon files on construction; one read-only instance serves all analyzers
+    _shared_vader: Optional[_WindowedVader] = None
+    
+    def __init__(self, fast_vader: bool = False):
+        """
+        Initialize with the shared sentiment analyzer.
+        
+        Args:
+            fast_vader: Score sentiment with the lexicon dot product in
+                _lexicon_compound instead of VADER's full rule set (faster,
+                approximate)
+        """
+        if TensionAnalyzer._shared_vader is None:
+            TensionAnalyzer._shared_vader = _WindowedVader()
+        self.sentiment_analyzer = TensionAnalyzer._shared_vader
+        self.fast_vader = fast_vader
+        # Thread-safe LRU keyed by the text itself
+        self._cached_nti = lru_cache(maxsize=NTI_CACHE_SIZE)(self._compute_nti)
     
     def calculate_nti(self, text: str) -> float:
         """
@@ -28,9 +122,31 @@ class TensionAnalyzer:
         - certainty: 0 (uncertain) to 1 (predictable)
         - sentiment: -1 (negative) to +1 (positive)
         
+        Results are cached, so scoring the same text again is a dict lookup.
+        
         Returns:
             Float between 0.0 (calm) and 2.0+ (extreme tension)
         """
+        return self._cached_nti(text)
+    
+    def calculate_nti_batch(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Calculate the NTI of several texts with this analyzer's shared VADER
+        instance and cache.
+        
+        Args:
+            texts: Scene texts
+            
+        Returns:
+            Array of NTI values, one per text
+        """
+        scores = np.empty(len(texts), dtype=np.float64)
+        for i, text in enumerate(texts):
+            scores[i] = self._cached_nti(text)
+        return scores
+    
+    def _compute_nti(self, text: str) -> float:
+        """Score text without consulting the cache (see calculate_nti)."""
         sentiment = self._calculate_sentiment(text)
         uncertainty = self._estimate_uncertainty(text)
         
@@ -51,6 +167,8 @@ class TensionAnalyzer:
         Returns:
             Float from -1 (negative) to +1 (positive)
         """
+        if self.fast_vader:
+            return _lexicon_compound(text, self.sentiment_analyzer.lexicon)
         scores = self.sentiment_analyzer.polarity_scores(text)
         return scores['compound']
     
@@ -68,21 +186,17 @@ class TensionAnalyzer:
             Float from 0.0 (certain) to 1.0 (uncertain)
         """
         text_lower = text.lower()
-        sentences = re.split(r'[.!?]+', text)
-        sentence_count = max(len([s for s in sentences if s.strip()]), 1)
+        sentence_count = max(len(_SENTENCE_RE.findall(text)), 1)
         
         # Count uncertainty markers
         question_count = text.count('?')
-        conditional_words = ['if', 'maybe', 'perhaps', 'could', 'might', 
-                            'possibly', 'uncertain', 'unclear', 'wonder']
-        conditional_count = sum(text_lower.count(word) for word in conditional_words)
+        conditional_count = sum(map(text_lower.count, _CONDITIONAL_WORDS))
         
         # Check for cliffhangers (ends with question or ellipsis)
-        has_cliffhanger = text.strip().endswith(('?', '...', '…'))
+        has_cliffhanger = _tail_nonspace(text).endswith(_CLIFFHANGER_ENDINGS)
         
         # Check for incomplete actions
-        incomplete_markers = ['suddenly', 'before', 'just then', 'interrupted']
-        incomplete_count = sum(text_lower.count(marker) for marker in incomplete_markers)
+        incomplete_count = sum(map(text_lower.count, _INCOMPLETE_MARKERS))
         
         # Calculate uncertainty score
         uncertainty = (
@@ -95,51 +209,93 @@ class TensionAnalyzer:
         return min(1.0, uncertainty)
 
 
+# Ideal tension level of each Save the Cat beat
+_BEAT_TENSIONS = {
+    "Opening Image": 0.3,
+    "Theme Stated": 0.35,
+    "Setup": 0.4,
+    "Catalyst": 0.7,
+    "Debate": 0.6,
+    "Break into Two": 0.75,
+    "B Story": 0.5,
+    "Fun and Games": 0.6,
+    "Midpoint": 1.5,  # Major spike
+    "Bad Guys Close In": 1.0,
+    "All Is Lost": 1.3,
+    "Dark Night of the Soul": 0.8,  # Brief respite
+    "Break into Three": 1.0,
+    "Finale": 1.8,  # Climax
+    "Final Image": 0.2  # Resolution
+}
+
+
+@lru_cache(maxsize=32)
+def _build_target_curve(num_beats: int) -> np.ndarray:
+    """
+    Generate ideal tension curve based on Save the Cat structure.
+    
+    Cached per beat count and shared by every PacingController, so the
+    array is returned read-only.
+    
+    Args:
+        num_beats: Number of beats in the story
+        
+    Returns:
+        Array of target NTI values for each beat
+    """
+    curve = []
+    for i in range(num_beats):
+        if i < len(SAVE_THE_CAT_BEATS):
+            beat_name = SAVE_THE_CAT_BEATS[i]["name"]
+            curve.append(_BEAT_TENSIONS.get(beat_name, 0.5))
+        else:
+            # For extra beats, interpolate
+            curve.append(0.5)
+    
+    target_curve = np.asarray(curve, dtype=np.float64)
+    target_curve.flags.writeable = False
+    return target_curve
+
+
 class PacingController:
     """Controls story pacing using NTI feedback."""
     
     def __init__(self, num_beats: int = 15):
         """Initialize with target beat count."""
         self.num_beats = num_beats
-        self.tension_history = []
-        self.target_curve = self._generate_target_curve()
+        # Observed NTIs: preallocated for one per beat, with a write cursor
+        self._history = np.empty(max(num_beats, 1), dtype=np.float64)
+        self._count = 0
+        self.target_curve = _build_target_curve(num_beats)
+    
+    @property
+    def tension_history(self) -> np.ndarray:
+        """Observed NTIs so far, in order (a view; do not modify)."""
+        return self._history[:self._count]
     
-    def _generate_target_curve(self) -> List[float]:
+    def record(self, nti: float):
         """
-        Generate ideal tension curve based on Save the Cat structure.
+        Append an observed NTI without asking for a hint.
         
-        Returns:
-            List of target NTI values for each beat
+        Used for scenes generated in parallel, which share one hint request;
+        the buffer grows if beats are revisited.
         """
-        # Map beats to tension levels
-        beat_tensions = {
-            "Opening Image": 0.3,
-            "Theme Stated": 0.35,
-            "Setup": 0.4,
-            "Catalyst": 0.7,
-            "Debate": 0.6,
-            "Break into Two": 0.75,
-            "B Story": 0.5,
-            "Fun and Games": 0.6,
-            "Midpoint": 1.5,  # Major spike
-            "Bad Guys Close In": 1.0,
-            "All Is Lost": 1.3,
-            "Dark Night of the Soul": 0.8,  # Brief respite
-            "Break into Three": 1.0,
-            "Finale": 1.8,  # Climax
-            "Final Image": 0.2  # Resolution
-        }
-        
-        curve = []
-        for i in range(self.num_beats):
-            if i < len(SAVE_THE_CAT_BEATS):
-                beat_name = SAVE_THE_CAT_BEATS[i]["name"]
-                curve.append(beat_tensions.get(beat_name, 0.5))
-            else:
-                # For extra beats, interpolate
-                curve.append(0.5)
+        if self._count == len(self._history):
+            self._history = np.resize(self._history, 2 * len(self._history))
+        self._history[self._count] = nti
+        self._count += 1
+    
+    def _recent_stats(self) -> Tuple[float, float]:
+        """
+        Mean and (population) variance of the last three NTIs.
         
-        return curve
+        Plain arithmetic on three scalars, in the same order as np.mean/np.var,
+        without converting the history to a new array.
+        """
+        a, b, c = self._history[self._count - 3:self._count].tolist()
+        mean = (a + b + c) / 3
+        variance = ((a - mean) ** 2 + (b - mean) ** 2 + (c - mean) ** 2) / 3
+        return mean, variance
     
     def get_adjustment_hint(
         self,
@@ -163,10 +319,11 @@ class PacingController:
         
         # If we have history, compare
         if actual_nti is not None:
-            self.tension_history.append(actual_nti)
+            self.record(actual_nti)
             
             # Check recent trend
-            recent_avg = np.mean(self.tension_history[-3:]) if len(self.tension_history) >= 3 else actual_nti
+            has_window = self._count >= 3
+            recent_avg, recent_var = self._recent_stats() if has_window else (actual_nti, 0.0)
             
             # Too low tension sustained
             if recent_avg < target_nti - 0.3:
@@ -177,7 +334,7 @@ class PacingController:
                 return "PROVIDE RESPITE: Include moment of reflection, small victory, or emotional connection."
             
             # Tension is flat (boring)
-            elif len(self.tension_history) >= 3 and np.std(self.tension_history[-3:]) < 0.1:
+            elif has_window and recent_var < 0.01:  # std < 0.1, without the sqrt
                 return "ADD VARIETY: Introduce surprising element or shift emotional tone."
         
         # Default guidance based on beat type
@@ -204,7 +361,7 @@ class PacingController:
         
         plot_data = {
             "beats": beats,
-            "target": self.target_curve,
+            "target": self.target_curve.tolist(),
             "actual": actual_history if actual_history else []
         }
         
@@ -245,8 +402,8 @@ if __name__ == "__main__":
     
     print("=== NARRATIVE TENSION INDEX TESTS ===\n")
     
-    for scene_type, text in test_scenes.items():
-        nti = analyzer.calculate_nti(text)
+    ntis = analyzer.calculate_nti_batch(list(test_scenes.values()))
+    for (scene_type, text), nti in zip(test_scenes.items(), ntis.tolist()):
         print(f"{scene_type}")
         print(f"  NTI: {nti}")
         print(f"  Interpretation: ", end="")
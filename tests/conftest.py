@@ -0,0 +1,17 @@
+"""
+Shared pytest setup: import modules from the repository root and give the
+config a dummy API key and a throwaway cache directory (no requests are sent).
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="narrative-transformer-tests-")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# test_system.py is a standalone validation script (python tests/test_system.py)
+collect_ignore = ["test_system.py"]
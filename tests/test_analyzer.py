@@ -0,0 +1,13 @@
+"""Tests for SourceAnalyzer helpers."""
+
+import analyzer
+
+
+def test_parse_pool_is_small_and_shared(monkeypatch):
+    monkeypatch.setattr(analyzer, "_parse_pool", None)
+    pool = analyzer._get_parse_pool()
+    try:
+        assert analyzer._get_parse_pool() is pool
+        assert pool._max_workers <= analyzer.PARSE_POOL_WORKERS
+    finally:
+        pool.shutdown()
@@ -0,0 +1,67 @@
+"""Tests for the on-disk response caches."""
+
+import threading
+
+import numpy as np
+
+from cache import SemanticCache
+from config import DEFAULT_CONFIG
+
+
+def _unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_semantic_lookup_hit_and_miss(tmp_path):
+    cache = SemanticCache("test", threshold=0.9, root=str(tmp_path))
+    cache.add(_unit(1, 0, 0), "first")
+
+    assert cache.lookup(_unit(1, 0.1, 0)) == "first"
+    assert cache.lookup(_unit(0, 1, 0)) is None
+    # Persisted entries are loaded by a new instance
+    assert SemanticCache("test", threshold=0.9, root=str(tmp_path)).lookup(_unit(1, 0, 0)) == "first"
+
+
+def test_semantic_lookup_during_concurrent_adds(tmp_path):
+    cache = SemanticCache("test", threshold=0.5, root=str(tmp_path))
+    errors = []
+    stop = threading.Event()
+
+    def look():
+        while not stop.is_set():
+            try:
+                cache.lookup(_unit(1, 0, 0))
+            except Exception as e:  # Any failure is the bug
+                errors.append(e)
+                return
+
+    reader = threading.Thread(target=look)
+    reader.start()
+    for i in range(200):
+        cache.add(_unit(1, i / 200, 0), i)
+    stop.set()
+    reader.join()
+
+    assert errors == []
+    assert len(cache.vectors) == len(cache.entries) == 200
+
+
+def test_semantic_index_is_per_embedding_model(tmp_path, monkeypatch):
+    SemanticCache("test", root=str(tmp_path)).add(_unit(1, 0, 0), "small model")
+    monkeypatch.setattr(DEFAULT_CONFIG, "embedding_model", "another-model")
+    cache = SemanticCache("test", root=str(tmp_path))
+
+    assert cache.vectors is None
+    assert cache.lookup(_unit(1, 0, 0)) is None
+
+
+def test_semantic_index_of_other_dimension_is_skipped_then_replaced(tmp_path):
+    cache = SemanticCache("test", threshold=0.5, root=str(tmp_path))
+    cache.add(_unit(1, 0, 0), "384-dim stand-in")
+    query = _unit(1, 0, 0, 0)
+
+    assert cache.lookup(query) is None
+    cache.add(query, "768-dim stand-in")
+    assert cache.vectors.shape == (1, 4) and cache.entries == ["768-dim stand-in"]
+    assert cache.lookup(query) == "768-dim stand-in"
@@ -0,0 +1,293 @@
+"""Tests for SceneGenerator response parsing and batched generation."""
+
+import threading
+
+import numpy as np
+import pytest
+
+import generator as generator_module
+
+from config import GENRE_TEMPLATES
+from generator import SceneGenerator, _names_pattern
+from models import Character, PlotBeat, StoryState, WorldMapping
+
+SCENE_TEXT = "Rain hammered the neon. Rom-30 waited in the alley, wondering if Jul-E would come."
+
+
+@pytest.fixture
+def generator():
+    return SceneGenerator()
+
+
+@pytest.fixture
+def beat():
+    return PlotBeat(
+        index=2, name="Setup", function="Establish the world", source_events=["brawl"],
+        target_emotion="tense", typical_length=400
+    )
+
+
+@pytest.fixture
+def state():
+    characters = {
+        name: Character(name=name, role="lead", traits=[], desires=[], fears=[], arc="", target_name=name)
+        for name in ("Rom-30", "Jul-E")
+    }
+    return StoryState(characters=characters, active_conflicts=[], timeline=[], current_beat=0)
+
+
+JSON_METADATA = """
+<metadata>
+{"characters": ["Rom-30", "Jul-E"], "location": "Neo-Verona", "emotion": "negative",
+ "state_changes": {"deaths": [], "location_changes": "Rom-30 moves to the tower"},
+ "hooks": ["Will she come?", "Who is watching?"]}
+</metadata>"""
+
+LEGACY_METADATA = """
+<metadata>
+CHARACTERS: Rom-30, Jul-E
+LOCATION: Neo-Verona
+EMOTION: negative
+STATE_CHANGES: Rom-30 moves to the tower
+HOOKS: Will she come?; Who is watching?
+</metadata>"""
+
+STRING_LIST_METADATA = """
+<metadata>
+{"characters": "Rom-30, Jul-E", "location": "Neo-Verona", "emotion": "negative",
+ "state_changes": {"location_changes": "Rom-30 moves to the tower"},
+ "hooks": "Will she come?; Who is watching?"}
+</metadata>"""
+
+
+@pytest.mark.parametrize("metadata", [JSON_METADATA, LEGACY_METADATA, STRING_LIST_METADATA],
+                         ids=["json", "legacy", "json-strings"])
+def test_parse_scene_output_metadata_formats(generator, beat, state, metadata):
+    scene = generator._parse_scene_output(SCENE_TEXT + "\n" + metadata, beat, state)
+
+    assert scene.text == SCENE_TEXT
+    assert scene.beat_index == 2 and scene.beat_name == "Setup"
+    assert scene.characters_involved == ["Rom-30", "Jul-E"]
+    assert scene.location == "Neo-Verona"
+    assert scene.emotional_valence < 0
+    assert scene.state_updates.location_changes == "Rom-30 moves to the tower"
+    assert scene.state_updates.deaths == []
+    assert scene.unresolved_hooks == ["Will she come?", "Who is watching?"]
+
+
+def test_parse_scene_output_without_metadata(generator, beat, state):
+    scene = generator._parse_scene_output(SCENE_TEXT, beat, state)
+
+    assert scene.text == SCENE_TEXT
+    assert scene.characters_involved == [] and scene.unresolved_hooks == []
+    assert scene.location == "Unknown"
+    assert scene.emotional_valence == 0.0
+
+
+@pytest.mark.parametrize("changes, deaths", [
+    ("deaths: Tybalt", ["deaths: Tybalt"]),
+    ("Mercutio dies, Romeo moves to the square", ["Mercutio dies"]),
+    ("Tybalt died in the duel", ["Tybalt died in the duel"]),
+    ("Paris is killed by Romeo", ["Paris is killed by Romeo"]),
+    ("death of Juliet", ["death of Juliet"]),
+    # Words merely containing a keyword are not deaths
+    ("Romeo studies the deathless poem", []),
+    ("", []),
+])
+def test_parse_state_changes_deaths(generator, changes, deaths):
+    assert generator._parse_state_changes(changes).deaths == deaths
+
+
+def test_legacy_deaths_field_marks_character_dead(generator, beat, state):
+    response = SCENE_TEXT + "\n<metadata>\nSTATE_CHANGES: deaths: Jul-E\n</metadata>"
+    scene = generator._parse_scene_output(response, beat, state)
+    generator.update_story_state(state, scene)
+
+    assert state.characters["Jul-E"].status == "dead"
+    assert state.get_alive_characters() == ["Rom-30"]
+
+
+def _beat(index, name):
+    return PlotBeat(index=index, name=name, function="", source_events=[], target_emotion="", typical_length=300)
+
+
+def _metadata(location):
+    return f'{{"characters": ["Rom-30"], "location": "{location}", "emotion": "neutral", "hooks": []}}'
+
+
+BATCHED_RESPONSE = f"""
+<scene idx=1>
+First scene text.
+</scene>
+<metadata idx=1>
+{_metadata("Tower")}
+</metadata>
+<scene idx="2">
+Second scene text.
+</scene>
+<metadata idx="2">
+{_metadata("Docks")}
+</metadata>
+<scene idx=3>
+Third scene text, without metadata.
+</scene>
+"""
+
+
+def test_split_batched_response():
+    parsed = SceneGenerator._split_batched_response(BATCHED_RESPONSE)
+
+    assert sorted(parsed) == [1, 2, 3]
+    assert parsed[1].startswith("First scene text.\n\n<metadata>")
+    assert '"location": "Docks"' in parsed[2] and parsed[2].endswith("</metadata>")
+    # A scene without its metadata block still gets an (empty) one
+    assert parsed[3] == "Third scene text, without metadata.\n\n<metadata></metadata>"
+
+
+def test_split_batched_response_without_markup():
+    assert SceneGenerator._split_batched_response("Just one untagged scene.") == {}
+
+
+def test_build_batched_prompt_numbers_each_beat(generator, state):
+    beats = [_beat(3, "Catalyst"), _beat(4, "Debate")]
+    prompt = generator._build_batched_prompt(
+        beats, GENRE_TEMPLATES["cyberpunk"], state, ["hint A", "hint B"], "", [300, 500]
+    )
+
+    assert "<beat idx=1>\nBeat: 4/15 - Catalyst" in prompt
+    assert "<beat idx=2>\nBeat: 5/15 - Debate" in prompt
+    assert "PACING DIRECTIVE: hint B" in prompt and "approximately 500 words" in prompt
+    assert "<scene idx=N>" in prompt and "<metadata idx=N>" in prompt
+
+
+@pytest.fixture
+def fake_llm(generator, monkeypatch):
+    """Replace the scene LLM call with canned responses; records each prompt."""
+    calls = []
+
+    def respond(prompt, prefix=None, max_tokens=None):
+        calls.append(prompt)
+        return respond.responses.pop(0)
+
+    monkeypatch.setattr(generator, "_call_llm", respond)
+    respond.calls = calls
+    return respond
+
+
+def test_request_scenes_regenerates_missing_and_ignores_extra(generator, state, fake_llm):
+    beats = [_beat(0, "Opening Image"), _beat(1, "Theme Stated")]
+    # Scene 2 is missing and an unrequested scene 3 is present
+    batched = BATCHED_RESPONSE.replace("idx=\"2\"", "idx=\"9\"")
+    fake_llm.responses = [batched, "Regenerated scene.\n<metadata>" + _metadata("Plaza") + "</metadata>"]
+
+    responses = generator._request_scenes(
+        beats, GENRE_TEMPLATES["cyberpunk"], state, ["a", "b"], "", [300, 300], "prefix"
+    )
+
+    assert len(responses) == 2
+    assert responses[0].startswith("First scene text.")
+    assert responses[1].startswith("Regenerated scene.")
+    # The fallback request is an ordinary single-scene prompt for the missing beat
+    assert len(fake_llm.calls) == 2
+    assert "<beats>" in fake_llm.calls[0] and "<beats>" not in fake_llm.calls[1]
+    assert "Theme Stated" in fake_llm.calls[1]
+
+
+def test_request_scenes_single_beat_skips_batching(generator, state, fake_llm):
+    fake_llm.responses = ["Only scene."]
+    responses = generator._request_scenes(
+        [_beat(0, "Opening Image")], GENRE_TEMPLATES["cyberpunk"], state, ["a"], "", [300], "prefix"
+    )
+
+    assert responses == ["Only scene."]
+    assert "<beats>" not in fake_llm.calls[0]
+
+
+def test_fold_batch_applies_state_in_beat_order(generator, state):
+    beats = [_beat(0, "Opening Image"), _beat(1, "Theme Stated"), _beat(2, "Setup")]
+    scenes = [
+        generator._parse_scene_output(f"Scene {n}.\n<metadata>{_metadata(loc)}</metadata>", beat, state)
+        for n, (beat, loc) in enumerate(zip(beats, ["Tower", "Docks", "Plaza"]))
+    ]
+
+    assert generator._fold_batch(beats, scenes, state) is scenes
+    assert state.timeline == ["Opening Image: Tower", "Theme Stated: Docks", "Setup: Plaza"]
+    assert state.current_beat == 2
+
+
+def test_generate_scenes_batch_folds_in_beat_order_not_arrival_order(generator, state, monkeypatch):
+    beats = [_beat(0, "Opening Image"), _beat(1, "Theme Stated")]
+    second_done = threading.Event()
+
+    def respond(prompt, prefix=None, max_tokens=None):
+        if "Opening Image" in prompt:
+            # The first beat's response arrives last
+            second_done.wait(timeout=5)
+            return f"First.\n<metadata>{_metadata('Tower')}</metadata>"
+        second_done.set()
+        return f"Second.\n<metadata>{_metadata('Docks')}</metadata>"
+
+    monkeypatch.setattr(generator, "_call_llm", respond)
+    mapping = WorldMapping(
+        genre="cyberpunk", character_mappings=[], location_mappings=[],
+        object_mappings=[], concept_mappings=[], world_rules=[]
+    )
+    scenes = generator.generate_scenes_batch(beats, mapping, state, ["a", "b"], "", [300, 300])
+
+    assert [s.text for s in scenes] == ["First.", "Second."]
+    assert state.timeline == ["Opening Image: Tower", "Theme Stated: Docks"]
+
+
+def _stream(generator, monkeypatch, chunks, fail=False):
+    """Make the scene stream yield the given chunks, then optionally fail."""
+    def stream(**kwargs):
+        yield from chunks
+        if fail:
+            raise ConnectionError("stream dropped")
+
+    monkeypatch.setattr(generator.llm, "stream", stream)
+
+
+@pytest.mark.parametrize("chunks", [
+    ["Jul-E walked in. <metadata>{}</metadata>"],
+    ["Rom-30 waited. Jul", "-E walked in.\n<metadata>", '{"hooks": []}</metadata>'],
+])
+def test_stream_aborts_on_dead_name_before_metadata(generator, monkeypatch, chunks):
+    _stream(generator, monkeypatch, chunks)
+    assert generator._stream_llm("prompt", abort_pattern=_names_pattern(("Jul-E",))) is None
+
+
+def test_stream_ignores_dead_name_in_metadata(generator, monkeypatch):
+    _stream(generator, monkeypatch, ["Rom-30 waited.\n<metadata>", '{"deaths": ["Jul-E"]}</metadata>', "extra"])
+    response = generator._stream_llm("prompt", abort_pattern=_names_pattern(("Jul-E",)))
+
+    assert response == 'Rom-30 waited.\n<metadata>{"deaths": ["Jul-E"]}</metadata>'
+
+
+@pytest.mark.parametrize("fallback, expected", [
+    ("Jul-E walked in.\n<metadata></metadata>", None),
+    ("Rom-30 waited.\n<metadata>Jul-E</metadata>", "Rom-30 waited.\n<metadata>Jul-E</metadata>"),
+])
+def test_stream_fallback_is_checked_too(generator, monkeypatch, fake_llm, fallback, expected):
+    _stream(generator, monkeypatch, ["Rom-30 waited.\n<metadata>"], fail=True)
+    fake_llm.responses = [fallback]
+
+    assert generator._stream_llm("prompt", abort_pattern=_names_pattern(("Jul-E",))) == expected
+
+
+def test_embedding_cache_keeps_recently_used_texts(generator, monkeypatch):
+    encoded = []
+
+    class Embedder:
+        def encode(self, texts, normalize_embeddings):
+            encoded.extend(texts)
+            return np.ones((len(texts), 4))
+
+    monkeypatch.setattr(generator_module, "get_embedder", Embedder)
+    monkeypatch.setattr(generator_module, "EMBEDDING_CACHE_SIZE", 2)
+    generator._embed(["a", "b"])
+    generator._embed(["a", "c"])  # "b" is now the least recently used
+
+    assert list(generator._embeddings) == ["a", "c"]
+    assert generator._embed(["a", "b", "a"]).shape == (3, 4)
+    assert encoded == ["a", "b", "c", "b"]
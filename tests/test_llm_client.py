@@ -0,0 +1,231 @@
+"""Tests for LLMClient response caching and request building, and JSONArrayStreamParser."""
+
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import llm_client
+from cache import SemanticCache
+from config import DEFAULT_CONFIG
+from llm_client import JSONArrayStreamParser, LLMClient
+
+
+def _bag_of_words(self, text):
+    """Deterministic stand-in embedder: normalized letter-only word hashes."""
+    vector = np.zeros(64, dtype=np.float32)
+    for word in text.lower().split():
+        word = "".join(ch for ch in word if ch.isalpha())
+        if word:
+            vector[hash(word) % 64] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+@pytest.fixture
+def make_client(tmp_path, monkeypatch):
+    """Build clients with a private cache directory and a fake provider call."""
+    monkeypatch.setattr(DEFAULT_CONFIG, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(DEFAULT_CONFIG, "cache_enabled", True)
+    monkeypatch.setattr(SemanticCache, "embed", _bag_of_words)
+
+    sent = []
+
+    def fake_call(self, prompt, system_prompt, temp, tokens, prefix, schema):
+        sent.append(prompt)
+        return f"response {len(sent)}"
+
+    monkeypatch.setattr(LLMClient, "_call_with_retry", fake_call)
+
+    def factory(semantic=False, **kwargs):
+        monkeypatch.setattr(DEFAULT_CONFIG, "semantic_cache_enabled", semantic)
+        return LLMClient(**kwargs)
+
+    factory.sent = sent
+    return factory
+
+
+def test_exact_hit_skips_provider(make_client):
+    client = make_client(json_mode=True)
+    first = client.call("Analyze this.", system_prompt="sys")
+    second = client.call("Analyze this.", system_prompt="sys")
+
+    assert first == second == "response 1"
+    assert len(make_client.sent) == 1
+    stats = client.stats()
+    assert (stats["exact_hits"], stats["semantic_hits"], stats["misses"]) == (1, 0, 1)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_creative_calls_are_not_cached(make_client):
+    client = make_client()
+    client.call("Write a scene.", temperature=0.7)
+    client.call("Write a scene.", temperature=0.7)
+
+    assert len(make_client.sent) == 2
+    assert client.stats() == {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "hit_rate": 0.0}
+
+
+def test_semantic_hit_on_near_duplicate_prompt(make_client):
+    client = make_client(semantic=True, json_mode=True)
+    client.call("Tell me about the ship.", system_prompt="sys")
+    cached = client.call("tell me about the ship", system_prompt="sys")
+
+    assert cached == "response 1"
+    assert len(make_client.sent) == 1
+    assert client.stats()["semantic_hits"] == 1
+
+
+def test_semantic_ignores_shared_preamble(make_client):
+    # A long fixed prefix must not make different requests look alike
+    preamble = "You are a narrative structure analyst. " * 100
+    client = make_client(semantic=True, json_mode=True)
+    client.call("Source: Romeo and Juliet", system_prompt="sys", cacheable_prefix=preamble)
+    response = client.call("Source: Hamlet, Prince of Denmark", system_prompt="sys", cacheable_prefix=preamble)
+
+    assert response == "response 2"
+    assert client.stats()["misses"] == 2
+
+
+@pytest.mark.parametrize("variant", [
+    {"system_prompt": "other"},
+    {"temperature": 0.0},
+    {"max_tokens": 50},
+    {"response_schema": {"type": "object", "title": "record_other"}},
+])
+def test_semantic_index_is_per_request_shape(make_client, variant):
+    client = make_client(semantic=True, json_mode=True)
+    base = {"system_prompt": "sys", "temperature": 0.7, "max_tokens": 100}
+    client.call("Tell me about the ship.", **base)
+    client.call("tell me about the ship", **{**base, **variant})
+
+    assert len(make_client.sent) == 2
+    assert client.stats()["semantic_hits"] == 0
+
+
+def test_json_mode_selects_semantic_index(make_client):
+    make_client(semantic=True, json_mode=True).call("Tell me about the ship.", temperature=0)
+    plain = make_client(semantic=True, json_mode=False)
+    plain.call("tell me about the ship", temperature=0)
+
+    assert len(make_client.sent) == 2
+    assert plain.stats()["misses"] == 1
+
+
+def test_cache_responses_false_disables_caching(make_client):
+    client = make_client(semantic=True, json_mode=True, cache_responses=False)
+    client.call("Analyze this.")
+    client.call("Analyze this.")
+
+    assert len(make_client.sent) == 2
+    assert client.stats()["hit_rate"] == 0.0
+
+
+def test_acall_uses_the_same_caches(make_client, monkeypatch):
+    async def fake_acall(self, prompt, system_prompt, temp, tokens, prefix, schema):
+        return LLMClient._call_with_retry(self, prompt, system_prompt, temp, tokens, prefix, schema)
+
+    monkeypatch.setattr(LLMClient, "_acall_with_retry", fake_acall)
+    client = make_client(semantic=True, json_mode=True)
+    client.call("Tell me about the ship.")
+
+    assert asyncio.run(client.acall("Tell me about the ship.")) == "response 1"
+    assert asyncio.run(client.acall("tell me about the ship")) == "response 1"
+    assert client.stats()["exact_hits"] == 1 and client.stats()["semantic_hits"] == 1
+
+
+SCHEMA = {"type": "object", "title": "record_analysis", "properties": {}}
+
+
+@pytest.mark.parametrize("model, expected", [
+    ("gpt-4o-mini", "json_schema"),
+    ("gpt-4.1", "json_schema"),
+    ("openai/gpt-4o", "json_schema"),
+    ("gpt-4-turbo-preview", "json_object"),
+    ("gpt-3.5-turbo", "json_object"),
+    ("openai/gpt-3.5-turbo", "json_object"),
+])
+def test_openai_schema_request_matches_model_support(make_client, model, expected):
+    client = make_client(model=model, json_mode=True)
+    request = client._openai_request("Analyze this.", "sys", 0.7, 100, schema=SCHEMA)
+
+    assert request["response_format"]["type"] == expected
+    if expected == "json_schema":
+        assert request["response_format"]["json_schema"]["schema"] is SCHEMA
+
+
+def test_openai_falls_back_to_json_mode_when_schema_rejected(make_client, monkeypatch):
+    class BadRequestError(Exception):
+        status_code = 400
+
+    formats = []
+
+    class Completions:
+        def create(self, **kwargs):
+            formats.append(kwargs["response_format"]["type"])
+            if kwargs["response_format"]["type"] == "json_schema":
+                raise BadRequestError("Invalid parameter: 'response_format' of type 'json_schema' is not supported")
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="{}"))])
+
+    monkeypatch.setattr(llm_client, "_JSON_SCHEMA_REJECTED", set())
+    client = make_client(model="gpt-4o-2024-05-13", json_mode=True)
+    client.client = SimpleNamespace(chat=SimpleNamespace(completions=Completions()))
+
+    assert client._call_openai("Analyze this.", "sys", 0.7, 100, schema=SCHEMA) == "{}"
+    assert client._call_openai("Analyze this.", "sys", 0.7, 100, schema=SCHEMA) == "{}"
+    # The rejection is remembered, so the second call goes straight to JSON mode
+    assert formats == ["json_schema", "json_object", "json_object"]
+
+
+STREAMED_JSON = r'''```json
+{
+  "title": "characters: [{\"fake\": 1}]",
+  "characters": [
+    {"name": "Rom-30", "quote": "a } brace and a { brace", "tags": ["x", "]"]},
+    {"name": "Jul-\"E\"", "path": "C:\\tower\\", "nested": {"deep": [{"a": 1}]}}
+  ],
+  "setting": {"characters": [{"name": "not top-level"}]},
+  "themes": [{"name": "untracked key"}],
+  "beats": ["not an object", {"name": "Catalyst"}]
+}
+```'''
+
+EXPECTED_ITEMS = [
+    ("characters", {"name": "Rom-30", "quote": "a } brace and a { brace", "tags": ["x", "]"]}),
+    ("characters", {"name": 'Jul-"E"', "path": "C:\\tower\\", "nested": {"deep": [{"a": 1}]}}),
+    ("beats", {"name": "Catalyst"}),
+]
+
+
+def _feed_in_chunks(text, size):
+    parser = JSONArrayStreamParser(("characters", "beats"))
+    items = []
+    for start in range(0, len(text), size):
+        items.extend(parser.feed(text[start:start + size]))
+    return items
+
+
+def test_stream_parser_whole_text():
+    assert _feed_in_chunks(STREAMED_JSON, len(STREAMED_JSON)) == EXPECTED_ITEMS
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16])
+def test_stream_parser_chunk_boundaries(size):
+    # Small chunks split inside keys, strings and escape sequences
+    assert _feed_in_chunks(STREAMED_JSON, size) == EXPECTED_ITEMS
+
+
+def test_stream_parser_emits_each_element_once_when_complete():
+    parser = JSONArrayStreamParser(("characters",))
+    assert parser.feed('{"characters": [{"name": "A"}, {"na') == [("characters", {"name": "A"})]
+    assert parser.feed('me": "B\\') == []
+    # The escaped quote does not end the string; the next one does
+    assert parser.feed('"}') == []
+    assert parser.feed('"}') == [("characters", {"name": 'B"}'})]
+    assert parser.feed("]}") == []
+
+
+def test_stream_parser_skips_malformed_element():
+    parser = JSONArrayStreamParser(("characters",))
+    assert parser.feed('{"characters": [{"name": A}, {"name": "B"}]}') == [("characters", {"name": "B"})]
@@ -0,0 +1,69 @@
+"""Tests for WorldMapper requests."""
+
+import pytest
+
+from config import DEFAULT_CONFIG
+from llm_client import LLMClient
+from mapper import MAPPING_CATEGORIES, MAPPING_RESPONSE_SCHEMAS, WorldMapper
+
+
+@pytest.fixture
+def router_config(monkeypatch):
+    """The OpenRouter setup from .env.example: custom base URL, gpt-3.5-turbo."""
+    monkeypatch.setattr(DEFAULT_CONFIG, "openai_base_url", "https://openrouter.ai/api/v1")
+    monkeypatch.setattr(DEFAULT_CONFIG, "default_model", "openai/gpt-3.5-turbo")
+    monkeypatch.setattr(DEFAULT_CONFIG, "mapping_model", "")
+    monkeypatch.setattr(DEFAULT_CONFIG, "gemini_api_key", "")
+
+
+@pytest.mark.parametrize("category", list(MAPPING_CATEGORIES))
+def test_mapping_requests_use_json_mode_without_schema_support(router_config, monkeypatch, category):
+    requests = []
+
+    def capture(self, prompt, system_prompt, temp, tokens, prefix, schema):
+        requests.append(self._openai_request(prompt, system_prompt, temp, tokens, prefix, schema))
+        return "{}"
+
+    monkeypatch.setattr(LLMClient, "_call_with_retry", capture)
+    mapper = WorldMapper()
+    mapper._call_llm(category, prefix="shared prefix")
+
+    assert mapper.llm.model == "openai/gpt-3.5-turbo"
+    assert requests[0]["response_format"] == {"type": "json_object"}
+    # JSON mode needs "JSON" in the messages, and the field list stands in for the schema
+    content = requests[0]["messages"][-1]["content"]
+    assert "JSON" in content
+    assert all(name in content for name in MAPPING_CATEGORIES[category])
+
+
+def test_mapping_requests_use_schema_when_supported(monkeypatch):
+    monkeypatch.setattr(DEFAULT_CONFIG, "openai_base_url", "")
+    monkeypatch.setattr(DEFAULT_CONFIG, "mapping_model", "gpt-4o-mini")
+    mapper = WorldMapper()
+    request = mapper.llm._openai_request(
+        "prompt", None, 0.8, 100, schema=MAPPING_RESPONSE_SCHEMAS["characters"]
+    )
+
+    assert request["response_format"]["type"] == "json_schema"
+    assert request["response_format"]["json_schema"]["name"] == "record_characters"
+
+
+def test_category_prompt_marks_list_fields():
+    prompt = WorldMapper._create_category_prompt("characters")
+
+    assert "- preserved_traits (list of strings):" in prompt
+    assert "- target_name: new name" in prompt
+
+
+def test_semantic_cache_is_per_prompt_version(monkeypatch, tmp_path):
+    import mapper
+
+    monkeypatch.setattr(DEFAULT_CONFIG, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(DEFAULT_CONFIG, "cache_enabled", True)
+    monkeypatch.setattr(DEFAULT_CONFIG, "semantic_cache_enabled", True)
+    current = WorldMapper()._semantic_cache("cyberpunk").directory
+    monkeypatch.setattr(mapper, "PROMPT_VERSION", "old")
+    old = WorldMapper()._semantic_cache("cyberpunk").directory
+
+    assert current != old
+    assert WorldMapper()._semantic_cache("space_opera").directory != old
@@ -0,0 +1,56 @@
+"""Tests for the data models."""
+
+from dataclasses import asdict, replace
+
+import pytest
+
+from models import ElementMapping, WorldMapping
+
+
+@pytest.fixture
+def mapping():
+    return WorldMapping(
+        genre="cyberpunk",
+        character_mappings=[ElementMapping("Romeo", "Rom-30", "character", "hero")],
+        location_mappings=[ElementMapping("Verona", "Neo-Verona", "location", "city")],
+        object_mappings=[ElementMapping("Romeo", "Romeo-brand phone", "object", "prop")],
+        concept_mappings=[],
+        world_rules=["High tech, low life"]
+    )
+
+
+def test_get_target_name(mapping):
+    assert mapping.get_target_name("ROMEO") == "Rom-30"  # Characters win across categories
+    assert mapping.get_target_name("romeo", category="object") == "Romeo-brand phone"
+    assert mapping.get_target_name("Verona", category="character") is None
+    assert mapping.get_target_name("Mantua") is None
+
+
+def test_index_stays_out_of_asdict_repr_and_eq(mapping):
+    data = asdict(mapping)
+
+    assert set(data) == {
+        "genre", "character_mappings", "location_mappings", "object_mappings",
+        "concept_mappings", "world_rules",
+    }
+    assert "_index" not in repr(mapping)
+    assert mapping == replace(mapping)
+
+
+def test_mapping_is_read_only_and_replace_reindexes(mapping):
+    with pytest.raises(AttributeError):
+        mapping.character_mappings.append(ElementMapping("Juliet", "Jul-E", "character", "heroine"))
+
+    updated = replace(
+        mapping,
+        character_mappings=mapping.character_mappings + (ElementMapping("Juliet", "Jul-E", "character", "heroine"),)
+    )
+    assert updated.get_target_name("juliet") == "Jul-E"
+    assert mapping.get_target_name("juliet") is None
+
+
+def test_to_dict_is_json_ready(mapping):
+    data = mapping.to_dict()
+
+    assert data["world_rules"] == ["High tech, low life"]
+    assert data["character_mappings"] == [{"source": "Romeo", "target": "Rom-30", "function": "hero"}]
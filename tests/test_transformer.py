@@ -0,0 +1,47 @@
+"""Tests for the NarrativeTransformer pipeline (LLM-backed steps replaced with fakes)."""
+
+import pytest
+
+from models import SceneOutput, SourceAnalysis, StateUpdate, WorldMapping
+from transformer import NarrativeTransformer
+
+SCORES = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7]
+
+
+@pytest.fixture
+def transformer(monkeypatch):
+    transformer = NarrativeTransformer()
+    analysis = SourceAnalysis(
+        title="Test", characters=[], themes=["love"], beats=[], conflicts=[], symbols={},
+        setting="Verona", tone="tragic", central_question="Can love win?"
+    )
+    mapping = WorldMapping(
+        genre="cyberpunk", character_mappings=[], location_mappings=[],
+        object_mappings=[], concept_mappings=[], world_rules=[]
+    )
+    monkeypatch.setattr(transformer.analyzer, "analyze", lambda text, title: analysis)
+    monkeypatch.setattr(transformer.mapper, "create_mapping", lambda analysis, genre: mapping)
+
+    def scene(beat):
+        return SceneOutput(
+            beat_index=beat.index, beat_name=beat.name, text="A scene.", characters_involved=[],
+            location="Neo-Verona", emotional_valence=0.0, tension_score=SCORES[beat.index],
+            state_updates=StateUpdate(), unresolved_hooks=[]
+        )
+
+    generator = transformer.generator
+    monkeypatch.setattr(generator, "generate_scene", lambda beat_info, **kwargs: scene(beat_info))
+    monkeypatch.setattr(generator, "generate_scenes_batch", lambda beats, **kwargs: [scene(b) for b in beats])
+    return transformer
+
+
+@pytest.mark.parametrize("parallel_beats", [1, 2, 3])
+def test_pacer_sees_every_scene(transformer, parallel_beats):
+    story, metadata = transformer.transform(
+        "Two households...", "Test", "cyberpunk", num_beats=7, parallel_beats=parallel_beats
+    )
+
+    assert metadata["tension_curve"] == SCORES
+    # Every scene before the last window reaches the pacer, in order, whatever the window size
+    last_window_start = (7 - 1) // parallel_beats * parallel_beats
+    assert transformer.pacer.tension_history.tolist() == SCORES[:last_window_start]
@@ -3,7 +3,11 @@ Narrative Transformer - Phase 5
 Main orchestrator that coordinates the full pipeline.
 """
 
-from typing import Tuple, Dict, List, Optional
+from collections import deque
+from typing import Tuple, Dict, Iterator, Optional, Union
+
+import numpy as np
+
 from analyzer import SourceAnalyzer
 from mapper import WorldMapper
 from generator import SceneGenerator
@@ -11,13 +15,23 @@ from tension import PacingController
 from models import StoryState
 
 
+# Closes stories whose last beat is not "Final Image"
+STORY_EPILOGUE = "\n## Epilogue\n\nAnd so our tale concludes, transformed yet timeless.\n"
+
+
 class NarrativeTransformer:
     """Main class that orchestrates narrative transformation."""
     
-    def __init__(self, model: Optional[str] = None):
-        """Initialize all components."""
+    def __init__(self, model: Optional[str] = None, mapping_model: Optional[str] = None):
+        """
+        Initialize all components.
+        
+        Args:
+            model: Model for analysis and scene generation (config default if None)
+            mapping_model: Model for world mapping (config's mapping model if None)
+        """
         self.analyzer = SourceAnalyzer(model)
-        self.mapper = WorldMapper(model)
+        self.mapper = WorldMapper(mapping_model)
         self.generator = SceneGenerator(model)
         self.pacer = None  # Initialized per transformation
     
@@ -26,7 +40,9 @@ class NarrativeTransformer:
         source_text: str,
         source_title: str,
         target_genre: str,
-        num_beats: int = 12
+        num_beats: int = 12,
+        parallel_beats: int = 1,
+        scenes_per_request: int = 1
     ) -> Tuple[str, Dict]:
         """
         Full transformation pipeline.
@@ -36,10 +52,51 @@ class NarrativeTransformer:
             source_title: Title of source work
             target_genre: Target genre (must be in GENRE_TEMPLATES)
             num_beats: Number of story beats to generate
+            parallel_beats: Beats generated concurrently from the same story
+                state (1 = strictly sequential, each beat sees the previous one)
+            scenes_per_request: Within a parallel window, pack up to this many
+                beats into a single LLM request
             
         Returns:
             (final_story_text, transformation_metadata)
         """
+        story_parts = []
+        for item in self.transform_iter(
+            source_text, source_title, target_genre, num_beats, parallel_beats, scenes_per_request
+        ):
+            if isinstance(item, dict):
+                metadata = item
+            else:
+                story_parts.append(item)
+        return "".join(story_parts), metadata
+    
+    def transform_iter(
+        self,
+        source_text: str,
+        source_title: str,
+        target_genre: str,
+        num_beats: int = 12,
+        parallel_beats: int = 1,
+        scenes_per_request: int = 1
+    ) -> Iterator[Union[str, Dict]]:
+        """
+        Run the pipeline, yielding the story piece by piece as scenes complete
+        so callers can write it out without holding the whole text.
+        
+        Args:
+            source_text: Source narrative text
+            source_title: Title of source work
+            target_genre: Target genre (must be in GENRE_TEMPLATES)
+            num_beats: Number of story beats to generate
+            parallel_beats: Beats generated concurrently from the same story
+                state (1 = strictly sequential, each beat sees the previous one)
+            scenes_per_request: Within a parallel window, pack up to this many
+                beats into a single LLM request
+            
+        Yields:
+            Story text pieces in order (title, then each scene), followed by
+            the transformation metadata dict last
+        """
         print(f"\n{'='*60}")
         print(f"NARRATIVE TRANSFORMATION PIPELINE")
         print(f"Source: {source_title}")
@@ -60,13 +117,24 @@ class NarrativeTransformer:
         # STEP 3: Initialize story state and pacing
         print("STEP 3/5: Initializing story state...")
         state = StoryState.from_analysis(analysis, mapping)
-        self.pacer = PacingController(num_beats)
+        # Local reference: a shared transformer may run several transformations at once
+        pacer = self.pacer = PacingController(num_beats)
         print(f"  ✅ {len(state.characters)} characters ready\n")
         
         # STEP 4: Generate scenes beat by beat
         print(f"STEP 4/5: Generating {num_beats} story beats...")
-        scenes = []
-        tension_history = []
+        # Scenes are handed to the caller as soon as they are done; only the
+        # one-line summaries of the last three are kept for the next prompt
+        recent_summaries = deque(maxlen=3)
+        last_scene = None
+        tension_history = np.empty(num_beats, dtype=np.float64)
+        scored = 0
+        paced = 0  # Scores already passed to the pacer
+        tension_sum = 0.0  # Running total for the average
+        
+        opening = self._story_opening(mapping, analysis)
+        word_count = len(opening.split())
+        yield opening
         
         # Use beats from analysis if available, otherwise use num_beats
         beats_to_use = analysis.beats[:num_beats] if len(analysis.beats) >= num_beats else analysis.beats
@@ -86,53 +154,87 @@ class NarrativeTransformer:
                 typical_length=template["typical_length"]
             ))
         
-        for beat_idx in range(num_beats):
-            beat = beats_to_use[beat_idx]
-            beat.index = beat_idx  # Ensure correct index
+        step = max(parallel_beats, 1)
+        for start in range(0, num_beats, step):
+            window = beats_to_use[start:start + step]
+            for offset, beat in enumerate(window):
+                beat.index = start + offset  # Ensure correct index
             
-            # Get pacing hint
-            prev_nti = tension_history[-1] if tension_history else None
-            pacing_hint = self.pacer.get_adjustment_hint(beat_idx, prev_nti)
+            # Give the pacer every scene since the last window; the newest NTI
+            # steers the window's first hint (later beats have no fresh NTI)
+            for nti in tension_history[paced:max(scored - 1, 0)].tolist():
+                pacer.record(nti)
+            paced = scored
+            prev_nti = float(tension_history[scored - 1]) if scored else None
+            pacing_hints = [
+                pacer.get_adjustment_hint(beat.index, prev_nti if offset == 0 else None)
+                for offset, beat in enumerate(window)
+            ]
             
-            # Generate scene
-            scene = self.generator.generate_scene(
-                beat_info=beat,
-                world_mapping=mapping,
-                story_state=state,
-                pacing_hint=pacing_hint,
-                previous_scenes_summary=self._summarize_recent(scenes, n=3),
-                target_length=self._calculate_scene_length(beat_idx, num_beats)
-            )
-            
-            # Validate
-            is_valid, errors = self.generator.validate_scene(scene, state)
-            if not is_valid:
-                print(f"    ⚠️  Validation warnings: {errors}")
-            
-            # Update state
-            state = self.generator.update_story_state(state, scene)
+            if len(window) == 1:
+                beat = window[0]
+                
+                # Generate scene
+                scene = self.generator.generate_scene(
+                    beat_info=beat,
+                    world_mapping=mapping,
+                    story_state=state,
+                    pacing_hint=pacing_hints[0],
+                    previous_scenes_summary="\n\n".join(recent_summaries),
+                    target_length=self._calculate_scene_length(beat.index, num_beats)
+                )
+                
+                # Validate
+                is_valid, errors = self.generator.validate_scene(scene, state)
+                if not is_valid:
+                    print(f"    ⚠️  Validation warnings: {errors}")
+                
+                # Update state
+                state = self.generator.update_story_state(state, scene)
+                new_scenes = [scene]
+            else:
+                # Independent beats: generate concurrently, then validate/update in order
+                new_scenes = self.generator.generate_scenes_batch(
+                    beats=window,
+                    world_mapping=mapping,
+                    story_state=state,
+                    pacing_hints=pacing_hints,
+                    previous_scenes_summary="\n\n".join(recent_summaries),
+                    target_lengths=[self._calculate_scene_length(b.index, num_beats) for b in window],
+                    scenes_per_request=scenes_per_request
+                )
             
             # Track
-            tension_history.append(scene.tension_score)
-            scenes.append(scene)
-            
-            print(f"    ✓ Beat {beat_idx + 1}/{num_beats}: {beat.name} (NTI: {scene.tension_score})")
+            for scene in new_scenes:
+                tension_history[scored] = scene.tension_score
+                scored += 1
+                tension_sum += scene.tension_score
+                recent_summaries.append(self._summarize_scene(scene))
+                last_scene = scene
+                print(f"    ✓ Beat {scene.beat_index + 1}/{num_beats}: {scene.beat_name} (NTI: {scene.tension_score})")
+                
+                section = self._scene_section(scene)
+                word_count += len(section.split())
+                yield section
         
         print("\n")
         
-        # STEP 5: Assemble final story
-        print("STEP 5/5: Assembling final story...")
-        final_story = self._assemble_story(scenes, mapping, analysis)
+        # STEP 5: Finish the story
+        print("STEP 5/5: Finishing story...")
+        # Add epilogue if final beat is not "Final Image"
+        if last_scene and last_scene.beat_name != "Final Image":
+            word_count += len(STORY_EPILOGUE.split())
+            yield STORY_EPILOGUE
         
         # Compile metadata
         metadata = {
             "source_title": source_title,
             "target_genre": target_genre,
             "total_beats": num_beats,
-            "tension_curve": tension_history,
-            "avg_tension": sum(tension_history) / len(tension_history),
+            "tension_curve": tension_history[:scored].tolist(),
+            "avg_tension": tension_sum / scored,
             "character_fates": self._get_character_fates(state),
-            "word_count": len(final_story.split()),
+            "word_count": word_count,
             "world_mapping": mapping.to_dict(),
             "source_analysis": analysis.to_dict()
         }
@@ -140,22 +242,12 @@ class NarrativeTransformer:
         print(f"  ✅ Story complete: {metadata['word_count']} words\n")
         print(f"{'='*60}\n")
         
-        return final_story, metadata
+        yield metadata
     
-    def _summarize_recent(self, scenes: List, n: int = 3) -> str:
-        """Summarize last N scenes for context."""
-        if not scenes:
-            return ""
-        
-        recent = scenes[-n:]
-        summary_parts = []
-        
-        for scene in recent:
-            summary_parts.append(
-                f"{scene.beat_name}: {scene.text[:100]}..."
-            )
-        
-        return "\n\n".join(summary_parts)
+    @staticmethod
+    def _summarize_scene(scene) -> str:
+        """One-line summary of a scene for the next scenes' context."""
+        return f"{scene.beat_name}: {scene.text[:100]}..."
     
     def _calculate_scene_length(self, beat_idx: int, total: int) -> int:
         """
@@ -174,8 +266,8 @@ class NarrativeTransformer:
         
         return int(length)
     
-    def _assemble_story(self, scenes: List, mapping, analysis) -> str:
-        """Assemble final story with title and transitions."""
+    def _story_opening(self, mapping, analysis) -> str:
+        """Title and opening paragraph of the assembled story."""
         
         # Create title
         title = f"{analysis.title}: A {mapping.genre.title()} Reimagining"
@@ -184,29 +276,18 @@ class NarrativeTransformer:
         from config import GENRE_TEMPLATES
         genre_template = GENRE_TEMPLATES[mapping.genre]
         
-        opening = f"""
+        return f"""
 {title}
 {'='*len(title)}
 
 A transformation of the classic tale into a {genre_template.name} setting.
 
 """
-        
-        # Assemble scenes with transitions
-        story_parts = [opening]
-        
-        for i, scene in enumerate(scenes):
-            # Add scene number/title
-            story_parts.append(f"\n## {scene.beat_name}\n")
-            story_parts.append(scene.text)
-            story_parts.append("\n")
-        
-        # Add epilogue if final beat is not "Final Image"
-        if scenes and scenes[-1].beat_name != "Final Image":
-            epilogue = "\n## Epilogue\n\nAnd so our tale concludes, transformed yet timeless.\n"
-            story_parts.append(epilogue)
-        
-        return "".join(story_parts)
+    
+    @staticmethod
+    def _scene_section(scene) -> str:
+        """One scene of the assembled story, under its beat name."""
+        return f"\n## {scene.beat_name}\n{scene.text}\n"
     
     def _get_character_fates(self, state: StoryState) -> Dict[str, str]:
         """Get summary of what happened to each character."""